@@ -0,0 +1,93 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Backfill                                                        #
+#                                                                         #
+# Rebuild history from past revisions of the dump in the git log         #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import subprocess
+
+from copy           import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from typing         import List, Optional, Tuple
+
+import Types
+import Parse
+import Cache
+import History
+
+def list_revisions(repo: str, rel_path: str, since: Optional[str] = None) -> List[Tuple[str, int, str]]:
+    """ (commit, commit time, blob id) of every revision of a file, oldest
+        first.  A revision that leaves the content unchanged is dropped. """
+    args = ['git', 'log', '--format=commit %H %ct', '--raw', '--no-abbrev']
+    if since:
+        args.append(f'--since={since}')
+    args += ['--', rel_path]
+    output = subprocess.check_output(args, cwd=repo).decode()
+
+    revisions = []
+    commit = commit_time = None
+    for line in output.splitlines():
+        if line.startswith('commit '):
+            _, commit, commit_time = line.split()
+        elif line.startswith(':'):
+            # :<old mode> <new mode> <old blob> <new blob> <status>\t<path>
+            fields = line.split('\t')[0].split()
+            if not fields[4].startswith('D'):
+                revisions.append((commit, int(commit_time), fields[3]))
+
+    revisions.reverse()
+
+    return [revision for i, revision in enumerate(revisions) if (i == 0) or (revision[2] != revisions[i - 1][2])]
+
+def parse_revision(repo: str, rel_path: str, blob: str, cache_dir: Optional[str]) -> Types.RunInfo:
+    """ Count one revision of the dump, streamed straight out of the git
+        object store rather than checked out """
+    cache = Cache.ParseCache(cache_dir) if cache_dir else None
+    cached = cache.get(blob) if cache else None
+    if cached is not None:
+        run_info = cached[0]
+    else:
+        run_info = Types.RunInfo()
+        ids = Types.Ids()
+        process = subprocess.Popen(['git', 'cat-file', 'blob', blob], cwd=repo, stdout=subprocess.PIPE)
+        try:
+            with Parse.decompress(process.stdout, rel_path) as stream:
+                Parse.extract_stream_run_info(run_info, stream, ids)
+        finally:
+            process.stdout.close()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, ['git', 'cat-file', 'blob', blob])
+        if cache:
+            cache.put(blob, run_info, ids)
+
+    return run_info
+
+def backfill(repo: str, rel_path: str, history: History.HistoryStore, jobs: int,
+             cache_dir: Optional[str] = None, since: Optional[str] = None) -> int:
+    """ Parse every past revision of the dump concurrently and rebuild
+        history from them in commit order; returns the runs added """
+    revisions = list_revisions(repo, rel_path, since)
+    if not revisions:
+        return 0
+
+    # content that recurs (e.g., after a revert) is only parsed once
+    blobs = list(dict.fromkeys(blob for _, _, blob in revisions))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        parsed = dict(zip(blobs, pool.map(parse_revision, [repo] * len(blobs), [rel_path] * len(blobs), blobs, [cache_dir] * len(blobs))))
+
+    records = []
+    for _, commit_time, blob in revisions:
+        run_info = deepcopy(parsed[blob])
+        run_info.run_date = float(commit_time)
+        records.append((run_info, blob))
+
+    # with 'since', runs history already holds are not added again
+    return history.bulk_load(records, replace=since is None)
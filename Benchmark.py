@@ -0,0 +1,161 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Benchmark                                                       #
+#                                                                         #
+# Timing and peak-memory benchmarks for parse, persist and render         #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+
+from argparse       import ArgumentParser, Namespace
+from dataclasses    import dataclass, asdict
+
+from typing         import Callable, List
+
+import Plot
+import Types
+import Parse
+import Table
+import History
+import Generate
+
+@dataclass
+class Result:
+    name: str
+    seconds: float
+    peak_bytes: int
+
+def measure(name: str, func: Callable, repeat: int = 3) -> Result:
+    """ Best wall time over 'repeat' calls, then one more call under
+        tracemalloc for the peak of Python allocations """
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return Result(name, seconds, peak)
+
+def parse_benchmarks(run_file: str, jobs: int, repeat: int) -> List[Result]:
+    def parse(**kwargs):
+        return lambda: Parse.extract_current_run_info(Types.RunInfo(), run_file, Types.Ids(), **kwargs)
+
+    results = [measure('parse', parse(), repeat),
+               measure('parse (streaming)', parse(streaming=True), repeat),
+               measure('parse (fast)', parse(fast=True), repeat),
+               measure('parse (table)', lambda: Parse.extract_current_run_info(Types.RunInfo(), run_file, Types.Ids(), table=Table.ResultTable()), repeat)]
+    if jobs > 1:
+        # worker processes are not visible to tracemalloc; the peak shown
+        # is the parent's alone
+        results.append(measure(f'parse ({jobs} jobs)', parse(jobs=jobs), repeat))
+    return results
+
+def history_benchmarks(run_file: str, runs: int, repeat: int) -> List[Result]:
+    run_info = Types.RunInfo()
+    Parse.extract_current_run_info(run_info, run_file, Types.Ids())
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        history = History.HistoryStore(os.path.join(temp_dir, 'history.db'))
+
+        def fill():
+            for _ in range(runs):
+                history.append(run_info)
+        results.append(measure(f'history fill ({runs} runs)', fill, 1))
+
+        def append():
+            history.append(run_info)
+            history.trim(runs)
+        results.append(measure('history append + trim', append, repeat))
+        results.append(measure('history window (5 runs)', lambda: history.window(5), repeat))
+
+        history.close()
+    return results
+
+def render_benchmarks(run_file: str, backend: str, repeat: int) -> List[Result]:
+    run_info = Types.RunInfo()
+    Parse.extract_current_run_info(run_info, run_file, Types.Ids())
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.makedirs(os.path.join(temp_dir, 'images'))
+        options = Namespace(repo=temp_dir, maxhistory=5, matplotlib=backend == 'matplotlib', altair=backend == 'altair',
+                            render_jobs=1, force_render=True)
+
+        history = [run_info] * options.maxhistory
+        results.append(measure(f'regenerate_tier_graphs ({backend})', lambda: Plot.regenerate_tier_graphs(options, history), repeat))
+        results.append(measure(f'regenerate_intermittent_graphs ({backend})', lambda: Plot.regenerate_intermittent_graphs(options, run_info), repeat))
+        results.append(measure(f'regenerate_passfail_graphs ({backend})', lambda: Plot.regenerate_passfail_graphs(options, run_info), repeat))
+    return results
+
+def report(results: List[Result]) -> None:
+    width = max(len(result.name) for result in results)
+    for result in results:
+        print(f'{result.name.ljust(width)}  {result.seconds * 1000:10.1f} ms  {result.peak_bytes / (1024 * 1024):10.1f} MiB')
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the cts-tracker hot paths")
+    parser.add_argument("-d", "--dump", metavar="FILE", default=None, type=str, help="Benchmark an existing dump instead of a synthetic one")
+    parser.add_argument("-s", "--scale", metavar="FACTOR", action="append", type=float, help="Synthetic dump scale; may be repeated (default: 1)")
+    parser.add_argument("-p", "--platforms", metavar="COUNT", default=len(Types.PLATFORMS), type=int, help="Platforms in the synthetic dump")
+    parser.add_argument("-i", "--intermittency", metavar="RATE", default=0.05, type=float, help="Intermittency rate of the synthetic dump")
+    parser.add_argument("-j", "--jobs", metavar="COUNT", default=os.cpu_count(), type=int, help="Worker processes for the parallel parse")
+    parser.add_argument("-n", "--runs", metavar="COUNT", default=1000, type=int, help="Runs of history to persist")
+    parser.add_argument("-r", "--repeat", metavar="COUNT", default=3, type=int, help="Timed repetitions; the best is reported")
+    parser.add_argument("-o", "--output", metavar="FILE", default=None, type=str, help="Also write the results as JSON")
+
+    options = parser.parse_args()
+
+    backends = []
+    for name in Plot.BACKENDS:
+        missing = Plot.missing_modules(name)
+        if missing:
+            print(f"render ({name}): skipped, missing {', '.join(missing)}")
+        else:
+            backends.append(name)
+
+    all_results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if options.dump:
+            dumps = {os.path.basename(options.dump): options.dump}
+        else:
+            dumps = {}
+            for scale in options.scale or [1]:
+                run_file = os.path.join(temp_dir, f'dump_{scale:g}x.json')
+                Generate.generate_dump(run_file, scale, options.platforms, options.intermittency)
+                dumps[f'{scale:g}x'] = run_file
+
+        for label, run_file in dumps.items():
+            print(f'\n{label}: {os.stat(run_file).st_size / (1024 * 1024):.1f} MiB')
+
+            results = parse_benchmarks(run_file, options.jobs, options.repeat)
+            results += history_benchmarks(run_file, options.runs, options.repeat)
+            for backend in backends:
+                results += render_benchmarks(run_file, backend, options.repeat)
+
+            report(results)
+            all_results[label] = [asdict(result) for result in results]
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(all_results, f, indent=2)
+
+    sys.exit(0)
@@ -0,0 +1,133 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Cache                                                           #
+#                                                                         #
+# Content digests of run output and a cache of parsed results             #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import os
+import pickle
+import hashlib
+import subprocess
+
+from typing         import Optional, Tuple
+
+import Types
+import Trie
+import Index
+import Table
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cts-tracker')
+
+def blob_id(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ Streamed digest of a file, computed the way git names blobs so
+        it matches the object id of the committed file """
+    digest = hashlib.sha1(f'blob {os.stat(path).st_size}\0'.encode())
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def revision_blob(repo: str, revision: str, rel_path: str) -> Optional[str]:
+    """ Object id of a file as of a commit, without touching the working
+        tree; None if the revision or the file does not exist """
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--verify', '--quiet', f'{revision}:{rel_path}'],
+                                         cwd=repo, stderr=subprocess.DEVNULL)
+        return output.decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def dump_digest(repo: str, run_file: str) -> str:
+    """ Content digest of the run output.  The committed blob id is free to
+        look up, so git is asked first; the file is only hashed if that fails
+        or the working copy has been modified. """
+    rel_path = os.path.relpath(run_file, repo).replace(os.sep, '/')
+    try:
+        subprocess.check_output(['git', 'diff', '--quiet', 'HEAD', '--', rel_path], cwd=repo, stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+        return blob_id(run_file)
+    return revision_blob(repo, 'HEAD', rel_path) or blob_id(run_file)
+
+class ParseCache:
+    """ On-disk map of dump digest -> parsed (RunInfo, Ids), so the same
+        dump content is never parsed twice """
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f'{digest}.pickle')
+
+    def get(self, digest: str) -> Optional[Tuple[Types.RunInfo, Types.Ids]]:
+        """ The parsed results for a digest, if they have been cached """
+        try:
+            with open(self.path(digest), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def put(self, digest: str, run_info: Types.RunInfo, ids: Types.Ids) -> None:
+        """ Remember the parsed results for a digest """
+        file_name = self.path(digest)
+        temp_name = f'{file_name}.{os.getpid()}.tmp'
+        with open(temp_name, 'wb') as f:
+            pickle.dump((run_info, ids), f)
+        os.replace(temp_name, file_name)
+
+    def get_index(self, digest: str) -> Optional[Index.TestIndex]:
+        """ The per-test index for a digest, if it has been cached """
+        try:
+            index = Index.TestIndex.load(os.path.join(self.cache_dir, f'{digest}.index'))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        # indexes cached before they recorded categories are made again
+        return index if hasattr(index, 'categories') else None
+
+    def put_index(self, digest: str, index: Index.TestIndex) -> None:
+        """ Remember the per-test index for a digest """
+        file_name = os.path.join(self.cache_dir, f'{digest}.index')
+        temp_name = f'{file_name}.{os.getpid()}.tmp'
+        index.save(temp_name)
+        os.replace(temp_name, file_name)
+
+    def has_table(self, digest: str) -> bool:
+        return os.path.exists(os.path.join(self.cache_dir, f'{digest}.table'))
+
+    def get_table(self, digest: str) -> Optional[Table.ResultTable]:
+        """ The result table for a digest, if it has been cached """
+        try:
+            return Table.ResultTable.load(os.path.join(self.cache_dir, f'{digest}.table'))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def put_table(self, digest: str, table: Table.ResultTable) -> None:
+        """ Remember the result table for a digest """
+        file_name = os.path.join(self.cache_dir, f'{digest}.table')
+        temp_name = f'{file_name}.{os.getpid()}.tmp'
+        table.save(temp_name)
+        os.replace(temp_name, file_name)
+
+    def get_trie(self, digest: str) -> Optional[Trie.CategoryTrie]:
+        """ The rolled-up category trie for a digest, if it has been cached """
+        try:
+            return Trie.CategoryTrie.load(os.path.join(self.cache_dir, f'{digest}.trie'))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def put_trie(self, digest: str, trie: Trie.CategoryTrie) -> None:
+        """ Remember the rolled-up category trie for a digest """
+        file_name = os.path.join(self.cache_dir, f'{digest}.trie')
+        temp_name = f'{file_name}.{os.getpid()}.tmp'
+        trie.save(temp_name)
+        os.replace(temp_name, file_name)
@@ -0,0 +1,144 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Daemon                                                          #
+#                                                                         #
+# Long-running watch mode that keeps history and backends resident        #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import os
+import sys
+import time
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import traceback
+
+from typing         import Callable, Optional
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# seconds to let a burst of writes (e.g., a checkout) finish before reacting
+SETTLE_TIME = 1.0
+
+# longest wait between cycles while they keep failing (unless the
+# interval itself is longer)
+MAX_BACKOFF = 3600.0
+
+class Watcher:
+    """ Waits for a file to change.  Uses inotify where the platform has
+        it, and falls back to polling the file's stat otherwise. """
+    def __init__(self, path: str, poll_interval: float = 2.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.fd: Optional[int] = None
+        self.stamp = self.stat()
+
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+                fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+                if fd >= 0:
+                    # git replaces files rather than rewriting them, so the
+                    # folder is watched for the name arriving
+                    folder = os.path.dirname(os.path.abspath(path)).encode()
+                    if libc.inotify_add_watch(fd, folder, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) >= 0:
+                        self.fd = fd
+                    else:
+                        os.close(fd)
+            except (OSError, AttributeError):
+                self.fd = None
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def wait(self, timeout: float) -> bool:
+        """ Block until the file changes (True) or 'timeout' seconds pass (False) """
+        deadline = time.monotonic() + timeout
+        name = os.path.basename(self.path).encode()
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            if self.fd is not None:
+                ready, _, _ = select.select([self.fd], [], [], remaining)
+                if not ready:
+                    return False
+                data = os.read(self.fd, 64 * 1024)
+                offset = 0
+                changed = False
+                while offset < len(data):
+                    _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                    event_name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                    changed |= event_name == name
+                    offset += EVENT_HEADER.size + length
+                if changed:
+                    time.sleep(SETTLE_TIME)
+                    self.stamp = self.stat()
+                    return True
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+                stamp = self.stat()
+                if stamp != self.stamp:
+                    time.sleep(SETTLE_TIME)
+                    self.stamp = self.stat()
+                    return True
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def run(run_file: str, interval: float, cycle: Callable[[], Optional[bool]]) -> None:
+    """ Run 'cycle' now, then again whenever the dump changes locally or
+        every 'interval' seconds (when the remote is polled), until
+        interrupted or terminated.  A cycle that raises, or returns False,
+        has failed; the daemon carries on, but backs off before the next
+        one, doubling the wait (up to MAX_BACKOFF) while failures repeat. """
+    # let SIGTERM unwind through the callers' cleanup like Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    watcher = Watcher(run_file)
+    failures = 0
+    try:
+        while True:
+            try:
+                succeeded = cycle() is not False
+            except Exception:
+                traceback.print_exc()
+                succeeded = False
+
+            if succeeded:
+                failures = 0
+                watcher.wait(interval)
+            else:
+                failures += 1
+                delay = min(interval * 2 ** failures, max(interval, MAX_BACKOFF))
+                print(f'Cycle failed ({failures} in a row); retrying in {delay:g} seconds')
+                # a new dump arriving still wakes it early
+                watcher.wait(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
@@ -0,0 +1,181 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Dashboard                                                       #
+#                                                                         #
+# Single-file HTML/Vega-Lite dashboard of the history and latest run      #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import json
+import functools
+import importlib.util
+
+from datetime       import datetime, timezone
+
+from typing         import List, Optional
+
+import Trie
+import Types
+
+DASHBOARD_NAME = 'dashboard.html'
+
+# Vega, Vega-Lite and Vega-Embed are inlined into the page as one script,
+# so it renders offline; vl-convert carries a copy to take it from
+HAVE_VL_CONVERT = importlib.util.find_spec('vl_convert') is not None
+
+# the page only carries data and specs; the browser does all the drawing
+TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script>
+{script}
+</script>
+</head>
+<body>
+<div id="dashboard"></div>
+<script>
+vegaEmbed('#dashboard', {spec}, {{actions: false}});
+</script>
+</body>
+</html>
+"""
+
+def history_rows(history: List[Types.RunInfo]) -> List[dict]:
+    """ Tier totals of every run; as with the PNG chart, platforms do not
+        differ at this level, so only the first is used """
+    rows = []
+    for run in history:
+        date = datetime.fromtimestamp(run.run_date, tz=timezone.utc).isoformat()
+        for tier in Types.TIERS[1:]:
+            rows.append({'date': date, 'tier': tier, 'tests': run.test_tier_count[tier][Types.PLATFORMS[0]]})
+    return rows
+
+def latest_rows(run: Types.RunInfo) -> List[dict]:
+    """ Intermittent and passing counts of the latest run, stacked against
+        the rest of the tier the same way the PNG bar charts are """
+    views = [('Intermittents', run.test_dbg_intermittent_count, run.test_opt_intermittent_count),
+             ('Passing', run.test_dbg_passing_count, run.test_opt_passing_count)]
+
+    rows = []
+    for label, dbg_counts, opt_counts in views:
+        for tier in Types.TIERS[1:]:
+            for platform in run.platforms:
+                total = run.test_tier_count[tier][platform]
+                for build, count in zip(Types.BUILDS, (dbg_counts[tier][platform], opt_counts[tier][platform])):
+                    rows.append({'view': label, 'tier': tier, 'platform': platform, 'build': build, 'type': label, 'tests': count})
+                    rows.append({'view': label, 'tier': tier, 'platform': platform, 'build': build, 'type': 'Total', 'tests': total - count})
+    return rows
+
+def area_rows(trie: Trie.CategoryTrie, count: int) -> List[dict]:
+    """ The areas with the most intermittent and failing results """
+    rows = []
+    for metric in (Trie.INTERMITTENT, Trie.FAILING):
+        for node in trie.top(metric, count):
+            rows.append({'metric': Trie.METRICS[metric], 'area': node.path, 'results': node.totals[metric]})
+    return rows
+
+def dashboard_spec(history: List[Types.RunInfo], trie: Optional[Trie.CategoryTrie] = None, top: int = 10) -> dict:
+    """ One Vega-Lite spec with the tier migration over 'history', and the
+        intermittent and passing views of its latest run behind tier and
+        platform selectors """
+    run = history[-1]
+
+    def build_view(label: str) -> dict:
+        return {
+            'title': label,
+            'data': {'name': 'latest'},
+            'transform': [{'filter': f"datum.view == '{label}' && datum.tier == tier && datum.platform == platform"}],
+            'mark': 'bar',
+            'encoding': {
+                'x': {'field': 'build', 'type': 'nominal', 'title': 'Build Type'},
+                'y': {'field': 'tests', 'type': 'quantitative', 'title': 'Count of Tests'},
+                'color': {'field': 'type', 'type': 'nominal', 'title': 'Result Type'},
+                'order': {'field': 'type', 'sort': 'ascending'},
+                'tooltip': [{'field': 'type'}, {'field': 'tests', 'type': 'quantitative'}],
+            },
+            'width': 250,
+            'height': 250,
+        }
+
+    views = [
+        {
+            'title': 'Tier Migration',
+            'data': {'name': 'history'},
+            'mark': {'type': 'area', 'line': True, 'point': True},
+            'encoding': {
+                'x': {'field': 'date', 'type': 'temporal', 'title': 'Run Date'},
+                'y': {'field': 'tests', 'type': 'quantitative', 'title': 'Count of Tests'},
+                'color': {'field': 'tier', 'type': 'nominal', 'title': 'Tiers'},
+                'tooltip': [{'field': 'date', 'type': 'temporal'}, {'field': 'tier'}, {'field': 'tests', 'type': 'quantitative'}],
+            },
+            'width': 550,
+            'height': 300,
+        },
+        {'hconcat': [build_view('Intermittents'), build_view('Passing')]},
+    ]
+
+    datasets = {'history': history_rows(history), 'latest': latest_rows(run)}
+    params = [
+        {'name': 'tier', 'value': Types.TIERS[-1], 'bind': {'input': 'select', 'options': Types.TIERS[1:], 'name': 'Tier '}},
+        {'name': 'platform', 'value': run.platforms[0], 'bind': {'input': 'select', 'options': run.platforms, 'name': 'Platform '}},
+    ]
+
+    if trie is not None:
+        datasets['areas'] = area_rows(trie, top)
+        params.append({'name': 'metric', 'value': 'intermittent', 'bind': {'input': 'select', 'options': ['intermittent', 'failing'], 'name': 'Areas by '}})
+        views.append({
+            'title': f'Top {top} Areas',
+            'data': {'name': 'areas'},
+            'transform': [{'filter': 'datum.metric == metric'}],
+            'mark': 'bar',
+            'encoding': {
+                'x': {'field': 'results', 'type': 'quantitative', 'title': 'Results'},
+                'y': {'field': 'area', 'type': 'nominal', 'title': 'Category', 'sort': '-x'},
+            },
+            'width': 550,
+        })
+
+    return {
+        '$schema': 'https://vega.github.io/schema/vega-lite/v5.json',
+        'title': 'WebGPU CTS',
+        'params': params,
+        'datasets': datasets,
+        'vconcat': views,
+        # tiers and result types are unrelated color scales
+        'resolve': {'scale': {'color': 'independent'}},
+    }
+
+@functools.lru_cache(maxsize=None)
+def script_bundle() -> str:
+    """ The libraries the page loads, for the Vega-Lite 5 its specs are
+        written against; building it takes seconds, so it is built once """
+    import vl_convert as vlc
+
+    versions = [version for version in vlc.get_vegalite_versions() if version.startswith('5.')]
+    bundle = vlc.javascript_bundle(vl_version=max(versions, key=lambda version: tuple(int(part) for part in version.split('.'))))
+    return bundle.replace('</script', '<\\/script')
+
+def write_dashboard(file_name: str, spec: dict) -> List[str]:
+    """ Write the page, scripts and all; returns it as the file to publish
+        when its content changed """
+    # a '</script>' in the data must not end the script block early
+    page = TEMPLATE.format(title=spec['title'], script=script_bundle(), spec=json.dumps(spec, separators=(',', ':')).replace('</', '<\\/'))
+
+    try:
+        with open(file_name, 'r', encoding='utf-8') as f:
+            if f.read() == page:
+                return []
+    except OSError:
+        pass
+
+    with open(file_name, 'w', encoding='utf-8') as f:
+        f.write(page)
+    return [file_name]
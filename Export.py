@@ -0,0 +1,136 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Export                                                          #
+#                                                                         #
+# Columnar Arrow/Parquet snapshots of the per-test results of each run    #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import os
+import sys
+import importlib.util
+
+from datetime       import datetime, timezone
+
+from typing         import List, Optional
+
+import Types
+import Index
+
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+HAVE_NUMPY = importlib.util.find_spec('numpy') is not None
+
+# snapshots are published with history, in this folder of the repo's
+# data path
+FOLDER_NAME = 'runs'
+
+# Arrow IPC files are written uncompressed so readers can memory-map
+# them; Parquet files are smaller, but are always decoded
+FORMATS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+def run_table(index: Index.TestIndex, run_date: float, digest: str):
+    """ The index of a run as an Arrow table: one row per test or subtest,
+        with its category, tier, disabled state and one column of expected
+        outcomes (e.g., 'FAIL,PASS'; null when none was recorded) for every
+        platform and build """
+    import numpy as np
+    import pyarrow as pa
+
+    builds = len(Types.BUILDS)
+    results = np.frombuffer(index.results, dtype=np.uint16).reshape(len(index.keys), len(index.platforms), builds)
+    outcomes = pa.array([','.join(outcome) for outcome in index.outcomes])
+
+    columns = {
+        'key': pa.array(index.keys, type=pa.string()),
+        'category': pa.DictionaryArray.from_arrays(pa.array(np.frombuffer(index.category_ids, dtype=np.uint32).astype(np.int32)), pa.array(index.categories, type=pa.string())),
+        'subtest': pa.array(np.frombuffer(index.subtests, dtype=np.int8).astype(bool)),
+        'tier': pa.array(np.frombuffer(index.tiers, dtype=np.int8)),
+        'disabled': pa.array(np.frombuffer(index.disabled, dtype=np.int8).astype(bool)),
+    }
+    for platform_id, platform in enumerate(index.platforms):
+        for build, build_name in enumerate(Types.BUILDS):
+            codes = results[:, platform_id, build].astype(np.int16)
+            # outcome 0 is the empty set: nothing was expected
+            columns[f'{platform}_{build_name}'] = pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes == 0), outcomes)
+
+    metadata = {'run_date': str(run_date), 'digest': digest or ''}
+    return pa.table(columns, metadata=metadata)
+
+def snapshot_name(run_date: float, digest: str, file_format: str = 'arrow') -> str:
+    """ Names sort by run date, so the newest snapshots are the last ones """
+    stamp = datetime.fromtimestamp(run_date, tz=timezone.utc).strftime('%Y%m%d-%H%M%S')
+    return f'{stamp}-{(digest or "")[:12]}{FORMATS[file_format]}'
+
+def write_table(table, file_name: str) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    temp_name = f'{file_name}.{os.getpid()}.tmp'
+    if file_name.endswith(FORMATS['parquet']):
+        pq.write_table(table, temp_name)
+    else:
+        with pa.OSFile(temp_name, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    os.replace(temp_name, file_name)
+
+def snapshots(folder: str) -> List[str]:
+    """ The snapshot files of a folder, oldest first """
+    try:
+        names = sorted(name for name in os.listdir(folder) if name.endswith(tuple(FORMATS.values())))
+    except OSError:
+        return []
+    return [os.path.join(folder, name) for name in names]
+
+def export_run(folder: str, index: Index.TestIndex, run_date: float, digest: str, file_format: str = 'arrow', keep: int = 0) -> str:
+    """ Write the snapshot of a run, keeping only the newest 'keep' (if
+        given) in the folder; returns the file written """
+    os.makedirs(folder, exist_ok=True)
+    file_name = os.path.join(folder, snapshot_name(run_date, digest, file_format))
+    write_table(run_table(index, run_date, digest), file_name)
+
+    if keep:
+        for old_file in snapshots(folder)[:-keep]:
+            os.remove(old_file)
+    return file_name
+
+def load_table(file_name: str, columns: Optional[List[str]] = None):
+    """ One snapshot; an Arrow file is memory-mapped, so only the columns
+        that are actually used are ever read from disk """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if file_name.endswith(FORMATS['parquet']):
+        return pq.read_table(file_name, columns=columns, memory_map=True)
+
+    table = pa.ipc.open_file(pa.memory_map(file_name, 'r')).read_all()
+    return table.select(columns) if columns is not None else table
+
+def load_runs(folder: str, count: int, columns: Optional[List[str]] = None) -> list:
+    """ The snapshots of the last 'count' runs, oldest first """
+    return [load_table(file_name, columns) for file_name in snapshots(folder)[-count:]]
+
+if __name__ == "__main__":
+    import time
+
+    if len(sys.argv) != 3:
+        print(f'Usage: {sys.argv[0]} <folder> <count>')
+        sys.exit(1)
+
+    start = time.perf_counter()
+    tables = load_runs(sys.argv[1], int(sys.argv[2]))
+    elapsed = time.perf_counter() - start
+
+    for table in tables:
+        metadata = table.schema.metadata or {}
+        run_date = float(metadata.get(b'run_date', b'0'))
+        print(f'{datetime.fromtimestamp(run_date, tz=timezone.utc):%Y-%m-%d %H:%M}  {table.num_rows:8} rows  {table.num_columns:3} columns')
+    print(f'{len(tables)} runs loaded in {elapsed * 1000:.1f} ms')
+
+    sys.exit(0)
@@ -0,0 +1,276 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Flaky                                                           #
+#                                                                         #
+# Per-test flakiness tracking across runs with rolling bitsets            #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import sys
+import zlib
+import pickle
+import importlib.util
+
+from array          import array
+from dataclasses    import dataclass, field
+
+from typing         import List, Optional, Tuple
+
+import Types
+import Index
+
+# runs remembered per test; bit 0 is the latest run, bit n the run n
+# runs before it
+WINDOW = 32
+MASK = (1 << WINDOW) - 1
+TYPECODE = 'I'
+
+HAVE_NUMPY = importlib.util.find_spec('numpy') is not None
+
+# the history database key the bitsets are kept under
+STATE_NAME = 'flakes'
+
+@dataclass
+class Flake:
+    """ The recent record of one test on one platform and build """
+    key: str
+    platform: str
+    build: str
+    score: float        # flips per consecutive pair of runs, 0 to 1
+    flips: int
+    runs: int
+    streak: int         # consecutive latest runs with the same outcome
+    passing: bool       # the latest outcome
+
+@dataclass
+class FlakeHistory:
+    """ Rolling pass/no-pass bitsets of every test, indexed by the test's
+        position in the sorted key list.  'seen' has one word per test
+        (which runs included it); 'passing' has one word per test, platform
+        and build (which runs expected it to pass).  Disabled tests are
+        treated as absent from a run, and a platform only has results from
+        the runs that included it ('platform_seen'). """
+    keys: List[str] = field(default_factory=list)
+    platforms: List[str] = field(default_factory=list)
+    platform_seen: array = field(default_factory=lambda: array(TYPECODE))
+    seen: array = field(default_factory=lambda: array(TYPECODE))
+    passing: array = field(default_factory=lambda: array(TYPECODE))
+    digest: Optional[str] = None    # the last dump folded in
+
+    @property
+    def cells(self) -> int:
+        return len(self.platforms) * len(Types.BUILDS)
+
+    def add_platform(self, name: str) -> int:
+        """ Column of a platform, widening every row for a new one """
+        if name in self.platforms:
+            return self.platforms.index(name)
+
+        old_cells = self.cells
+        self.platforms.append(name)
+        self.platform_seen.append(0)
+        passing = array(TYPECODE, bytes(self.passing.itemsize * len(self.keys) * self.cells))
+        for row in range(len(self.keys)):
+            passing[row * self.cells:row * self.cells + old_cells] = self.passing[row * old_cells:(row + 1) * old_cells]
+        self.passing = passing
+        return len(self.platforms) - 1
+
+    def update(self, index: Index.TestIndex, digest: Optional[str] = None) -> bool:
+        """ Shift in the results of a new run; a dump already folded in is
+            ignored.  Returns whether the bitsets changed. """
+        if (digest is not None) and (digest == self.digest):
+            return False
+
+        columns = [self.add_platform(name) for name in index.platforms]
+        self.platform_seen = array(TYPECODE, [(seen << 1) & MASK for seen in self.platform_seen])
+        for column in columns:
+            self.platform_seen[column] |= 1
+        passes = {code for code, outcome in enumerate(index.outcomes) if outcome in Index.PASSING}
+
+        if HAVE_NUMPY:
+            self.update_numpy(index, columns, passes)
+        else:
+            self.update_python(index, columns, passes)
+
+        self.digest = digest
+        return True
+
+    def merged_keys(self, shifted_seen, new_keys: List[str]) -> Tuple[List[str], List[int], List[int], List[int]]:
+        """ Keys still in the window after the shift, plus the new run's;
+            returns them with the old rows kept and where old and new rows land """
+        kept = [row for row, seen in enumerate(shifted_seen) if seen]
+        kept_keys = [self.keys[row] for row in kept]
+        if kept_keys == new_keys:
+            # the usual case: the run has the same tests as the last ones
+            rows = list(range(len(kept_keys)))
+            return kept_keys, kept, rows, rows
+
+        keys = sorted(set(kept_keys).union(new_keys))
+        positions = {key: i for i, key in enumerate(keys)}
+        return keys, kept, [positions[key] for key in kept_keys], [positions[key] for key in new_keys]
+
+    def update_numpy(self, index: Index.TestIndex, columns: List[int], passes: set) -> None:
+        import numpy as np
+
+        builds = len(Types.BUILDS)
+        seen = np.frombuffer(self.seen, dtype=np.uint32)
+        passing = np.frombuffer(self.passing, dtype=np.uint32).reshape(len(self.keys), self.cells)
+
+        shifted_seen = (seen << 1) & MASK
+        enabled = np.frombuffer(index.disabled, dtype=np.int8) == 0
+        new_keys = [key for key, flag in zip(index.keys, enabled.tolist()) if flag]
+        keys, kept, old_rows, new_rows = self.merged_keys(shifted_seen.tolist(), new_keys)
+
+        new_seen = np.zeros(len(keys), dtype=np.uint32)
+        new_passing = np.zeros((len(keys), self.cells), dtype=np.uint32)
+        new_seen[old_rows] = shifted_seen[kept]
+        new_passing[old_rows] = (passing[kept] << 1) & MASK
+
+        new_seen[new_rows] |= 1
+        results = np.frombuffer(index.results, dtype=np.uint16).reshape(len(index.keys), len(index.platforms), builds)[enabled]
+        passed = np.isin(results, np.fromiter(passes, dtype=np.uint16, count=len(passes))).astype(np.uint32)
+        for platform_id, column in enumerate(columns):
+            for build in range(builds):
+                new_passing[new_rows, column * builds + build] |= passed[:, platform_id, build]
+
+        self.keys = keys
+        self.seen = array(TYPECODE, new_seen.tobytes())
+        self.passing = array(TYPECODE, new_passing.tobytes())
+
+    def update_python(self, index: Index.TestIndex, columns: List[int], passes: set) -> None:
+        builds = len(Types.BUILDS)
+        cells = self.cells
+
+        shifted_seen = [(seen << 1) & MASK for seen in self.seen]
+        new_keys = [key for key, disabled in zip(index.keys, index.disabled) if not disabled]
+        keys, kept, old_rows, new_rows = self.merged_keys(shifted_seen, new_keys)
+
+        new_seen = array(TYPECODE, bytes(self.seen.itemsize * len(keys)))
+        new_passing = array(TYPECODE, bytes(self.passing.itemsize * len(keys) * cells))
+        for row, position in zip(kept, old_rows):
+            new_seen[position] = shifted_seen[row]
+            new_passing[position * cells:(position + 1) * cells] = array(TYPECODE, [(bits << 1) & MASK for bits in self.passing[row * cells:(row + 1) * cells]])
+
+        entries = [i for i, disabled in enumerate(index.disabled) if not disabled]
+        stride = len(index.platforms) * builds
+        for i, position in zip(entries, new_rows):
+            new_seen[position] |= 1
+            for platform_id, column in enumerate(columns):
+                for build in range(builds):
+                    if index.results[i * stride + platform_id * builds + build] in passes:
+                        new_passing[position * cells + column * builds + build] |= 1
+
+        self.keys = keys
+        self.seen = new_seen
+        self.passing = new_passing
+
+    def scores(self):
+        """ (flips, runs, streak, latest) for every cell in one pass over
+            the bitsets; numpy arrays when numpy is available, else lists """
+        if HAVE_NUMPY:
+            return self.scores_numpy()
+
+        flips, runs, streaks, latest = [], [], [], []
+        cells = self.cells
+        builds = len(Types.BUILDS)
+        for row, test_seen in enumerate(self.seen):
+            for column, bits in enumerate(self.passing[row * cells:(row + 1) * cells]):
+                seen = test_seen & self.platform_seen[column // builds]
+                pairs = seen & (seen >> 1)
+                count = seen.bit_count()
+                flips.append(((bits ^ (bits >> 1)) & pairs).bit_count())
+                runs.append(count)
+                same = ~(bits ^ (MASK if bits & 1 else 0)) & seen & MASK
+                differ = ~same & MASK
+                streaks.append(WINDOW if differ == 0 else (differ & -differ).bit_length() - 1)
+                latest.append(bits & 1)
+        return flips, runs, streaks, latest
+
+    def scores_numpy(self):
+        import numpy as np
+
+        passing = np.frombuffer(self.passing, dtype=np.uint32).reshape(len(self.keys), self.cells)
+        platform_seen = np.repeat(np.frombuffer(self.platform_seen, dtype=np.uint32), len(Types.BUILDS))
+        seen = np.frombuffer(self.seen, dtype=np.uint32)[:, None] & platform_seen[None, :]
+
+        # only transitions between two runs that both had the test count
+        flips = popcount((passing ^ (passing >> 1)) & (seen & (seen >> 1)))
+        runs = popcount(seen)
+
+        # the streak ends at the first run that differs from the latest (or
+        # did not have the test); that is the lowest set bit of 'differ'
+        latest = passing & 1
+        same = ~(passing ^ np.where(latest == 1, np.uint32(MASK), np.uint32(0))) & seen
+        differ = (~same & np.uint32(MASK)).astype(np.uint64)
+        lowest = differ & (~differ + np.uint64(1))
+        lowest[differ == 0] = 1
+        streaks = np.where(differ == 0, WINDOW, np.log2(lowest).astype(np.int64))
+        return flips, runs, streaks, latest
+
+    def flakiest(self, count: int = 20, min_runs: int = 3) -> List[Flake]:
+        """ The cells that flip most often, over at least 'min_runs' runs """
+        flips, runs, streaks, latest = self.scores()
+        cells = self.cells
+
+        if HAVE_NUMPY:
+            import numpy as np
+            flips, runs, streaks, latest = (np.ravel(a) for a in (flips, runs, streaks, latest))
+            score = flips / np.maximum(runs - 1, 1)
+            candidates = np.flatnonzero((flips > 0) & (runs >= min_runs))
+            order = candidates[np.lexsort((-flips[candidates], -score[candidates]))][:count]
+            flips, runs, streaks, latest, score = (a.tolist() for a in (flips, runs, streaks, latest, score))
+        else:
+            score = [f / max(r - 1, 1) for f, r in zip(flips, runs)]
+            candidates = [i for i in range(len(flips)) if flips[i] and (runs[i] >= min_runs)]
+            order = sorted(candidates, key=lambda i: (-score[i], -flips[i]))[:count]
+
+        results = []
+        for cell in order:
+            row, column = divmod(int(cell), cells)
+            platform_id, build = divmod(column, len(Types.BUILDS))
+            results.append(Flake(self.keys[row], self.platforms[platform_id], Types.BUILDS[build],
+                                 score[cell], flips[cell], runs[cell], streaks[cell], bool(latest[cell])))
+        return results
+
+    def dumps(self) -> bytes:
+        return zlib.compress(pickle.dumps(self))
+
+    @staticmethod
+    def loads(data: bytes) -> 'FlakeHistory':
+        return pickle.loads(zlib.decompress(data))
+
+def popcount(values):
+    """ Set bits in each element of a numpy uint32 array """
+    import numpy as np
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values).astype(np.int64)
+    # numpy before 2.0: count through the bytes
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+    values = np.ascontiguousarray(values)
+    return table[values.view(np.uint8)].reshape(values.shape + (values.itemsize,)).sum(axis=-1)
+
+if __name__ == "__main__":
+    import History
+
+    if len(sys.argv) not in (2, 3):
+        print(f'Usage: {sys.argv[0]} <history.db> [count]')
+        sys.exit(1)
+
+    history = History.HistoryStore(sys.argv[1])
+    data = history.get_state(STATE_NAME)
+    history.close()
+    if data is None:
+        print('No flakiness has been recorded in this history')
+        sys.exit(1)
+
+    for flake in FlakeHistory.loads(data).flakiest(int(sys.argv[2]) if len(sys.argv) == 3 else 20):
+        state = 'passing' if flake.passing else 'not passing'
+        print(f'{flake.score:5.2f}  {flake.flips:2} flips in {flake.runs:2} runs  {state} for {flake.streak:2}  {flake.platform} {flake.build}  {flake.key}')
+
+    sys.exit(0)
@@ -0,0 +1,96 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Generate                                                        #
+#                                                                         #
+# Synthetic CTS dump generator for benchmarking                           #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import sys
+import json
+import random
+
+from argparse       import ArgumentParser
+from typing         import List
+
+import Types
+
+# categories generated at 1x scale
+BASE_CATEGORIES = 500
+
+# Parse strips this many characters of path from each category key
+CATEGORY_PREFIX = 'testing/web-platform/mozilla/meta/webgpu/cts/webgpu/'.ljust(69, '_')
+
+TEST_RESULTS = ['OK', 'ERROR', 'TIMEOUT', 'CRASH']
+SUBTEST_RESULTS = ['PASS', 'FAIL', 'TIMEOUT', 'SKIP']
+
+def platform_names(count: int) -> List[str]:
+    """ The known platforms first, then made-up ones """
+    return (Types.PLATFORMS + [f'Platform{i}' for i in range(len(Types.PLATFORMS), count)])[:count]
+
+def expectation(rng: random.Random, results: List[str], passing: float, intermittency: float) -> List[str]:
+    roll = rng.random()
+    if roll < intermittency:
+        return rng.sample(results, 2)
+    if roll < intermittency + passing:
+        return [results[0]]
+    return [rng.choice(results[1:])]
+
+def properties(rng: random.Random, results: List[str], platforms: List[str], intermittency: float, disabled: float) -> dict:
+    """ A 'properties' block shaped like the ones Parse reads """
+    props = {'is_disabled': rng.random() < disabled}
+
+    roll = rng.random()
+    if roll < 0.5:
+        props['implementation_status'] = {name: {'Debug': 'backlog', 'Optimized': 'backlog'} for name in platforms}
+    elif roll < 0.75:
+        props['implementation_status'] = None
+
+    if rng.random() < 0.9:
+        props['expected'] = {name: {'Debug': expectation(rng, results, 0.7, intermittency),
+                                    'Optimized': expectation(rng, results, 0.7, intermittency)} for name in platforms}
+    return props
+
+def generate_dump(file_name: str, scale: float = 1, platform_count: int = 3, intermittency: float = 0.05,
+                  disabled: float = 0.02, seed: int = 0) -> None:
+    """ Write a synthetic dump of 'scale' times the base size.  Categories
+        are written one at a time, so even 100x dumps need little memory. """
+    rng = random.Random(seed)
+    platforms = platform_names(platform_count)
+
+    with open(file_name, 'w') as f:
+        f.write('{')
+        for c in range(int(BASE_CATEGORIES * scale)):
+            tests = {}
+            for t in range(rng.randint(1, 8)):
+                test = {'properties': properties(rng, TEST_RESULTS, platforms, intermittency, disabled)}
+                if rng.random() < 0.8:
+                    test['subtests'] = {f'subtest:{s}': {'properties': properties(rng, SUBTEST_RESULTS, platforms, intermittency, disabled)}
+                                        for s in range(rng.randint(1, 20))}
+                tests[f'cts.https.html?q=webgpu:area{c % 37}:case{c}:{t}'] = test
+
+            key = f'{CATEGORY_PREFIX}area{c % 37}\\case{c}.https.html.ini'
+            if c:
+                f.write(',')
+            f.write(f'\n{json.dumps(key)}: {json.dumps({"properties": {}, "tests": tests})}')
+        f.write('\n}\n')
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Generate a synthetic CTS dump")
+    parser.add_argument("output", metavar="FILE", type=str, help="Path of the dump to write")
+    parser.add_argument("-s", "--scale", metavar="FACTOR", default=1, type=float, help=f"Size relative to {BASE_CATEGORIES} categories (e.g. 1, 10, 100)")
+    parser.add_argument("-p", "--platforms", metavar="COUNT", default=len(Types.PLATFORMS), type=int, help="Number of platforms per test")
+    parser.add_argument("-i", "--intermittency", metavar="RATE", default=0.05, type=float, help="Fraction of expectations that are intermittent")
+    parser.add_argument("-d", "--disabled", metavar="RATE", default=0.02, type=float, help="Fraction of tests and subtests that are disabled")
+    parser.add_argument("--seed", metavar="SEED", default=0, type=int, help="Random seed")
+
+    options = parser.parse_args()
+
+    generate_dump(options.output, options.scale, options.platforms, options.intermittency, options.disabled, options.seed)
+    sys.exit(0)
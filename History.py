@@ -0,0 +1,254 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: History                                                         #
+#                                                                         #
+# SQLite-backed store of per-run history                                  #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import os
+import re
+import pickle
+import sqlite3
+import pathlib
+
+from array          import array
+from typing         import Dict, List, Optional, Tuple
+
+import Types
+
+# levels of rolled-up history, finest first; runs that age out of the
+# raw window are summed into the day they ran, and days that age out
+# are summed into their week
+DAILY = 'daily'
+WEEKLY = 'weekly'
+
+DAY = 86400.0
+
+def period_start(level: str, run_date: float) -> float:
+    """ Start (UTC) of the day or week a run date falls in """
+    day = int(run_date // DAY)
+    if level == WEEKLY:
+        # weeks start on Monday; the epoch was a Thursday
+        day -= (day + 3) % 7
+    return day * DAY
+
+def averaged(total: Types.RunInfo, run_count: int, date_sum: float) -> Types.RunInfo:
+    """ The mean run of a rollup, dated at the mean of its run dates """
+    run_info = Types.RunInfo(platforms=list(total.platforms), counts=array('i', [(value + run_count // 2) // run_count for value in total.counts]))
+    run_info.run_date = date_sum / run_count
+    for name in ('chunk_count', 'test_count', 'subtest_count', 'disabled_test_count', 'disabled_subtest_count'):
+        setattr(run_info, name, (getattr(total, name) + run_count // 2) // run_count)
+    return run_info
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_date REAL NOT NULL,
+    digest   TEXT,
+    data     BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_run_date ON runs (run_date);
+CREATE TABLE IF NOT EXISTS rollups (
+    level     TEXT NOT NULL,
+    period    REAL NOT NULL,
+    run_count INTEGER NOT NULL,
+    date_sum  REAL NOT NULL,
+    data      BLOB NOT NULL,
+    PRIMARY KEY (level, period)
+);
+CREATE TABLE IF NOT EXISTS state (
+    name     TEXT PRIMARY KEY,
+    data     BLOB NOT NULL
+);
+"""
+
+class HistoryStore:
+    """ Append-only history of RunInfo records.  Each run is a single
+        insert, retention is a range delete, and readers only load the
+        window of runs they ask for. """
+    def __init__(self, db_file: str, pickle_file: Optional[str] = None, read_only: bool = False):
+        self.db_file = db_file
+        self.migrated_from: Optional[str] = None
+        self.read_only = read_only
+
+        # the run pipeline uses the store from its worker threads, though
+        # only from one task at a time
+        if read_only and os.path.exists(db_file):
+            self.connection = sqlite3.connect(f'{pathlib.Path(os.path.abspath(db_file)).as_uri()}?mode=ro', uri=True, check_same_thread=False)
+            self.stand_in()
+        else:
+            # a read-only store without a database has nothing to open, and
+            # must not create one
+            self.connection = sqlite3.connect(':memory:' if read_only else db_file, check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+
+            # databases created before runs recorded their dump digest
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(runs)')]
+            if 'digest' not in columns:
+                with self.connection:
+                    self.connection.execute('ALTER TABLE runs ADD COLUMN digest TEXT')
+
+        if pickle_file and os.path.exists(pickle_file):
+            if not read_only:
+                self.migrate(pickle_file)
+            elif not os.path.exists(db_file):
+                # read into memory, and left for the next full run to migrate
+                self.load_pickle(pickle_file)
+
+    def stand_in(self) -> None:
+        """ A read-only store cannot upgrade an older database; what it
+            lacks is stood in for by temporary tables and views, which
+            shadow the database's own """
+        tables = {row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for statement in SCHEMA.split(';'):
+            match = re.search(r'CREATE TABLE IF NOT EXISTS (\w+)', statement)
+            if (match is not None) and (match.group(1) not in tables):
+                self.connection.execute(statement.replace('CREATE TABLE', 'CREATE TEMP TABLE'))
+
+        columns = [row[1] for row in self.connection.execute('PRAGMA main.table_info(runs)')]
+        if columns and ('digest' not in columns):
+            self.connection.execute('CREATE TEMP VIEW runs AS SELECT id, run_date, NULL AS digest, data FROM main.runs')
+
+    def load_pickle(self, pickle_file: str) -> None:
+        history_data: List[Types.RunInfo] = pickle.load(open(pickle_file, 'rb'))
+        with self.connection:
+            self.connection.executemany('INSERT INTO runs (run_date, data) VALUES (?, ?)',
+                                        [(run.run_date, pickle.dumps(run)) for run in history_data])
+
+    def migrate(self, pickle_file: str) -> None:
+        """ One-time import of a legacy pickled history list; the pickle
+            is removed once its runs are safely in the database """
+        if len(self) == 0:
+            self.load_pickle(pickle_file)
+        os.remove(pickle_file)
+        self.migrated_from = pickle_file
+
+    def append(self, run_info: Types.RunInfo, digest: Optional[str] = None) -> None:
+        """ Record a new run, along with the digest of the dump it came from """
+        with self.connection:
+            self.connection.execute('INSERT INTO runs (run_date, digest, data) VALUES (?, ?, ?)', (run_info.run_date, digest, pickle.dumps(run_info)))
+
+    def bulk_load(self, records: List[Tuple[Types.RunInfo, Optional[str]]], replace: bool = False) -> int:
+        """ Add many (run, digest) records at once, e.g., from a backfill,
+            optionally replacing what is there.  Otherwise, only what history
+            does not already hold is added: a dump whose digest it recorded
+            is skipped, and so is a run from before the oldest one it still
+            has (that was rolled up or dropped).  Runs are renumbered so
+            that history stays in run date order.  Returns the runs added. """
+        with self.connection:
+            if replace:
+                self.connection.execute('DELETE FROM runs')
+                self.connection.execute('DELETE FROM rollups')
+            else:
+                known = {row[0] for row in self.connection.execute('SELECT digest FROM runs WHERE digest IS NOT NULL')}
+                oldest = self.connection.execute('SELECT MIN(run_date) FROM runs').fetchone()[0]
+                records = [(run_info, digest) for run_info, digest in records
+                           if (digest not in known) and ((oldest is None) or (run_info.run_date >= oldest))]
+            self.connection.execute('CREATE TEMP TABLE merged AS SELECT run_date, digest, data FROM runs')
+            self.connection.executemany('INSERT INTO merged (run_date, digest, data) VALUES (?, ?, ?)',
+                                        [(run_info.run_date, digest, pickle.dumps(run_info)) for run_info, digest in records])
+            self.connection.execute('DELETE FROM runs')
+            self.connection.execute('INSERT INTO runs (run_date, digest, data) SELECT run_date, digest, data FROM merged ORDER BY run_date')
+            self.connection.execute('DROP TABLE merged')
+        return len(records)
+
+    def trim(self, max_runs: int, days: int = 0, weeks: int = 0) -> None:
+        """ Keep the most recent 'max_runs' runs.  With 'days', older runs
+            are rolled up into daily totals, which are kept for that many
+            days (before the latest run); with 'weeks', expired days (or
+            runs) are rolled up into weekly totals, of which that many are
+            kept.  Whatever ages out of every level is dropped. """
+        levels = [level for level, keep in ((DAILY, days), (WEEKLY, weeks)) if keep]
+
+        with self.connection:
+            expired = 'FROM runs WHERE id <= (SELECT id FROM runs ORDER BY id DESC LIMIT 1 OFFSET ?)'
+            if levels:
+                rows = self.connection.execute(f'SELECT run_date, data {expired}', (max_runs,)).fetchall()
+                self.fold(levels[0], [(pickle.loads(data), 1, run_date) for run_date, data in rows])
+            self.connection.execute(f'DELETE {expired}', (max_runs,))
+
+            if days:
+                latest = self.connection.execute('SELECT MAX(run_date) FROM runs').fetchone()[0]
+                if latest is not None:
+                    cutoff = period_start(DAILY, latest) - days * DAY
+                    rows = self.connection.execute('SELECT run_count, date_sum, data FROM rollups WHERE level = ? AND period < ?', (DAILY, cutoff)).fetchall()
+                    if weeks:
+                        self.fold(WEEKLY, [(pickle.loads(data), run_count, date_sum) for run_count, date_sum, data in rows])
+                    self.connection.execute('DELETE FROM rollups WHERE level = ? AND period < ?', (DAILY, cutoff))
+
+            if weeks:
+                self.connection.execute('DELETE FROM rollups WHERE level = ? AND period <= (SELECT period FROM rollups WHERE level = ? ORDER BY period DESC LIMIT 1 OFFSET ?)',
+                                        (WEEKLY, WEEKLY, weeks))
+
+    def fold(self, level: str, entries: List[Tuple[Types.RunInfo, int, float]]) -> None:
+        """ Add (summed run, run count, sum of run dates) entries into the
+            rollups of 'level'; the caller holds the transaction """
+        periods: Dict[float, Tuple[Types.RunInfo, int, float]] = {}
+        for run_info, run_count, date_sum in entries:
+            period = period_start(level, date_sum / run_count)
+            if period not in periods:
+                row = self.connection.execute('SELECT run_count, date_sum, data FROM rollups WHERE level = ? AND period = ?', (level, period)).fetchone()
+                periods[period] = (pickle.loads(row[2]), row[0], row[1]) if row else (Types.RunInfo(), 0, 0.0)
+            total, total_count, total_dates = periods[period]
+            total.merge(run_info)
+            periods[period] = (total, total_count + run_count, total_dates + date_sum)
+
+        self.connection.executemany('INSERT OR REPLACE INTO rollups (level, period, run_count, date_sum, data) VALUES (?, ?, ?, ?, ?)',
+                                    [(level, period, run_count, date_sum, pickle.dumps(total)) for period, (total, run_count, date_sum) in periods.items()])
+
+    def rollups(self, level: str, since: Optional[float] = None) -> List[Types.RunInfo]:
+        """ The mean run of every period of a rollup level, oldest first """
+        rows = self.connection.execute('SELECT run_count, date_sum, data FROM rollups WHERE level = ? AND period >= ? ORDER BY period',
+                                       (level, since if since is not None else float('-inf'))).fetchall()
+        return [averaged(pickle.loads(data), run_count, date_sum) for run_count, date_sum, data in rows]
+
+    def trend(self, count: int, since: Optional[float] = None) -> List[Types.RunInfo]:
+        """ The long view, oldest first: weekly then daily rollups, then the
+            most recent 'count' raw runs.  Only the rollup rows and the raw
+            window are read, however long the span. """
+        runs = self.window(count)
+        history = []
+        for level in (WEEKLY, DAILY):
+            history.extend(self.rollups(level, since))
+        if since is not None:
+            runs = [run for run in runs if run.run_date >= since]
+        # a week can be partly rolled up, with its later days still daily
+        history.sort(key=lambda run: run.run_date)
+        return history + runs
+
+    def window(self, count: int) -> List[Types.RunInfo]:
+        """ The most recent 'count' runs, oldest first """
+        rows = self.connection.execute('SELECT data FROM runs ORDER BY id DESC LIMIT ?', (count,)).fetchall()
+        return [pickle.loads(row[0]) for row in reversed(rows)]
+
+    def latest(self) -> Optional[Types.RunInfo]:
+        """ The most recent run, if there is one """
+        runs = self.window(1)
+        return runs[0] if runs else None
+
+    def latest_digest(self) -> Optional[str]:
+        """ The dump digest of the most recent run, if it was recorded """
+        row = self.connection.execute('SELECT digest FROM runs ORDER BY id DESC LIMIT 1').fetchone()
+        return row[0] if row else None
+
+    def get_state(self, name: str) -> Optional[bytes]:
+        """ A named blob kept alongside the runs (e.g., flakiness bitsets) """
+        row = self.connection.execute('SELECT data FROM state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def put_state(self, name: str, data: bytes) -> None:
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO state (name, data) VALUES (?, ?)', (name, data))
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
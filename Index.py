@@ -0,0 +1,248 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Index                                                           #
+#                                                                         #
+# Per-test result index and run-to-run diff engine                        #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import sys
+import zlib
+import pickle
+
+from array          import array
+from dataclasses    import dataclass, field
+
+from typing         import Dict, List, Optional, Tuple
+
+import Types
+
+# expectation sets that count as a clean pass (tests report 'OK',
+# subtests report 'PASS')
+PASSING = {('OK',), ('PASS',)}
+
+class IndexBuilder:
+    """ Collects per-test results while the dump is being counted.  Each
+        entry is interned as it is added, so nothing of the decoded dump
+        (e.g., a category parsed by --stream) is kept alive until finish() """
+    def __init__(self):
+        self.keys: List[str] = []
+        self.tiers = array('b')
+        self.disabled = array('b')
+        self.subtests = array('b')
+        self.category_ids = array('I')
+        # per entry, flattened (platform, Debug outcome, Optimized outcome)
+        # codes of every platform with an expectation
+        self.results: List[Tuple[int, ...]] = []
+
+        self.categories: List[str] = []
+        self.platforms: List[str] = []
+        self.outcomes: List[Tuple[str, ...]] = [()]
+        self.category_codes: Dict[str, int] = {}
+        self.platform_codes: Dict[str, int] = {}
+        self.outcome_codes: Dict[Tuple[str, ...], int] = {}
+
+    @staticmethod
+    def intern(values: list, codes: dict, value) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def add(self, category: str, name: str, tier: int, disabled: bool, expected: Optional[dict], subtest: bool = False) -> None:
+        """ Record a test (or, with 'subtest', a 'test/subtest' name) of a category """
+        self.keys.append(f'{category}/{name}')
+        self.tiers.append(tier)
+        self.disabled.append(1 if disabled else 0)
+        self.subtests.append(1 if subtest else 0)
+        self.category_ids.append(self.intern(self.categories, self.category_codes, category))
+
+        codes = []
+        if expected is not None:
+            for platform, builds in expected.items():
+                codes.append(self.intern(self.platforms, self.platform_codes, platform))
+                for build in Types.BUILDS:
+                    codes.append(self.intern(self.outcomes, self.outcome_codes, tuple(builds[build])))
+        self.results.append(tuple(codes))
+
+    def merge(self, other: 'IndexBuilder') -> None:
+        """ Append the entries of a partial builder (e.g., one shard of the
+            categories), moving its codes over to this one's """
+        categories = [self.intern(self.categories, self.category_codes, category) for category in other.categories]
+        platforms = [self.intern(self.platforms, self.platform_codes, platform) for platform in other.platforms]
+        # code 0 is never given out by intern()
+        outcomes = [0] + [self.intern(self.outcomes, self.outcome_codes, outcome) for outcome in other.outcomes[1:]]
+
+        self.keys.extend(other.keys)
+        self.tiers.extend(other.tiers)
+        self.disabled.extend(other.disabled)
+        self.subtests.extend(other.subtests)
+        self.category_ids.extend(categories[category_id] for category_id in other.category_ids)
+
+        width = 1 + len(Types.BUILDS)
+        for codes in other.results:
+            self.results.append(tuple(platforms[code] if i % width == 0 else outcomes[code] for i, code in enumerate(codes)))
+
+    def finish(self) -> 'TestIndex':
+        """ Sort the collected results into a compact index """
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+
+        # codes are handed out again in the order the sorted entries use
+        # them, so the index does not depend on the order entries were
+        # added in (e.g., by shard)
+        index = TestIndex()
+        category_codes: Dict[int, int] = {}
+        platform_codes: Dict[int, int] = {}
+        outcome_codes: Dict[int, int] = {}
+        rows: List[List[Tuple[int, List[int]]]] = []
+        width = 1 + len(Types.BUILDS)
+
+        for i in order:
+            index.keys.append(self.keys[i])
+            index.tiers.append(self.tiers[i])
+            index.disabled.append(self.disabled[i])
+            index.subtests.append(self.subtests[i])
+            category_id = self.category_ids[i]
+            if category_id not in category_codes:
+                category_codes[category_id] = len(index.categories)
+                index.categories.append(self.categories[category_id])
+            index.category_ids.append(category_codes[category_id])
+
+            row = []
+            codes = self.results[i]
+            for j in range(0, len(codes), width):
+                platform_id = codes[j]
+                if platform_id not in platform_codes:
+                    platform_codes[platform_id] = len(index.platforms)
+                    index.platforms.append(self.platforms[platform_id])
+                outcomes = []
+                for code in codes[j + 1:j + width]:
+                    if code not in outcome_codes:
+                        outcome_codes[code] = len(index.outcomes)
+                        index.outcomes.append(self.outcomes[code])
+                    outcomes.append(outcome_codes[code])
+                row.append((platform_codes[platform_id], outcomes))
+            rows.append(row)
+
+        stride = len(index.platforms) * len(Types.BUILDS)
+        index.results = array('H', bytes(2 * stride * len(rows)))
+        for i, row in enumerate(rows):
+            for platform_id, outcomes in row:
+                for build, code in enumerate(outcomes):
+                    index.results[i * stride + platform_id * len(Types.BUILDS) + build] = code
+
+        self.__init__()
+        return index
+
+@dataclass
+class TestIndex:
+    """ Sorted per-run index of test id -> tier, disabled state and the
+        interned expectation set of every platform/build """
+    keys: List[str] = field(default_factory=list)
+    tiers: array = field(default_factory=lambda: array('b'))
+    disabled: array = field(default_factory=lambda: array('b'))
+    subtests: array = field(default_factory=lambda: array('b'))
+    categories: List[str] = field(default_factory=list)
+    category_ids: array = field(default_factory=lambda: array('I'))
+    platforms: List[str] = field(default_factory=list)
+    # outcome code 0 is the empty set: no expectation was recorded
+    outcomes: List[Tuple[str, ...]] = field(default_factory=lambda: [()])
+    results: array = field(default_factory=lambda: array('H'))
+
+    def outcome(self, i: int, platform_id: int, build: int) -> Tuple[str, ...]:
+        return self.outcomes[self.results[(i * len(self.platforms) + platform_id) * len(Types.BUILDS) + build]]
+
+    def save(self, file_name: str) -> None:
+        with open(file_name, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(self)))
+
+    @staticmethod
+    def load(file_name: str) -> 'TestIndex':
+        with open(file_name, 'rb') as f:
+            return pickle.loads(zlib.decompress(f.read()))
+
+@dataclass
+class IndexDiff:
+    """ What moved between two runs """
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    tier_changed: List[Tuple[str, int, int]] = field(default_factory=list)
+    started_passing: List[Tuple[str, str, str]] = field(default_factory=list)
+    stopped_passing: List[Tuple[str, str, str]] = field(default_factory=list)
+    became_intermittent: List[Tuple[str, str, str]] = field(default_factory=list)
+    disabled: List[str] = field(default_factory=list)
+    enabled: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        lines = []
+        for name, values in self.__dict__.items():
+            lines.append(f'{name.replace("_", " ")}: {len(values)}')
+            for value in values[:10]:
+                lines.append(f'\t{value}')
+            if len(values) > 10:
+                lines.append(f'\t... {len(values) - 10} more')
+        return '\n'.join(lines)
+
+def diff(old: TestIndex, new: TestIndex) -> IndexDiff:
+    """ Compare two runs in a single merge pass over their sorted keys """
+    result = IndexDiff()
+
+    # platforms are interned per index, so line them up by name once
+    shared = [(old.platforms.index(name), platform_id, name) for platform_id, name in enumerate(new.platforms) if name in old.platforms]
+
+    i = j = 0
+    while (i < len(old.keys)) or (j < len(new.keys)):
+        if (j == len(new.keys)) or ((i < len(old.keys)) and (old.keys[i] < new.keys[j])):
+            result.removed.append(old.keys[i])
+            i += 1
+            continue
+        if (i == len(old.keys)) or (new.keys[j] < old.keys[i]):
+            result.added.append(new.keys[j])
+            j += 1
+            continue
+
+        key = new.keys[j]
+        if old.disabled[i] != new.disabled[j]:
+            (result.disabled if new.disabled[j] else result.enabled).append(key)
+        elif old.tiers[i] != new.tiers[j]:
+            result.tier_changed.append((key, old.tiers[i], new.tiers[j]))
+
+        for old_id, new_id, name in shared:
+            for build, build_name in enumerate(Types.BUILDS):
+                was = old.outcome(i, old_id, build)
+                now = new.outcome(j, new_id, build)
+                if was == now:
+                    continue
+                if now in PASSING:
+                    result.started_passing.append((key, name, build_name))
+                elif was in PASSING:
+                    result.stopped_passing.append((key, name, build_name))
+                if (len(now) > 1) and (len(was) <= 1):
+                    result.became_intermittent.append((key, name, build_name))
+
+        i += 1
+        j += 1
+
+    return result
+
+if __name__ == "__main__":
+    import Parse
+
+    if len(sys.argv) != 3:
+        print(f'Usage: {sys.argv[0]} <old dump.json> <new dump.json>')
+        sys.exit(1)
+
+    indexes = []
+    for run_file in sys.argv[1:]:
+        builder = IndexBuilder()
+        Parse.extract_current_run_info(Types.RunInfo(), run_file, Types.Ids(), streaming=True, index=builder)
+        indexes.append(builder.finish())
+
+    print(diff(*indexes).summary())
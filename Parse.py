@@ -13,116 +13,486 @@ __email__      = "bhood@mozilla.com"
 __status__     = "Production"
 
 import os
+import re
+import gzip
+import lzma
 import json
+import mmap
+import codecs
+
+from contextlib     import contextmanager
+from typing         import BinaryIO, Dict, Iterator, List, Optional, Required, Tuple, TypedDict, Union
+
+try:
+    import ijson
+    HAVE_IJSON = True
+except ImportError:
+    HAVE_IJSON = False
+
+try:
+    import zstandard
+    HAVE_ZSTANDARD = True
+except ImportError:
+    HAVE_ZSTANDARD = False
+
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:
+    HAVE_ORJSON = False
+
+try:
+    import msgspec
+    HAVE_MSGSPEC = True
+except ImportError:
+    HAVE_MSGSPEC = False
 
 import Types
+import Index
+import Trie
+import Table
+import Pipeline
+
+# initial read size for the streaming reader; it grows as needed to
+# hold the largest single category in the dump
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# top-level categories are the '.html.ini' keys of the dump; test and
+# subtest names never carry that suffix, so this locates shard boundaries
+# without decoding anything
+CATEGORY_KEY = re.compile(rb'\.html\.ini"\s*:')
+JSON_WS = b' \t\n\r'
+
+# the run output may be committed compressed; the first of these found
+# in the data folder is the one that is read
+DUMP_NAMES = ['dump.json', 'dump.json.gz', 'dump.json.xz', 'dump.json.zst']
+COMPRESSED_SUFFIXES = ['.gz', '.xz', '.zst']
+
+# the parts of the run output that are counted; decoding against this
+# schema skips everything else in the dump (e.g., category properties)
+class Outcomes(TypedDict):
+    Debug: List[str]
+    Optimized: List[str]
+
+class Status(TypedDict):
+    Debug: str
+    Optimized: str
+
+class Properties(TypedDict, total=False):
+    is_disabled: Required[bool]
+    expected: Optional[Dict[str, Outcomes]]
+    implementation_status: Optional[Dict[str, Status]]
+
+class Test(TypedDict, total=False):
+    properties: Properties
+    # every field of a subtest is counted as a subtest, so all are kept
+    subtests: Dict[str, Dict[str, Properties]]
+
+class Category(TypedDict, total=False):
+    tests: Dict[str, Test]
+
+RUN_DECODER = msgspec.json.Decoder(Dict[str, Category]) if HAVE_MSGSPEC else None
+
+def fast_loads(data: Union[bytes, memoryview]) -> dict:
+    """ Decode the run output in one pass, from any buffer (e.g., a view of
+        the mapped file).  With msgspec, only the counted fields are built;
+        a dump that does not fit the schema is decoded in full. """
+    if HAVE_MSGSPEC:
+        try:
+            return RUN_DECODER.decode(data)
+        except msgspec.ValidationError:
+            pass
+    return orjson.loads(data) if HAVE_ORJSON else msgspec.json.decode(data)
+
+def find_dump(data_path: str) -> str:
+    """ Path of the run output in the data folder, in whichever format it is """
+    for name in DUMP_NAMES:
+        run_file = os.path.join(data_path, name)
+        if os.path.exists(run_file):
+            return run_file
+    return os.path.join(data_path, DUMP_NAMES[0])
+
+def is_compressed(file_name: str) -> bool:
+    return os.path.splitext(file_name)[1] in COMPRESSED_SUFFIXES
+
+def decompress(stream: BinaryIO, file_name: str) -> BinaryIO:
+    """ Wrap a raw stream of 'file_name' so it reads as uncompressed JSON """
+    suffix = os.path.splitext(file_name)[1]
+    if suffix == '.gz':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    elif suffix == '.xz':
+        return lzma.LZMAFile(stream, mode='rb')
+    elif suffix == '.zst':
+        if not HAVE_ZSTANDARD:
+            raise ValueError(f"'{file_name}' is zstd compressed, and the zstandard package is not available")
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    return stream
+
+@contextmanager
+def open_dump(run_file: str) -> Iterator[BinaryIO]:
+    """ Open the run output for reading as bytes.  Compressed files are
+        decompressed as they are read; plain ones are memory-mapped, so
+        reads come straight from the page cache. """
+    with open(run_file, 'rb') as f:
+        if is_compressed(run_file):
+            with decompress(f, run_file) as stream:
+                yield stream
+        elif os.fstat(f.fileno()).st_size == 0:
+            # an empty file cannot be mapped
+            yield f
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield data
+
+def iter_categories(source: Union[str, BinaryIO]) -> Iterator[Tuple[str, dict]]:
+    """ Yield each top-level (category, data) pair of the run output in turn,
+        without ever holding more than one category in memory.  The source
+        is either a file name or a binary stream (e.g., a pipe). """
+    if isinstance(source, str):
+        with open_dump(source) as f:
+            yield from iter_categories(f)
+        return
+
+    if HAVE_IJSON:
+        yield from ijson.kvitems(source, '', use_float=True)
+        return
+
+    decoder = json.JSONDecoder()
+    ws = ' \t\n\r'
+
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    buffer = ''
+    pos = 0
+    eof = False
+    read_size = STREAM_CHUNK_SIZE
+
+    def fill(size: int) -> bool:
+        """ Append more of the file to the buffer, dropping what has been consumed """
+        nonlocal buffer, pos, eof
+        raw = source.read(size)
+        if not raw:
+            utf8.decode(b'', final=True)
+            eof = True
+            return False
+        buffer = buffer[pos:] + utf8.decode(raw)
+        pos = 0
+        return True
+
+    def next_token() -> str:
+        """ Skip whitespace and return (without consuming) the next character """
+        nonlocal pos
+        while True:
+            while (pos < len(buffer)) and (buffer[pos] in ws):
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill(read_size):
+                raise json.JSONDecodeError('Unexpected end of run output', buffer, pos)
+
+    def decode_value():
+        """ Decode the next complete JSON value, reading more of the file until it fits """
+        nonlocal pos, read_size
+        next_token()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # a number at the edge of the buffer may be truncated
+                if (end < len(buffer)) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # double the read each time so large categories stay linear
+            fill(read_size)
+            read_size = max(read_size, len(buffer))
+
+    if next_token() != '{':
+        raise json.JSONDecodeError("Expecting '{'", buffer, pos)
+    pos += 1
+
+    if next_token() == '}':
+        return
+
+    while True:
+        category = decode_value()
+        if next_token() != ':':
+            raise json.JSONDecodeError("Expecting ':' delimiter", buffer, pos)
+        pos += 1
+        cat = decode_value()
 
-def extract_current_run_info(run_info: Types.RunInfo, run_file: str, ids: Types.Ids) -> None:
-    """ Scan through the run output and gather our info for graphing status """
+        yield category, cat
+
+        token = next_token()
+        pos += 1
+        if token == '}':
+            return
+        elif token != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos - 1)
+
+def find_category_offsets(run_file: str) -> List[int]:
+    """ Locate the byte offset of every top-level category key in the run output """
+    with open(run_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offsets = [data.rfind(b'"', 0, m.start()) for m in CATEGORY_KEY.finditer(data)]
+            # the first category must open the top-level object, or the
+            # keys we found are not the ones we think they are
+            if offsets and (data[:offsets[0]].strip(JSON_WS) != b'{'):
+                raise ValueError('Unexpected content before the first category')
+    return offsets
+
+def shard_offsets(offsets: List[int], size: int, jobs: int) -> List[Tuple[List[int], int]]:
+    """ Split the category offsets into contiguous shards of roughly equal byte size """
+    shards = []
+    target = size / jobs
+    start = 0
+    for i in range(1, len(offsets) + 1):
+        end = offsets[i] if i < len(offsets) else size
+        if (i == len(offsets)) or ((end - offsets[start]) >= target):
+            shards.append((offsets[start:i], end))
+            start = i
+    return shards
+
+def parse_shard(run_file: str, offsets: List[int], end: int, indexed: bool = False, tabled: bool = False,
+                tried: bool = False) -> Tuple[Types.RunInfo, Types.Ids, Optional[Index.IndexBuilder], Optional[Table.ResultTable], Optional[Trie.CategoryTrie]]:
+    """ Count a contiguous run of categories, returning the partial results """
+    run_info = Types.RunInfo()
+    ids = Types.Ids()
+    index = Index.IndexBuilder() if indexed else None
+    table = Table.ResultTable() if tabled else None
+    trie = Trie.CategoryTrie() if tried else None
+
+    with open(run_file, 'rb') as f:
+        final = end == os.fstat(f.fileno()).st_size
+        f.seek(offsets[0])
+        data = f.read(end - offsets[0])
+
+    decoder = json.JSONDecoder()
+    bounds = [offset - offsets[0] for offset in offsets] + [len(data)]
+    for i in range(len(offsets)):
+        text = data[bounds[i]:bounds[i + 1]].decode('utf-8')
+
+        category, pos = decoder.raw_decode(text)
+        pos = text.index(':', pos) + 1
+        while text[pos] in ' \t\n\r':
+            pos += 1
+        cat, pos = decoder.raw_decode(text, pos)
+
+        # whatever follows the value must be the separator before the next
+        # category we located (or the close of the top-level object)
+        if text[pos:].strip() != ('}' if final and (i + 1 == len(offsets)) else ','):
+            raise ValueError(f'Category {category} is not followed by a top-level delimiter')
+
+        run_info.chunk_count += 1
+        tally_category(run_info, category, cat, ids, index, table, trie)
+
+    return run_info, ids, index, table, trie
+
+def extract_current_run_info(run_info: Types.RunInfo, run_file: str, ids: Types.Ids, streaming: bool = False, jobs: int = 1,
+                             index: Optional[Index.IndexBuilder] = None, fast: bool = False, table: Optional[Table.ResultTable] = None,
+                             trie: Optional[Trie.CategoryTrie] = None) -> None:
+    """ Scan through the run output and gather our info for graphing status.
+        If an index builder is provided, per-test results are collected too.
+        The dump is read one category at a time unless 'fast' is given
+        (and not 'streaming'); then the whole file is decoded at once with
+        msgspec or orjson, if either is installed, building only the fields
+        that are counted when msgspec is.
+        If a result table is provided, the results are added to it as rows
+        and the counters are produced by querying it.  If a category trie
+        is provided, results are also counted per category and rolled up. """
     run_info.run_date = os.stat(run_file).st_mtime
+    sharded = False
+
+    # a compressed dump can only be read front to back, so it is never sharded
+    if (jobs > 1) and (not is_compressed(run_file)):
+        try:
+            offsets = find_category_offsets(run_file)
+        except ValueError:
+            offsets = []
+
+        if offsets:
+            shards = shard_offsets(offsets, os.stat(run_file).st_size, jobs)
+            try:
+                with Pipeline.process_pool(jobs) as pool:
+                    futures = [pool.submit(parse_shard, run_file, shard, end, index is not None, table is not None, trie is not None)
+                               for shard, end in shards]
+                    results = [future.result() for future in futures]
+            except ValueError:
+                # the category keys did not tile the top-level object;
+                # count it the ordinary way instead
+                results = None
+
+            if results is not None:
+                for partial_info, partial_ids, partial_index, partial_table, partial_trie in results:
+                    run_info.merge(partial_info)
+                    ids.merge(partial_ids)
+                    if index is not None:
+                        index.merge(partial_index)
+                    if table is not None:
+                        table.merge(partial_table)
+                    if trie is not None:
+                        trie.merge(partial_trie)
+                sharded = True
+
+    if sharded:
+        pass
+    elif fast and (not streaming) and (HAVE_MSGSPEC or HAVE_ORJSON):
+        with open_dump(run_file) as f:
+            if isinstance(f, mmap.mmap):
+                # decoded straight from the page cache, never copied
+                with memoryview(f) as view:
+                    cts = fast_loads(view)
+            else:
+                cts = fast_loads(f.read())
+
+        run_info.chunk_count = len(cts)
+
+        for category in cts:
+            tally_category(run_info, category, cts[category], ids, index, table, trie)
+    else:
+        # the dump is consumed one category at a time, so peak memory is
+        # bounded by the largest category instead of the whole file (the
+        # stdlib decoder would need all of it copied out of the map)
+        with open_dump(run_file) as f:
+            extract_stream_run_info(run_info, f, ids, index, table, trie)
+
+    if table is not None:
+        table.fill(run_info, ids)
+    if trie is not None:
+        trie.rollup()
+
+def extract_stream_run_info(run_info: Types.RunInfo, stream: BinaryIO, ids: Types.Ids, index: Optional[Index.IndexBuilder] = None,
+                            table: Optional[Table.ResultTable] = None, trie: Optional[Trie.CategoryTrie] = None) -> None:
+    """ Gather our info from run output arriving on a binary stream (e.g.,
+        a blob piped out of git).  The caller sets the run date, fills the
+        counters from the table and rolls up the trie, if given. """
+    for category, cat in iter_categories(stream):
+        run_info.chunk_count += 1
+        tally_category(run_info, category, cat, ids, index, table, trie)
+
+def tally_category(run_info: Types.RunInfo, category: str, cat: dict, ids: Types.Ids, index: Optional[Index.IndexBuilder] = None,
+                   table: Optional[Table.ResultTable] = None, trie: Optional[Trie.CategoryTrie] = None) -> None:
+    """ Count a category directly, or add it to the result table if one is
+        given, and count it in the category trie """
+    if table is None:
+        count_category(run_info, category, cat, ids, index)
+    else:
+        table.add_category(category, cat, index)
+    if trie is not None:
+        trie.add_category(category, cat)
+
+def count_category(run_info: Types.RunInfo, category: str, cat: dict, ids: Types.Ids, index: Optional[Index.IndexBuilder] = None) -> None:
+    """ Gather the info for a single top-level category of the run output """
+    category_id = category[69:].replace('.html.ini','').replace('\\','_')
+    add = run_info.add
+    for chunk in cat:
+        if chunk == 'properties':
+            pass
+        elif chunk == 'tests':
+            for child in cat[chunk]:
+                run_info.test_count += 1
+                test = cat[chunk][child]
+                test_name = child
+                for item in test:
+                    if item == 'properties':
+                        properties = test[item]
+
+                        status = properties['implementation_status'] if 'implementation_status' in properties else None
+                        expected = properties['expected'] if 'expected' in properties else None
+                        disabled = properties['is_disabled']
+
+                        run_info.disabled_test_count += 1 if disabled else 0
+
+                        if not disabled:
+                            # figure out the tier first
+                            tier = 1    # this won't ever be true with this data set
+                            if status is not None:
+                                tier = 3
+                                for name in status:
+                                    platform = status[name]
+                                    debug = platform['Debug']
+                                    optimized = platform['Optimized']
+                                    ids.test_implementation_status_ids.add(debug)
+                                    ids.test_implementation_status_ids.add(optimized)
+                                    add(Types.TEST_TIER, tier, name)
+                            else:
+                                # 'null' is tier 2, counted against the baseline platforms
+                                tier = 2
+                                for name in Types.PLATFORMS:
+                                    add(Types.TEST_TIER, tier, name)
+
+                            if expected is not None:
+                                for name in expected:
+                                    platform = expected[name]
+                                    debug = platform['Debug']
+                                    optimized = platform['Optimized']
+                                    if (len(debug) == 1) and (debug[0] == 'OK'):
+                                        add(Types.TEST_PASSING, tier, name, Types.DEBUG)
+                                        add(Types.TEST_PASSING, tier, name, Types.OPTIMIZED)
+                                    if len(debug) > 1:
+                                        add(Types.TEST_INTERMITTENT, tier, name, Types.DEBUG)
+                                    if len(optimized) > 1:
+                                        add(Types.TEST_INTERMITTENT, tier, name, Types.OPTIMIZED)
+                                    for id in debug:
+                                        ids.tests_properties_expected_ids.add(id)
+                                    for id in optimized:
+                                        ids.tests_properties_expected_ids.add(id)
+
+                        if index is not None:
+                            index.add(category_id, test_name, 0 if disabled else tier, disabled, expected)
+
+                    elif item == 'subtests':
+                        subtests = test[item]
+                        for child in subtests:
+                            subtest = subtests[child]
+                            for item in subtest:
+                                run_info.subtest_count += 1
+                                if item == 'properties':
+                                    properties = subtest[item]
+
+                                    status = properties['implementation_status'] if 'implementation_status' in properties else None
+                                    expected = properties['expected'] if 'expected' in properties else None
+                                    disabled = properties['is_disabled']
+
+                                    run_info.disabled_subtest_count += 1 if disabled else 0
+
+                                    if not disabled:
+                                        # figure out the tier first
+                                        tier = 1    # this won't ever be true with this data set
+                                        if status is not None:
+                                            tier = 3
+                                            for name in status:
+                                                platform = status[name]
+                                                debug = platform['Debug']
+                                                optimized = platform['Optimized']
+                                                ids.subtest_implementation_status_ids.add(debug)
+                                                ids.subtest_implementation_status_ids.add(optimized)
+                                                add(Types.SUBTEST_TIER, tier, name)
+                                        else:
+                                            # 'null' is tier 2, counted against the baseline platforms
+                                            tier = 2
+                                            for name in Types.PLATFORMS:
+                                                add(Types.SUBTEST_TIER, tier, name)
 
-    cts = json.load(open(run_file, 'r'))
-
-    run_info.chunk_count = len(cts)
-
-    for category in cts:
-        cat = cts[category]
-        id = category[69:].replace('.html.ini','').replace('\\','_')
-        for chunk in cat:
-            if chunk == 'properties':
-                pass
-            elif chunk == 'tests':
-                for child in cat[chunk]:
-                    run_info.test_count += 1
-                    test = cat[chunk][child]
-                    for item in test:
-                        if item == 'properties':
-                            properties = test[item]
-
-                            status = properties['implementation_status'] if 'implementation_status' in properties else None
-                            expected = properties['expected'] if 'expected' in properties else None
-                            disabled = properties['is_disabled']
-
-                            run_info.disabled_test_count += 1 if disabled else 0
-
-                            if not disabled:
-                                # figure out the tier first
-                                tier = 1    # this won't ever be true with this data set
-                                if status is not None:
-                                    tier = 3
-                                    for name in status:
-                                        platform = status[name]
-                                        debug = platform['Debug']
-                                        optimized = platform['Optimized']
-                                        ids.test_implementation_status_ids.add(debug)
-                                        ids.test_implementation_status_ids.add(optimized)
-                                        assert name in run_info.test_tier_count[Types.TIERS[tier]], f"Platform {name} not in test_tier_count[{Types.TIERS[tier]}]"
-                                        run_info.test_tier_count[Types.TIERS[tier]][name] += 1
-                                else:
-                                    # 'null' is tier 2
-                                    tier = 2
-                                    for name in run_info.test_tier_count[Types.TIERS[tier]]:
-                                        run_info.test_tier_count[Types.TIERS[tier]][name] += 1
-
-                                if expected is not None:
-                                    for name in expected:
-                                        platform = expected[name]
-                                        debug = platform['Debug']
-                                        run_info.test_dbg_passing_count[Types.TIERS[tier]][name] += 1 if (len(debug) == 1) and (debug[0] == 'OK') else 0
-                                        run_info.test_dbg_intermittent_count[Types.TIERS[tier]][name] += 1 if len(debug) > 1 else 0
-                                        optimized = platform['Optimized']
-                                        run_info.test_opt_passing_count[Types.TIERS[tier]][name] += 1 if (len(debug) == 1) and (debug[0] == 'OK') else 0
-                                        run_info.test_opt_intermittent_count[Types.TIERS[tier]][name] += 1 if len(optimized) > 1 else 0
-                                        for id in debug:
-                                            ids.tests_properties_expected_ids.add(id)
-                                        for id in optimized:
-                                            ids.tests_properties_expected_ids.add(id)
-
-                        elif item == 'subtests':
-                            subtests = test[item]
-                            for child in subtests:
-                                subtest = subtests[child]
-                                for item in subtest:
-                                    run_info.subtest_count += 1
-                                    if item == 'properties':
-                                        properties = subtest[item]
-
-                                        status = properties['implementation_status'] if 'implementation_status' in properties else None
-                                        expected = properties['expected'] if 'expected' in properties else None
-                                        disabled = properties['is_disabled']
-
-                                        run_info.disabled_subtest_count += 1 if disabled else 0
-
-                                        if not disabled:
-                                            # figure out the tier first
-                                            tier = 1    # this won't ever be true with this data set
-                                            if status is not None:
-                                                tier = 3
-                                                for name in status:
-                                                    platform = status[name]
-                                                    debug = platform['Debug']
-                                                    optimized = platform['Optimized']
-                                                    ids.subtest_implementation_status_ids.add(debug)
-                                                    ids.subtest_implementation_status_ids.add(optimized)
-                                                    assert name in run_info.subtest_tier_count[Types.TIERS[tier]], f"Platform {name} not in subtest_tier_count[{Types.TIERS[tier]}]"
-                                                    run_info.subtest_tier_count[Types.TIERS[tier]][name] += 1
-                                            else:
-                                                # 'null' is tier 2
-                                                tier = 2
-                                                for name in run_info.subtest_tier_count[Types.TIERS[tier]]:
-                                                    run_info.subtest_tier_count[Types.TIERS[tier]][name] += 1
-
-                                            if expected is not None:
-                                                for name in expected:
-                                                    platform = expected[name]
-                                                    debug = platform['Debug']
-                                                    run_info.subtest_dbg_passing_count[Types.TIERS[tier]][name] += 1 if (len(debug) == 1) and (debug[0] == 'PASS') else 0
-                                                    run_info.subtest_dbg_intermittent_count[Types.TIERS[tier]][name] += 1 if len(debug) > 1 else 0
-                                                    optimized = platform['Optimized']
-                                                    run_info.subtest_opt_passing_count[Types.TIERS[tier]][name] += 1 if (len(debug) == 1) and (debug[0] == 'PASS') else 0
-                                                    run_info.subtest_opt_intermittent_count[Types.TIERS[tier]][name] += 1 if len(optimized) > 1 else 0
-                                                    for id in debug:
-                                                        ids.subtests_properties_expected_ids.add(id)
-                                                    for id in optimized:
-                                                        ids.subtests_properties_expected_ids.add(id)
+                                        if expected is not None:
+                                            for name in expected:
+                                                platform = expected[name]
+                                                debug = platform['Debug']
+                                                optimized = platform['Optimized']
+                                                if (len(debug) == 1) and (debug[0] == 'PASS'):
+                                                    add(Types.SUBTEST_PASSING, tier, name, Types.DEBUG)
+                                                    add(Types.SUBTEST_PASSING, tier, name, Types.OPTIMIZED)
+                                                if len(debug) > 1:
+                                                    add(Types.SUBTEST_INTERMITTENT, tier, name, Types.DEBUG)
+                                                if len(optimized) > 1:
+                                                    add(Types.SUBTEST_INTERMITTENT, tier, name, Types.OPTIMIZED)
+                                                for id in debug:
+                                                    ids.subtests_properties_expected_ids.add(id)
+                                                for id in optimized:
+                                                    ids.subtests_properties_expected_ids.add(id)
 
+                                    if index is not None:
+                                        index.add(category_id, f'{test_name}/{child}', 0 if disabled else tier, disabled, expected, subtest=True)
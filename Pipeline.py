@@ -0,0 +1,97 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Pipeline                                                        #
+#                                                                         #
+# Dependency-aware scheduler for the phases of a run                      #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses    import dataclass
+
+from typing         import Any, Callable, Dict, List, Optional, Sequence
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """ A pool of worker processes that is safe to start from a task.  A
+        forked worker inherits every lock another thread holds at that
+        moment (e.g., the import lock of a backend being loaded) and can
+        wait on it forever, so workers come from a fork server instead,
+        or are spawned where there is none. """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+@dataclass
+class Task:
+    name: str
+    func: Callable[[], Any]
+    after: Sequence[str]
+    when: Optional[Callable[[], bool]]
+
+class Pipeline:
+    """ Runs named tasks on a thread pool, each as soon as the tasks it
+        comes 'after' have finished, so independent phases overlap.  The
+        phases of a run spend their time waiting on git, on worker
+        processes, on disk or in C code (sqlite, zlib, rendering), so
+        threads are enough to overlap them.
+
+        A task with a 'when' condition that is false when it becomes ready
+        is skipped, and so is everything after it.  Task results are
+        available to later tasks in 'results'. """
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.tasks: Dict[str, Task] = {}
+        self.results: Dict[str, Any] = {}
+        self.skipped: List[str] = []
+
+    def add(self, name: str, func: Callable[[], Any], after: Sequence[str] = (), when: Optional[Callable[[], bool]] = None) -> None:
+        unknown = [dependency for dependency in after if dependency not in self.tasks]
+        if unknown:
+            # tasks are added in dependency order, which also rules out cycles
+            raise ValueError(f"task '{name}' comes after unknown tasks: {', '.join(unknown)}")
+        self.tasks[name] = Task(name, func, tuple(after), when)
+
+    def run(self) -> Dict[str, Any]:
+        """ Run every task; the first failure stops anything new from
+            starting and is raised once the running tasks have finished """
+        pending = dict(self.tasks)
+        running = {}
+        error = None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                ready = True
+                while ready and (error is None):
+                    ready = False
+                    for name, task in list(pending.items()):
+                        if any(dependency in pending or dependency in running.values() for dependency in task.after):
+                            continue
+                        del pending[name]
+                        ready = True
+                        if any(dependency in self.skipped for dependency in task.after) or ((task.when is not None) and (not task.when())):
+                            self.skipped.append(name)
+                        else:
+                            running[pool.submit(task.func)] = name
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+
+        if error is not None:
+            raise error
+        return self.results
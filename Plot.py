@@ -13,30 +13,251 @@ __email__      = "bhood@mozilla.com"
 __status__     = "Production"
 
 import os
+import json
 import pprint
+import hashlib
+import threading
+import importlib.util
 
+from contextlib     import contextmanager
 from copy           import deepcopy
+from dataclasses    import dataclass
 from datetime       import datetime
 
-from typing         import List
+from typing         import Iterator, List, Optional, Tuple, Union
 
-try:
+import Trie
+import Types
+import History
+import Profile
+import Pipeline
+
+# the plotting backends are heavy to import, so nothing is loaded until
+# a chart for the selected backend actually has to be rendered
+plt = np = alt = pd = None
+
+def load_matplotlib() -> None:
+    global plt, np
+    import matplotlib
+    # charts are only ever written to files, and may be drawn off the
+    # main thread
+    matplotlib.use('Agg')
     import matplotlib.pyplot as plt
     import numpy as np
-except ImportError:
-    pass
 
-try:
+def load_altair() -> None:
+    global alt, pd
     import altair as alt
     import pandas as pd
-except ImportError:
-    pass
-
-import Types
 
-def regenerate_tier_graphs(options, history: List[Types.RunInfo]) -> None:
+BACKENDS = {
+    'matplotlib' : load_matplotlib,
+    'altair' : load_altair,
+}
+
+# every module a backend imports, or needs to save a PNG (altair hands
+# that to vl-convert)
+BACKEND_MODULES = {
+    'matplotlib' : ['matplotlib', 'numpy'],
+    'altair' : ['altair', 'pandas', 'vl_convert'],
+}
+
+loaded_backends = set()
+
+# pyplot keeps global state, so charts drawn in this process are drawn one
+# at a time, and a render pool waits its turn too; the manifest is shared
+# by every render of an images folder
+RENDER_LOCK = threading.Lock()
+MANIFEST_LOCK = threading.Lock()
+
+def missing_modules(name: str) -> List[str]:
+    """ The modules a backend needs that are not installed; none of them
+        is imported """
+    return [module for module in BACKEND_MODULES[name] if importlib.util.find_spec(module) is None]
+
+def load_backend(name: str) -> None:
+    """ Import a plotting backend the first time it is needed """
+    if name not in loaded_backends:
+        BACKENDS[name]()
+        loaded_backends.add(name)
+
+# kept in the images folder; records the input digest of every chart
+# that was last rendered there
+MANIFEST_NAME = 'render_manifest.json'
+
+@dataclass
+class ChartJob:
+    """ Everything needed to render one chart, independent of any other
+        chart, so jobs can be handed to worker processes """
+    kind: str           # 'tiers', 'bars' or 'subtrees'
+    backend: str        # 'matplotlib' or 'altair'
+    file_name: str
+    title: str
+    data: dict
+
+def chart_backend(options) -> str:
+    return 'matplotlib' if options.matplotlib else 'altair' if options.altair else None
+
+def tier_graph_jobs(options, history: Union[History.HistoryStore, List[Types.RunInfo]]) -> List[ChartJob]:
+    """ The tier migration chart for the current history data """
+    if isinstance(history, History.HistoryStore):
+        # the raw runs that will be plotted, after the daily and weekly
+        # rollups of the older ones; no other run is loaded
+        history = history.trend(options.maxhistory)
+
+    backend = chart_backend(options)
+    if backend is None:
+        return []
+
+    # platforms don't appear to differ at this level, so we only need
+    # the data from one of them
+    data = {
+        'dates' : [run.run_date for run in history],
+        'tiers' : {tier: [run.test_tier_count[tier][Types.PLATFORMS[0]] for run in history] for tier in Types.TIERS[1:]},
+    }
+
+    file_name = os.path.join(options.repo, 'images', 'Tier_Migration.png')
+    return [ChartJob('tiers', backend, file_name, 'Tier Migration', data)]
+
+def intermittent_graph_jobs(options, run: Types.RunInfo) -> List[ChartJob]:
+    """ The intermittent plots for tiers and platforms """
+    return bar_graph_jobs(options, run, 'Intermittents', 'intermittents', run.test_dbg_intermittent_count, run.test_opt_intermittent_count)
+
+def passfail_graph_jobs(options, run: Types.RunInfo) -> List[ChartJob]:
+    """ The pass/fail plots for tiers and platforms """
+    return bar_graph_jobs(options, run, 'Passing', 'passing', run.test_dbg_passing_count, run.test_opt_passing_count)
+
+def bar_graph_jobs(options, run: Types.RunInfo, label: str, suffix: str, dbg_counts, opt_counts) -> List[ChartJob]:
+    backend = chart_backend(options)
+    if backend is None:
+        return []
+
+    jobs = []
+    for tier in Types.TIERS[1:]:
+        for platform in Types.PLATFORMS:
+            data = {
+                'label' : label,
+                'total' : run.test_tier_count[tier][platform],
+                'dbg_build' : dbg_counts[tier][platform],
+                'opt_build' : opt_counts[tier][platform],
+            }
+            file_name = os.path.join(options.repo, 'images', f'{tier}_{platform}_{suffix}.png'.replace(' ', '_'))
+            jobs.append(ChartJob('bars', backend, file_name, f'{tier}: {platform} {label}', data))
+    return jobs
+
+def job_digest(job: ChartJob) -> str:
+    """ Digest of everything that determines how a chart looks """
+    inputs = json.dumps([job.kind, job.backend, job.title, job.data], sort_keys=True)
+    return hashlib.sha1(inputs.encode()).hexdigest()
+
+def load_manifest(image_path: str) -> dict:
+    try:
+        with open(os.path.join(image_path, MANIFEST_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(image_path: str, manifest: dict) -> None:
+    with open(os.path.join(image_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def subtree_graph_jobs(options, trie: Trie.CategoryTrie, count: int = 10, depth: int = 1) -> List[ChartJob]:
+    """ The category subtrees holding the most intermittent and failing results """
+    backend = chart_backend(options)
+    if backend is None:
+        return []
+
+    jobs = []
+    for metric in (Trie.INTERMITTENT, Trie.FAILING):
+        label = Trie.METRICS[metric].capitalize()
+        nodes = trie.top(metric, count, depth)
+        data = {
+            'label' : label,
+            'paths' : [node.path for node in nodes],
+            'values' : [node.totals[metric] for node in nodes],
+        }
+        file_name = os.path.join(options.repo, 'images', f'Top_{label}_Areas.png')
+        jobs.append(ChartJob('subtrees', backend, file_name, f'Top {len(nodes)} Areas: {label}', data))
+    return jobs
+
+def render_jobs(options, jobs: List[ChartJob], profiler: Optional[Profile.Profiler] = None) -> List[ChartJob]:
+    """ Render independent charts, spread over at most 'render_jobs'
+        worker processes.  Charts whose inputs match the manifest are
+        skipped; the jobs actually rendered are returned. """
+    if not jobs:
+        return []
+
+    image_path = os.path.dirname(jobs[0].file_name)
+    manifest = {} if getattr(options, 'force_render', False) else load_manifest(image_path)
+
+    digests = {job.file_name: job_digest(job) for job in jobs}
+    stale = [job for job in jobs if (manifest.get(os.path.basename(job.file_name)) != digests[job.file_name]) or
+                                    (not os.path.exists(job.file_name))]
+
+    workers = min(getattr(options, 'render_jobs', 1), len(stale))
+    if workers > 1:
+        # one pool at a time, so --render-jobs bounds every render of the run
+        with RENDER_LOCK, Pipeline.process_pool(workers) as pool:
+            if (profiler is not None) and profiler.enabled:
+                for span in pool.map(profiled_render_chart, stale):
+                    profiler.record(span)
+            else:
+                list(pool.map(render_chart, stale))
+    else:
+        for job in stale:
+            with RENDER_LOCK:
+                if profiler is not None:
+                    with profiler.phase(job.title, 'chart'):
+                        render_chart(job)
+                else:
+                    render_chart(job)
+
+    if stale:
+        with MANIFEST_LOCK:
+            # another render may have updated it in the meantime
+            manifest = load_manifest(image_path)
+            for job in stale:
+                manifest[os.path.basename(job.file_name)] = digests[job.file_name]
+            save_manifest(image_path, manifest)
+
+    return stale
+
+def profiled_render_chart(job: ChartJob) -> Profile.Span:
+    return Profile.timed(job.title, 'chart', render_chart, job)
+
+def render_chart(job: ChartJob) -> None:
+    load_backend(job.backend)
+    if job.kind == 'tiers':
+        render_tier_graph(job)
+    elif job.kind == 'subtrees':
+        render_subtree_graph(job)
+    else:
+        render_bar_graph(job)
+
+def regenerate_tier_graphs(options, history: Union[History.HistoryStore, List[Types.RunInfo]]) -> None:
     """ Update the rendered graphs with the current history data """
-    if options.matplotlib:
+    render_jobs(options, tier_graph_jobs(options, history))
+
+def regenerate_intermittent_graphs(options, run: Types.RunInfo) -> None:
+    """ Update the intermittent plots for tiers and platforms """
+    render_jobs(options, intermittent_graph_jobs(options, run))
+
+def regenerate_passfail_graphs(options, run: Types.RunInfo) -> None:
+    """ Update the pass/fail plots for tiers and platforms """
+    render_jobs(options, passfail_graph_jobs(options, run))
+
+@contextmanager
+def figure(**kwargs) -> Iterator[Tuple]:
+    """ A new matplotlib figure and its axes, released when the chart is
+        done with them, or every chart drawn stays resident """
+    fig, ax = plt.subplots(**kwargs)
+    try:
+        yield fig, ax
+    finally:
+        plt.close(fig)
+
+def render_tier_graph(job: ChartJob) -> None:
+    if job.backend == 'matplotlib':
         dates = []
 
         tiers = {}
@@ -50,13 +271,11 @@ def regenerate_tier_graphs(options, history: List[Types.RunInfo]) -> None:
         # format the run info for graphing
         min_y = 1000000
         max_y = 0
-        for run in history:
-            dt = datetime.fromtimestamp(run.run_date)#, tz=timezone.utc)
+        for i, run_date in enumerate(job.data['dates']):
+            dt = datetime.fromtimestamp(run_date)#, tz=timezone.utc)
             dates.append(datetime.strftime(dt, '%b %d %H:%M'))
             for tier in Types.TIERS[1:]:
-                # platforms don't appear to differ at this level, so we only need
-                # the data from one of them
-                val = run.test_tier_count[tier][Types.PLATFORMS[0]]
+                val = job.data['tiers'][tier][i]
                 platforms[Types.PLATFORMS[0]][tier].append(val)
 
                 min_y = min(min_y, val)
@@ -64,40 +283,38 @@ def regenerate_tier_graphs(options, history: List[Types.RunInfo]) -> None:
 
         pprint.pp(platforms)
 
-        fig, ax = plt.subplots()
-
-        # plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m/%d/%Y'))
-        # plt.gca().xaxis.set_major_locator(mdates.DayLocator())
+        with figure() as (fig, ax):
+            # plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m/%d/%Y'))
+            # plt.gca().xaxis.set_major_locator(mdates.DayLocator())
 
-        ax.stackplot(dates, platforms[Types.PLATFORMS[0]].values(), labels=platforms[Types.PLATFORMS[0]].keys())
+            ax.stackplot(dates, platforms[Types.PLATFORMS[0]].values(), labels=platforms[Types.PLATFORMS[0]].keys())
 
-        # ax.vlines(dates, min_y, max_y, color='k', ls=':')
+            # ax.vlines(dates, min_y, max_y, color='k', ls=':')
 
-        h_offset = 0.01
-        last_label = len(dates) - 1
-        for i in range(len(dates)):
-            if i != last_label:
-                h_offset += i
-            else:
-                h_offset += i / 2.5
-            # last_val = 0
-            for tier in Types.TIERS[1:]:
-                val = platforms[Types.PLATFORMS[0]][tier][i]
-                if val != 0:
-                    plt.annotate(val, (h_offset, val))
-                    # last_val = val
+            h_offset = 0.01
+            last_label = len(dates) - 1
+            for i in range(len(dates)):
+                if i != last_label:
+                    h_offset += i
+                else:
+                    h_offset += i / 2.5
+                # last_val = 0
+                for tier in Types.TIERS[1:]:
+                    val = platforms[Types.PLATFORMS[0]][tier][i]
+                    if val != 0:
+                        ax.annotate(val, (h_offset, val))
+                        # last_val = val
 
-        # ax.set(xlim=(0, 2), ylim=(0, max_y + 500))
+            # ax.set(xlim=(0, 2), ylim=(0, max_y + 500))
 
-        ax.legend(loc='center left', reverse=True)
-        ax.set_title('Tier Migration')
-        ax.set_xlabel('Run Dates')
-        ax.set_ylabel('Total Tests')
+            ax.legend(loc='center left', reverse=True)
+            ax.set_title(job.title)
+            ax.set_xlabel('Run Dates')
+            ax.set_ylabel('Total Tests')
 
-        file_name = os.path.join(options.repo, 'images', 'Tier_Migration.png')
-        plt.savefig(file_name)
+            fig.savefig(job.file_name)
 
-    elif options.altair:
+    elif job.backend == 'altair':
         # https://altair-viz.github.io/user_guide/data.html
 
         data = {'date': []}
@@ -105,15 +322,15 @@ def regenerate_tier_graphs(options, history: List[Types.RunInfo]) -> None:
         # https://altair-viz.github.io/gallery/line_chart_with_arrows.html
         # layers = []
 
-        for run in history:
-            dt = datetime.fromtimestamp(run.run_date)#, tz=timezone.utc)
+        for i, run_date in enumerate(job.data['dates']):
+            dt = datetime.fromtimestamp(run_date)#, tz=timezone.utc)
             data['date'].append(datetime.strftime(dt, '%Y-%m-%d'))
 
             for tier in Types.TIERS[1:]:
                 # in terms of tier migration, all platforms
                 # produce the same data, so we only need to
                 # pass through one platform
-                val = run.test_tier_count[tier][Types.PLATFORMS[0]]
+                val = job.data['tiers'][tier][i]
                 if tier not in data:
                     data[tier] = []
                 data[tier].append(val)
@@ -130,7 +347,7 @@ def regenerate_tier_graphs(options, history: List[Types.RunInfo]) -> None:
         # for Altair
         pd_form = pd.DataFrame(data).melt('date', var_name='tier', value_name='tests')
 
-        chart = alt.Chart(pd_form, title="Tier Migration").mark_area(line=True, point=True).encode(
+        chart = alt.Chart(pd_form, title=job.title).mark_area(line=True, point=True).encode(
             alt.X('date').title('Run Date'),
             alt.Y('tests').title('Count of Tests'),
             alt.Color('tier').title('Tiers')
@@ -139,97 +356,75 @@ def regenerate_tier_graphs(options, history: List[Types.RunInfo]) -> None:
         # layers.insert(0, chart)
         # alt.layer(*layers).save(open("Teir_Migration.png", "wb"), "png", scale_factor=1.5)
 
-        file_name = os.path.join(options.repo, 'images', 'Tier_Migration.png')
-        chart.save(open(file_name, "wb"), "png", scale_factor=1.5)
+        with open(job.file_name, "wb") as f:
+            chart.save(f, "png", scale_factor=1.5)
 
-def regenerate_intermittent_graphs(options, run: Types.RunInfo) -> None:
-    """ Update the intermittent plots for tiers and platforms """
-    for tier in Types.TIERS[1:]:
-        for platform in Types.PLATFORMS:
-            total = run.test_tier_count[tier][platform]
-            dbg_build = run.test_dbg_intermittent_count[tier][platform]
-            opt_build = run.test_opt_intermittent_count[tier][platform]
-
-            if options.matplotlib:
-                values = {
-                    "Intermittents" : np.array([dbg_build, opt_build]),
-                    "Total" : np.array([total, total]),
-                }
-
-                fig, ax = plt.subplots()
-                bottom = np.zeros(2)
-                width = 0.5
-
-                for build, counts in values.items():
-                    p = ax.bar(['Debug', 'Optimized'], counts, width, label=build, bottom=bottom)
-                    bottom += counts
-                    ax.bar_label(p, label_type='center')
-
-                ax.set_title(f'{tier}: {platform} Intermittents')
-                ax.legend()
-
-                file_name = os.path.join(options.repo, 'images', f'{tier}_{platform}_intermittents.png'.replace(' ', '_'))
-                plt.savefig(file_name)
-            elif options.altair:
-                values = { "build" : ["Debug", "Debug", "Optimized", "Optimized"],
-                           "type" : ["Intermittents", "Total", "Intermittents", "Total"],
-                           "tests" : [dbg_build, total-dbg_build, opt_build, total-opt_build],
-                }
-
-                form = pd.DataFrame(values)
-
-                chart = alt.Chart(form, title=f"{tier}: {platform} Intermittents").mark_bar().encode(
-                    alt.X('build').title('Build Type'),
-                    alt.Y('tests').title('Count of Tests'),
-                    alt.Color('type').title('Result Type'),
-                    order=alt.Order('type').sort('ascending')
-                ).properties(width=300, height=300)
-
-                file_name = os.path.join(options.repo, 'images', f'{tier}_{platform}_intermittents.png'.replace(' ', '_'))
-                chart.save(open(file_name, "wb"), "png", scale_factor=1.5)
+def render_bar_graph(job: ChartJob) -> None:
+    label = job.data['label']
+    total = job.data['total']
+    dbg_build = job.data['dbg_build']
+    opt_build = job.data['opt_build']
 
-def regenerate_passfail_graphs(options, run: Types.RunInfo) -> None:
-    """ Update the pass/fail plots for tiers and platforms """
-    for tier in Types.TIERS[1:]:
-        for platform in Types.PLATFORMS:
-            total = run.test_tier_count[tier][platform]
-            dbg_build = run.test_dbg_passing_count[tier][platform]
-            opt_build = run.test_opt_passing_count[tier][platform]
-
-            if options.matplotlib:
-                values = {
-                    "Passing" : np.array([dbg_build, opt_build]),
-                    "Total" : np.array([total, total]),
-                }
-
-                fig, ax = plt.subplots()
-                bottom = np.zeros(2)
-                width = 0.5
-
-                for build, counts in values.items():
-                    p = ax.bar(['Debug', 'Optimized'], counts, width, label=build, bottom=bottom)
-                    bottom += counts
-                    ax.bar_label(p, label_type='center')
-
-                ax.set_title(f'{tier}: {platform} Passing')
-                ax.legend()
-
-                file_name = os.path.join(options.repo, 'images', f'{tier}_{platform}_passing.png'.replace(' ', '_'))
-                plt.savefig(file_name)
-            elif options.altair:
-                values = { "build" : ["Debug", "Debug", "Optimized", "Optimized"],
-                           "type" : ["Passing", "Total", "Passing", "Total"],
-                           "tests" : [dbg_build, total-dbg_build, opt_build, total-opt_build],
-                }
-
-                form = pd.DataFrame(values)
-
-                chart = alt.Chart(form, title=f"{tier}: {platform} Passing").mark_bar().encode(
-                    alt.X('build').title('Build Type'),
-                    alt.Y('tests').title('Count of Tests'),
-                    alt.Color('type').title('Result Type'),
-                    order=alt.Order('type').sort('ascending')
-                ).properties(width=300, height=300)
-
-                file_name = os.path.join(options.repo, 'images', f'{tier}_{platform}_passing.png'.replace(' ', '_'))
-                chart.save(open(file_name, "wb"), "png", scale_factor=1.5)
+    if job.backend == 'matplotlib':
+        values = {
+            label : np.array([dbg_build, opt_build]),
+            "Total" : np.array([total, total]),
+        }
+
+        with figure() as (fig, ax):
+            bottom = np.zeros(2)
+            width = 0.5
+
+            for build, counts in values.items():
+                p = ax.bar(['Debug', 'Optimized'], counts, width, label=build, bottom=bottom)
+                bottom += counts
+                ax.bar_label(p, label_type='center')
+
+            ax.set_title(job.title)
+            ax.legend()
+
+            fig.savefig(job.file_name)
+    elif job.backend == 'altair':
+        values = { "build" : ["Debug", "Debug", "Optimized", "Optimized"],
+                   "type" : [label, "Total", label, "Total"],
+                   "tests" : [dbg_build, total-dbg_build, opt_build, total-opt_build],
+        }
+
+        form = pd.DataFrame(values)
+
+        chart = alt.Chart(form, title=job.title).mark_bar().encode(
+            alt.X('build').title('Build Type'),
+            alt.Y('tests').title('Count of Tests'),
+            alt.Color('type').title('Result Type'),
+            order=alt.Order('type').sort('ascending')
+        ).properties(width=300, height=300)
+
+        with open(job.file_name, "wb") as f:
+            chart.save(f, "png", scale_factor=1.5)
+
+def render_subtree_graph(job: ChartJob) -> None:
+    label = job.data['label']
+    paths = job.data['paths']
+    values = job.data['values']
+
+    if job.backend == 'matplotlib':
+        with figure(figsize=(8, max(3, len(paths) * 0.4))) as (fig, ax):
+            # largest at the top
+            p = ax.barh(paths[::-1], values[::-1])
+            ax.bar_label(p, label_type='edge')
+
+            ax.set_title(job.title)
+            ax.set_xlabel(f'{label} Results')
+            fig.tight_layout()
+
+            fig.savefig(job.file_name)
+    elif job.backend == 'altair':
+        form = pd.DataFrame({'area': paths, 'results': values})
+
+        chart = alt.Chart(form, title=job.title).mark_bar().encode(
+            alt.X('results').title(f'{label} Results'),
+            alt.Y('area').title('Category').sort('-x'),
+        ).properties(width=300, height=max(150, len(paths) * 20))
+
+        with open(job.file_name, "wb") as f:
+            chart.save(f, "png", scale_factor=1.5)
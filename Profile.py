@@ -0,0 +1,175 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Profile                                                         #
+#                                                                         #
+# Per-phase timing and memory instrumentation                             #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import os
+import json
+import time
+import threading
+import cProfile
+import tracemalloc
+
+from contextlib     import contextmanager
+from dataclasses    import dataclass, asdict, field
+from datetime       import datetime
+
+from typing         import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start: float        # seconds since the epoch
+    wall: float         # seconds
+    cpu: float          # seconds, of the thread that ran the span
+    peak_bytes: int     # peak of Python allocations during the span
+    pid: int = field(default_factory=os.getpid)
+    tid: int = field(default_factory=threading.get_native_id)
+    # 'process' when phases of other threads overlapped the span: the
+    # peak is then that of the whole process, not of this phase alone
+    peak_scope: str = 'phase'
+
+def max_rss() -> int:
+    """ Peak resident set size of this process, in bytes """
+    if resource is None:
+        return 0
+    # Linux reports kilobytes, macOS bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname().sysname == 'Darwin' else rss * 1024
+
+class Profiler:
+    """ Records wall time, CPU time and peak memory of pipeline phases.
+        When disabled, every phase is a no-op. """
+    def __init__(self, enabled: bool = False, profile_parse: bool = False):
+        self.enabled = enabled
+        self.profile_parse = enabled and profile_parse
+        self.spans: List[Span] = []
+        self.stats: Optional[cProfile.Profile] = None
+        # phases nest within a thread, and pipeline threads run side by
+        # side; each thread's open phases, innermost last, are kept as
+        # [running peak, overlapped] pairs
+        self.lock = threading.Lock()
+        self.open: Dict[int, List[list]] = {}
+        self.created = datetime.now()
+
+        if enabled:
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str, category: str = 'phase'):
+        if not self.enabled:
+            yield
+            return
+
+        # tracemalloc keeps one peak for the whole process, so a phase only
+        # has a peak of its own while no other thread has a phase open;
+        # phases may nest, so each keeps its own running peak and hands it
+        # up to its parent when it ends
+        thread = threading.get_ident()
+        with self.lock:
+            peaks = self.open.setdefault(thread, [])
+            overlapped = any(frames for other, frames in self.open.items() if other != thread)
+            if overlapped:
+                for frames in self.open.values():
+                    for frame in frames:
+                        frame[1] = True
+            if peaks:
+                peaks[-1][0] = max(peaks[-1][0], tracemalloc.get_traced_memory()[1])
+            frame = [0, overlapped]
+            peaks.append(frame)
+            if not overlapped:
+                tracemalloc.reset_peak()
+        start = time.time()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                peaks.pop()
+                peak = max(frame[0], tracemalloc.get_traced_memory()[1])
+                if peaks:
+                    peaks[-1][0] = max(peaks[-1][0], peak)
+                else:
+                    del self.open[thread]
+            self.spans.append(Span(name, category, start, time.perf_counter() - wall, time.thread_time() - cpu, peak,
+                                   peak_scope='process' if frame[1] else 'phase'))
+
+    @contextmanager
+    def parse_phase(self, name: str = 'parse'):
+        """ A phase that is also captured by cProfile when asked to """
+        with self.phase(name):
+            if not self.profile_parse:
+                yield
+                return
+            self.stats = cProfile.Profile()
+            self.stats.enable()
+            try:
+                yield
+            finally:
+                self.stats.disable()
+
+    def record(self, span: Span) -> None:
+        """ Add a span measured elsewhere (e.g., in a worker process) """
+        if self.enabled:
+            self.spans.append(span)
+
+    def write(self, folder: str) -> List[str]:
+        """ Write the JSON summary, the Chrome trace-event file and any
+            parse profile into 'folder', returning the files written """
+        if not self.enabled:
+            return []
+
+        os.makedirs(folder, exist_ok=True)
+        stamp = self.created.strftime('%Y%m%d-%H%M%S')
+
+        summary_file = os.path.join(folder, f'profile-{stamp}.json')
+        with open(summary_file, 'w') as f:
+            json.dump({'created': self.created.isoformat(),
+                       'max_rss_bytes': max_rss(),
+                       'spans': [asdict(span) for span in self.spans]}, f, indent=2)
+
+        # Chrome trace-event format, for chrome://tracing or Perfetto
+        trace_file = os.path.join(folder, f'trace-{stamp}.json')
+        events = [{'name': span.name, 'cat': span.category, 'ph': 'X',
+                   'ts': int(span.start * 1000000), 'dur': int(span.wall * 1000000),
+                   'pid': span.pid, 'tid': span.tid,
+                   'args': {'cpu_ms': round(span.cpu * 1000, 3), 'peak_bytes': span.peak_bytes, 'peak_scope': span.peak_scope}} for span in self.spans]
+        with open(trace_file, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+        files = [summary_file, trace_file]
+        if self.stats is not None:
+            stats_file = os.path.join(folder, f'parse-{stamp}.prof')
+            self.stats.dump_stats(stats_file)
+            files.append(stats_file)
+
+        return files
+
+def timed(name: str, category: str, func, *args) -> Span:
+    """ Run a function and measure it; usable inside a worker process """
+    tracemalloc.start()
+    start = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        func(*args)
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return Span(name, category, start, time.perf_counter() - wall, time.process_time() - cpu, peak)
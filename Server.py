@@ -0,0 +1,185 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Server                                                          #
+#                                                                         #
+# Read-only HTTP endpoint serving run metrics as JSON                     #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import sys
+import json
+import signal
+import hashlib
+import threading
+
+from datetime       import datetime, timezone
+from http.server    import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse   import parse_qsl, urlsplit
+
+from typing         import Dict, Optional, Tuple
+
+import Types
+import History
+
+# documents of a digest are few, but every distinct query is one
+MAX_DOCUMENTS = 256
+
+ENDPOINTS = {
+    '/latest': 'the most recent run',
+    '/history': 'the most recent runs, oldest first (?count=N)',
+    '/trend': 'the weekly and daily rollups followed by the recent runs',
+    '/counters': 'the counters of the most recent run (?tier=...&platform=...)',
+}
+
+def counters_json(run: Types.RunInfo, tier: Optional[str] = None, platform: Optional[str] = None) -> dict:
+    """ counter -> tier -> platform -> count, by the historical counter names """
+    tiers = [tier] if tier else Types.TIERS[1:]
+    platforms = [platform] if platform else run.platforms
+    return {name: {t: {p: getattr(run, name)[t][p] for p in platforms} for t in tiers} for name in Types.COUNTERS}
+
+def run_json(run: Types.RunInfo) -> dict:
+    return {
+        'run_date': run.run_date,
+        'date': datetime.fromtimestamp(run.run_date, tz=timezone.utc).isoformat(),
+        'test_count': run.test_count,
+        'subtest_count': run.subtest_count,
+        'disabled_test_count': run.disabled_test_count,
+        'disabled_subtest_count': run.disabled_subtest_count,
+        'platforms': run.platforms,
+        'counters': counters_json(run),
+    }
+
+class MetricsCache:
+    """ Encoded JSON documents, built from history on first request and
+        kept until the digest of the latest recorded dump changes """
+    def __init__(self, history: History.HistoryStore, window: int):
+        self.history = history
+        self.window = window
+        self.lock = threading.Lock()
+        self.digest: Optional[str] = None
+        self.documents: Dict[Tuple, Tuple[bytes, str]] = {}
+
+    def get(self, path: str, query: Dict[str, str]) -> Optional[Tuple[bytes, str]]:
+        """ (body, ETag) of a document, or None for an unknown path;
+            raises ValueError for a bad query """
+        # history is shared by every request thread
+        with self.lock:
+            digest = self.history.latest_digest()
+            if (digest != self.digest) or (len(self.documents) >= MAX_DOCUMENTS):
+                self.documents.clear()
+                self.digest = digest
+
+            key = (path, tuple(sorted(query.items())))
+            document = self.documents.get(key)
+            if document is None:
+                value = self.build(path, query)
+                if value is None:
+                    return None
+                body = json.dumps(value, separators=(',', ':')).encode()
+                document = self.documents[key] = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+            return document
+
+    def build(self, path: str, query: Dict[str, str]):
+        if path == '/':
+            return {'digest': self.digest, 'endpoints': ENDPOINTS}
+
+        if path == '/history':
+            count = query.get('count', str(self.window))
+            if (not count.isdigit()) or (int(count) < 1):
+                raise ValueError('count must be a number of at least 1')
+            count = int(count)
+            return [run_json(run) for run in self.history.window(count)]
+
+        if path == '/trend':
+            return [run_json(run) for run in self.history.trend(self.window)]
+
+        if path in ('/latest', '/counters'):
+            run = self.history.latest()
+            if run is None:
+                return None
+            if path == '/latest':
+                return dict(run_json(run), digest=self.digest)
+
+            tier = query.get('tier')
+            platform = query.get('platform')
+            if (tier is not None) and (tier not in Types.TIERS[1:]):
+                raise ValueError(f"unknown tier '{tier}'")
+            if (platform is not None) and (platform not in run.platforms):
+                raise ValueError(f"unknown platform '{platform}'")
+            return counters_json(run, tier, platform)
+
+        return None
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], cache: MetricsCache):
+        super().__init__(address, MetricsHandler)
+        self.cache = cache
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """ GET (and HEAD) only; every response carries an ETag, and a
+        matching If-None-Match gets an empty 304 """
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def respond(self, with_body: bool) -> None:
+        url = urlsplit(self.path)
+        try:
+            document = self.server.cache.get(url.path.rstrip('/') or '/', dict(parse_qsl(url.query)))
+        except ValueError as e:
+            self.send_error_json(400, str(e), with_body)
+            return
+        if document is None:
+            self.send_error_json(404, f"nothing at '{url.path}'", with_body)
+            return
+
+        body, etag = document
+        tags = [tag.strip().removeprefix('W/') for tag in self.headers.get('If-None-Match', '').split(',')]
+        if (etag in tags) or ('*' in tags):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        # clients may keep a copy, but must revalidate it
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def send_error_json(self, code: int, message: str, with_body: bool) -> None:
+        body = json.dumps({'error': message}).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+def serve(history: History.HistoryStore, address: str, port: int, window: int) -> None:
+    """ Serve until interrupted or terminated """
+    # let SIGTERM unwind through the callers' cleanup like Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    server = MetricsServer((address, port), MetricsCache(history, window))
+    print(f'Serving metrics on http://{address}:{server.server_address[1]}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,94 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Suites                                                          #
+#                                                                         #
+# Multi-suite configuration and concurrent git round-trips                #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import os
+import json
+import asyncio
+
+from argparse       import Namespace
+from dataclasses    import dataclass, field
+
+from typing         import List, Optional, Tuple
+
+# options that select a mode of the whole invocation, not of one suite
+GLOBAL_OPTIONS = {'suites', 'daemon', 'interval', 'backfill', 'since', 'check'}
+
+@dataclass
+class Suite:
+    """ One tracked repo (e.g., a Firefox channel) and its run state """
+    name: str
+    options: Namespace
+    changed: bool = False
+    previous_digest: Optional[str] = None
+    current_digest: Optional[str] = None
+    files: List[str] = field(default_factory=list)
+    committed: bool = False
+    error: Optional[str] = None
+
+def load_suites(config_file: str, defaults: Namespace) -> List[Suite]:
+    """ Read a JSON suite list:
+
+            {"suites": [{"name": "nightly", "repo": "/srv/cts-nightly"},
+                        {"name": "beta", "repo": "/srv/cts-beta", "maxhistory": 20}]}
+
+        Every key other than 'name' is a command line option (by its long
+        name, with dashes as underscores) overriding the invocation's own
+        value for that suite.  A relative 'repo' is taken from the folder
+        of the config file. """
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    suites = []
+    for entry in config.get('suites', []):
+        entry = dict(entry)
+        options = Namespace(**vars(defaults))
+        name = entry.pop('name', None) or os.path.basename(os.path.normpath(entry.get('repo') or ''))
+        for key, value in entry.items():
+            key = key.replace('-', '_')
+            if (key not in vars(defaults)) or (key in GLOBAL_OPTIONS):
+                raise ValueError(f"suite '{name}' sets an unknown option '{key}'")
+            if key == 'repo':
+                # relative repos are found next to the config
+                value = os.path.join(os.path.dirname(os.path.abspath(config_file)), value)
+            setattr(options, key, value)
+        if options.profile is not None:
+            # each suite's timings go in a folder of its own
+            options.profile = os.path.join(options.profile, name)
+        suites.append(Suite(name, options))
+
+    names = [suite.name for suite in suites]
+    repos = [os.path.realpath(suite.options.repo or '') for suite in suites]
+    if not suites:
+        raise ValueError(f"'{config_file}' lists no suites")
+    if len(set(names)) != len(names):
+        raise ValueError('suite names must be unique')
+    # history, charts and commits live in the repo, so suites cannot share one
+    if len(set(repos)) != len(repos):
+        raise ValueError('every suite needs a repo of its own')
+
+    return suites
+
+async def git_async(repo: str, *args: str) -> Tuple[int, str]:
+    """ Run a git command without blocking the other suites' commands """
+    process = await asyncio.create_subprocess_exec('git', *args, cwd=repo, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    output, _ = await process.communicate()
+    return process.returncode, output.decode(errors='replace')
+
+def git_all(suites: List[Suite], *args: str) -> List[Tuple[int, str]]:
+    """ Run the same git command in every suite's repo at once; the
+        round-trips (fetch, push) are network bound, so the whole set
+        takes about as long as the slowest of them """
+    async def run_all():
+        return await asyncio.gather(*(git_async(suite.options.repo, *args) for suite in suites))
+    return asyncio.run(run_all())
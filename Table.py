@@ -0,0 +1,374 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Table                                                           #
+#                                                                         #
+# Columnar per-result table with group-by aggregation                     #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import sys
+import zlib
+import pickle
+import importlib.util
+
+from array          import array
+from collections    import Counter
+from dataclasses    import dataclass, field
+
+from typing         import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import Types
+import Index
+
+LEVELS = ['test', 'subtest']
+TEST, SUBTEST = range(len(LEVELS))
+
+# one row per (test or subtest, platform, build); every column is a small
+# integer, with names and expectation sets interned in side tables
+COLUMNS = {
+    'level': 'b',       # TEST or SUBTEST
+    'category': 'I',    # index into categories
+    'tier': 'b',        # 2 or 3, 0 when disabled
+    'platform': 'H',    # index into platforms
+    'build': 'b',       # Types.DEBUG or Types.OPTIMIZED
+    'expected': 'H',    # index into outcomes; 0 is no expectation
+    'disabled': 'b',
+    'tiered': 'b',      # the platform counts toward the entry's tier
+}
+
+# how each level's results land in the RunInfo counters, and the
+# expectation that counts as a pass
+LEVEL_METRICS = {
+    TEST: (Types.TEST_TIER, Types.TEST_INTERMITTENT, Types.TEST_PASSING, 'OK'),
+    SUBTEST: (Types.SUBTEST_TIER, Types.SUBTEST_INTERMITTENT, Types.SUBTEST_PASSING, 'PASS'),
+}
+
+HAVE_NUMPY = importlib.util.find_spec('numpy') is not None
+
+@dataclass
+class ResultTable:
+    """ The results of a run as columns.  Any counter is a group-by over
+        the rows, so new metrics need neither a re-parse nor new RunInfo
+        fields. """
+    categories: List[str] = field(default_factory=list)
+    platforms: List[str] = field(default_factory=lambda: list(Types.PLATFORMS))
+    outcomes: List[Tuple[str, ...]] = field(default_factory=lambda: [()])
+    columns: Dict[str, array] = field(default_factory=lambda: {name: array(code) for name, code in COLUMNS.items()})
+
+    # per-entry totals that are not per-platform
+    test_count: int = 0
+    subtest_count: int = 0
+    disabled_test_count: int = 0
+    disabled_subtest_count: int = 0
+    status_ids: List[Set[str]] = field(default_factory=lambda: [set(), set()])
+
+    # platforms in the order RunInfo would have interned them
+    interned: List[int] = field(default_factory=lambda: list(range(len(Types.PLATFORMS))))
+
+    def __post_init__(self):
+        self.category_ids = {name: i for i, name in enumerate(self.categories)}
+        self.platform_ids = {name: i for i, name in enumerate(self.platforms)}
+        self.outcome_ids = {outcome: i for i, outcome in enumerate(self.outcomes)}
+        self.interned_ids = set(self.interned)
+
+    def __len__(self) -> int:
+        return len(self.columns['level'])
+
+    def category(self, name: str) -> int:
+        category_id = self.category_ids.get(name)
+        if category_id is None:
+            category_id = self.category_ids[name] = len(self.categories)
+            self.categories.append(name)
+        return category_id
+
+    def platform(self, name: str) -> int:
+        platform_id = self.platform_ids.get(name)
+        if platform_id is None:
+            platform_id = self.platform_ids[name] = len(self.platforms)
+            self.platforms.append(name)
+        return platform_id
+
+    def outcome(self, outcome: Tuple[str, ...]) -> int:
+        outcome_id = self.outcome_ids.get(outcome)
+        if outcome_id is None:
+            outcome_id = self.outcome_ids[outcome] = len(self.outcomes)
+            self.outcomes.append(outcome)
+        return outcome_id
+
+    def intern(self, platform_id: int) -> None:
+        if platform_id not in self.interned_ids:
+            self.interned_ids.add(platform_id)
+            self.interned.append(platform_id)
+
+    def add_category(self, category: str, cat: dict, index: Optional[Index.IndexBuilder] = None) -> None:
+        """ Add the rows of one top-level category of the run output """
+        category_id = category[69:].replace('.html.ini','').replace('\\','_')
+        row_category = self.category(category_id)
+
+        for chunk in cat:
+            if chunk != 'tests':
+                continue
+            for test_name, test in cat[chunk].items():
+                self.test_count += 1
+                for item in test:
+                    if item == 'properties':
+                        tier = self.add_entry(TEST, row_category, test[item])
+                        if index is not None:
+                            index.add(category_id, test_name, tier, tier == 0, test[item].get('expected'))
+                    elif item == 'subtests':
+                        for child, subtest in test[item].items():
+                            # every field of a subtest was historically
+                            # counted as a subtest
+                            for field_name in subtest:
+                                self.subtest_count += 1
+                                if field_name == 'properties':
+                                    tier = self.add_entry(SUBTEST, row_category, subtest[field_name])
+                                    if index is not None:
+                                        index.add(category_id, f'{test_name}/{child}', tier, tier == 0, subtest[field_name].get('expected'), subtest=True)
+
+    def add_entry(self, level: int, category: int, properties: dict) -> int:
+        """ Add the rows of one test or subtest; returns its tier (0 if disabled) """
+        status = properties.get('implementation_status')
+        expected = properties.get('expected')
+        disabled = properties['is_disabled']
+
+        # platform -> whether it counts toward the tier, in first-seen order
+        tiered: Dict[int, int] = {}
+        if disabled:
+            tier = 0
+            if level == TEST:
+                self.disabled_test_count += 1
+            else:
+                self.disabled_subtest_count += 1
+        elif status is not None:
+            tier = 3
+            for name in status:
+                self.status_ids[level].add(status[name]['Debug'])
+                self.status_ids[level].add(status[name]['Optimized'])
+                platform_id = self.platform(name)
+                self.intern(platform_id)
+                tiered[platform_id] = 1
+        else:
+            # 'null' is tier 2
+            tier = 2
+            for platform_id in range(len(Types.PLATFORMS)):
+                tiered[platform_id] = 1
+
+        outcomes: Dict[int, Tuple[int, int]] = {}
+        if expected is not None:
+            passing = LEVEL_METRICS[level][3]
+            for name in expected:
+                debug = tuple(expected[name]['Debug'])
+                optimized = tuple(expected[name]['Optimized'])
+                platform_id = self.platform(name)
+                tiered.setdefault(platform_id, 0)
+                outcomes[platform_id] = (self.outcome(debug), self.outcome(optimized))
+                # a platform is only interned once something is counted for it
+                if (not disabled) and ((debug == (passing,)) or (len(debug) > 1) or (len(optimized) > 1)):
+                    self.intern(platform_id)
+
+        columns = self.columns
+        for platform_id, counts_tier in tiered.items():
+            codes = outcomes.get(platform_id, (0, 0))
+            for build in range(len(Types.BUILDS)):
+                columns['level'].append(level)
+                columns['category'].append(category)
+                columns['tier'].append(tier)
+                columns['platform'].append(platform_id)
+                columns['build'].append(build)
+                columns['expected'].append(codes[build])
+                columns['disabled'].append(1 if disabled else 0)
+                columns['tiered'].append(counts_tier)
+        return tier
+
+    def merge(self, other: 'ResultTable') -> None:
+        """ Append the rows of a partial table (e.g., one shard of the categories) """
+        categories = [self.category(name) for name in other.categories]
+        platforms = [self.platform(name) for name in other.platforms]
+        outcomes = [self.outcome(outcome) for outcome in other.outcomes]
+
+        remap = {'category': categories, 'platform': platforms, 'expected': outcomes}
+        for name, column in self.columns.items():
+            if name in remap:
+                column.extend(map(remap[name].__getitem__, other.columns[name]))
+            else:
+                column.extend(other.columns[name])
+
+        for name in ('test_count', 'subtest_count', 'disabled_test_count', 'disabled_subtest_count'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for level in range(len(LEVELS)):
+            self.status_ids[level].update(other.status_ids[level])
+        for platform_id in other.interned:
+            self.intern(platforms[platform_id])
+
+    def cardinality(self, name: str) -> int:
+        """ Number of distinct codes a column can hold """
+        if name == 'category':
+            return len(self.categories)
+        elif name == 'platform':
+            return len(self.platforms)
+        elif name == 'expected':
+            return len(self.outcomes)
+        elif name == 'level':
+            return len(LEVELS)
+        elif name == 'tier':
+            return len(Types.TIERS)
+        elif name == 'build':
+            return len(Types.BUILDS)
+        return 2
+
+    def matching_outcomes(self, predicate: Callable[[Tuple[str, ...]], bool]) -> Set[int]:
+        """ Outcome codes whose expectation set satisfies 'predicate', for
+            use as an 'expected' filter """
+        return {i for i, outcome in enumerate(self.outcomes) if predicate(outcome)}
+
+    def count(self, by: Sequence[str], **where) -> Dict[Tuple[int, ...], int]:
+        """ Count the rows matching 'where' (column=value, or column=set of
+            values), grouped by the 'by' columns """
+        if HAVE_NUMPY:
+            return self.count_numpy(by, where)
+
+        selected = [(self.columns[name], value if isinstance(value, (set, frozenset)) else {value}) for name, value in where.items()]
+        keys = [self.columns[name] for name in by]
+        rows = range(len(self))
+        for column, values in selected:
+            rows = [row for row in rows if column[row] in values]
+        return dict(Counter(tuple(key[row] for key in keys) for row in rows))
+
+    def count_numpy(self, by: Sequence[str], where: dict) -> Dict[Tuple[int, ...], int]:
+        import numpy as np
+
+        if len(self) == 0:
+            return {}
+
+        keep = np.ones(len(self), dtype=bool)
+        for name, value in where.items():
+            column = np.frombuffer(self.columns[name], dtype=self.columns[name].typecode)
+            if isinstance(value, (set, frozenset)):
+                keep &= np.isin(column, np.fromiter(value, dtype=np.int64, count=len(value)))
+            else:
+                keep &= column == value
+
+        if not by:
+            return {(): int(keep.sum())}
+
+        keys = [np.frombuffer(self.columns[name], dtype=self.columns[name].typecode)[keep].astype(np.int64) for name in by]
+        shape = tuple(self.cardinality(name) for name in by)
+        totals = np.bincount(np.ravel_multi_index(keys, shape), minlength=int(np.prod(shape)))
+        return {tuple(int(i) for i in np.unravel_index(flat, shape)): int(totals[flat]) for flat in np.flatnonzero(totals)}
+
+    def fill(self, run_info: Types.RunInfo, ids: Types.Ids) -> None:
+        """ Produce the RunInfo counters and Ids as queries over the table """
+        for name in ('test_count', 'subtest_count', 'disabled_test_count', 'disabled_subtest_count'):
+            setattr(run_info, name, getattr(run_info, name) + getattr(self, name))
+        for platform_id in self.interned:
+            run_info.intern(self.platforms[platform_id])
+
+        intermittent = self.matching_outcomes(lambda outcome: len(outcome) > 1)
+        for level, (tier_metric, intermittent_metric, passing_metric, passing) in LEVEL_METRICS.items():
+            enabled = {'level': level, 'disabled': 0}
+
+            for (tier, platform_id), n in self.count(('tier', 'platform'), build=Types.DEBUG, tiered=1, **enabled).items():
+                run_info.add(tier_metric, tier, self.platforms[platform_id], Types.DEBUG, n)
+
+            # a pass is judged by the Debug expectation for both builds
+            passes = self.matching_outcomes(lambda outcome: outcome == (passing,))
+            for (tier, platform_id), n in self.count(('tier', 'platform'), build=Types.DEBUG, expected=passes, **enabled).items():
+                run_info.add(passing_metric, tier, self.platforms[platform_id], Types.DEBUG, n)
+                run_info.add(passing_metric, tier, self.platforms[platform_id], Types.OPTIMIZED, n)
+
+            for (tier, platform_id, build), n in self.count(('tier', 'platform', 'build'), expected=intermittent, **enabled).items():
+                run_info.add(intermittent_metric, tier, self.platforms[platform_id], build, n)
+
+            expected_ids = ids.tests_properties_expected_ids if level == TEST else ids.subtests_properties_expected_ids
+            for (outcome_id,) in self.count(('expected',), **enabled):
+                expected_ids.update(self.outcomes[outcome_id])
+
+        ids.test_implementation_status_ids.update(self.status_ids[TEST])
+        ids.subtest_implementation_status_ids.update(self.status_ids[SUBTEST])
+
+    def save(self, file_name: str) -> None:
+        with open(file_name, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(self)))
+
+    @staticmethod
+    def load(file_name: str) -> 'ResultTable':
+        with open(file_name, 'rb') as f:
+            return pickle.loads(zlib.decompress(f.read()))
+
+    def __getstate__(self):
+        # the lookup dicts are rebuilt from the lists on load
+        return {name: value for name, value in self.__dict__.items() if name not in ('category_ids', 'platform_ids', 'outcome_ids', 'interned_ids')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__post_init__()
+
+    def label(self, name: str, code: int) -> str:
+        """ Readable form of a column code """
+        if name == 'category':
+            return self.categories[code]
+        elif name == 'platform':
+            return self.platforms[code]
+        elif name == 'expected':
+            return '|'.join(self.outcomes[code]) or '-'
+        elif name == 'level':
+            return LEVELS[code]
+        elif name == 'build':
+            return Types.BUILDS[code]
+        return str(code)
+
+    def code(self, name: str, label: str) -> int:
+        """ Column code of a readable value (the inverse of label) """
+        if name == 'category':
+            return self.category_ids[label]
+        elif name == 'platform':
+            return self.platform_ids[label]
+        elif name == 'expected':
+            return self.outcome_ids[tuple(label.split('|')) if label != '-' else ()]
+        elif (name == 'level') and (label in LEVELS):
+            return LEVELS.index(label)
+        elif (name == 'build') and (label in Types.BUILDS):
+            return Types.BUILDS.index(label)
+        return int(label)
+
+if __name__ == "__main__":
+    from argparse   import ArgumentParser
+
+    import Parse
+
+    parser = ArgumentParser(description="Group-by counts over the results of a run")
+    parser.add_argument("source", metavar="FILE", type=str, help="A dump, or a cached .table file")
+    parser.add_argument("-b", "--by", metavar="COLUMN", nargs="*", default=[], choices=list(COLUMNS), help="Columns to group by")
+    parser.add_argument("-w", "--where", metavar="COLUMN=VALUE", nargs="*", default=[], help="Filters; a value may be a name (e.g., level=subtest platform=Linux)")
+
+    options = parser.parse_args()
+
+    if options.source.endswith('.table'):
+        table = ResultTable.load(options.source)
+    else:
+        table = ResultTable()
+        Parse.extract_current_run_info(Types.RunInfo(), options.source, Types.Ids(), streaming=True, table=table)
+
+    where = {}
+    for condition in options.where:
+        name, _, value = condition.partition('=')
+        if name not in COLUMNS:
+            print(f"Error: unknown column '{name}'")
+            sys.exit(1)
+        try:
+            where[name] = {table.code(name, label) for label in value.split(',')}
+        except (KeyError, ValueError):
+            print(f"Error: '{value}' is not a value of column '{name}'")
+            sys.exit(1)
+
+    for key, n in sorted(table.count(options.by, **where).items()):
+        print('\t'.join([table.label(name, code) for name, code in zip(options.by, key)] + [str(n)]))
+
+    sys.exit(0)
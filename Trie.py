@@ -0,0 +1,167 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: Trie                                                            #
+#                                                                         #
+# Category path trie with per-subtree rollups                             #
+#-------------------------------------------------------------------------#
+
+__author__     = "Bob Hood"
+__version__    = "1.0"
+__maintainer__ = "Bob Hood"
+__email__      = "bhood@mozilla.com"
+__status__     = "Production"
+
+import re
+import sys
+import zlib
+import pickle
+
+from dataclasses    import dataclass, field
+
+from typing         import Dict, Iterator, List
+
+import Types
+
+METRICS = ['tests', 'subtests', 'disabled', 'passing', 'failing', 'intermittent']
+TESTS, SUBTESTS, DISABLED, PASSING, FAILING, INTERMITTENT = range(len(METRICS))
+
+# category keys are file paths; the dumps have been seen with both separators
+PATH_SEPARATORS = re.compile(r'[\\/]')
+
+@dataclass
+class TrieNode:
+    name: str
+    path: str
+    depth: int
+    children: Dict[str, 'TrieNode'] = field(default_factory=dict)
+    # what was counted at this node itself (only category leaves have any)
+    counts: List[int] = field(default_factory=lambda: [0] * len(METRICS))
+    # counts of the whole subtree, filled in by CategoryTrie.rollup()
+    totals: List[int] = field(default_factory=lambda: [0] * len(METRICS))
+
+class CategoryTrie:
+    """ Prefix tree of the category paths of a run.  Results are counted
+        at the category leaves as the dump is parsed, then rolled up to
+        every ancestor at once. """
+    def __init__(self):
+        self.root = TrieNode('', '', 0)
+
+    def leaf(self, path: str) -> TrieNode:
+        """ The node of a category path, created along with any missing ancestors """
+        node = self.root
+        for name in PATH_SEPARATORS.split(path):
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = TrieNode(name, f'{node.path}/{name}' if node.path else name, node.depth + 1)
+            node = child
+        return node
+
+    def add_category(self, category: str, cat: dict) -> None:
+        """ Count one top-level category of the run output at its leaf """
+        counts = self.leaf(category[69:].replace('.html.ini','')).counts
+
+        tests = cat.get('tests') or {}
+        counts[TESTS] += len(tests)
+        for test in tests.values():
+            if 'properties' in test:
+                self.count_properties(counts, test['properties'], 'OK')
+            for subtest in (test.get('subtests') or {}).values():
+                counts[SUBTESTS] += 1
+                if 'properties' in subtest:
+                    self.count_properties(counts, subtest['properties'], 'PASS')
+
+    @staticmethod
+    def count_properties(counts: List[int], properties: dict, passing: str) -> None:
+        if properties['is_disabled']:
+            counts[DISABLED] += 1
+            return
+
+        expected = properties.get('expected')
+        if expected is not None:
+            # every platform and build expectation is one result
+            for platform in expected.values():
+                for build in Types.BUILDS:
+                    outcome = platform[build]
+                    if len(outcome) > 1:
+                        counts[INTERMITTENT] += 1
+                    elif outcome == [passing]:
+                        counts[PASSING] += 1
+                    elif outcome:
+                        counts[FAILING] += 1
+
+    def merge(self, other: 'CategoryTrie') -> None:
+        """ Fold in the leaf counts of a partial trie (e.g., one shard of the categories) """
+        for node in other.nodes():
+            if any(node.counts):
+                counts = self.leaf(node.path).counts
+                for i, value in enumerate(node.counts):
+                    counts[i] += value
+
+    def nodes(self) -> Iterator[TrieNode]:
+        """ Every node below the root, parents before their children """
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+    def rollup(self) -> None:
+        """ Total every subtree in a single bottom-up pass """
+        order = [self.root] + list(self.nodes())
+        for node in reversed(order):
+            totals = list(node.counts)
+            for child in node.children.values():
+                for i, value in enumerate(child.totals):
+                    totals[i] += value
+            node.totals = totals
+
+    def base(self) -> TrieNode:
+        """ The first node where category paths branch; the prefix above it
+            is shared by every category and says nothing """
+        node = self.root
+        while (len(node.children) == 1) and (not any(node.counts)):
+            node = next(iter(node.children.values()))
+        return node
+
+    def top(self, metric: int, count: int = 10, depth: int = 1) -> List[TrieNode]:
+        """ The 'count' subtrees 'depth' levels below the base with the
+            highest rolled-up 'metric' """
+        depth += self.base().depth
+        candidates = [node for node in self.nodes() if (node.depth == depth) and node.totals[metric]]
+        candidates.sort(key=lambda node: (-node.totals[metric], node.path))
+        return candidates[:count]
+
+    def save(self, file_name: str) -> None:
+        with open(file_name, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(self)))
+
+    @staticmethod
+    def load(file_name: str) -> 'CategoryTrie':
+        with open(file_name, 'rb') as f:
+            return pickle.loads(zlib.decompress(f.read()))
+
+if __name__ == "__main__":
+    from argparse   import ArgumentParser
+
+    import Parse
+
+    parser = ArgumentParser(description="Rank the category subtrees of a run")
+    parser.add_argument("source", metavar="FILE", type=str, help="A dump, or a cached .trie file")
+    parser.add_argument("-m", "--metric", default='intermittent', choices=METRICS, help="What to rank by")
+    parser.add_argument("-n", "--count", metavar="COUNT", default=10, type=int, help="How many subtrees to list")
+    parser.add_argument("-d", "--depth", metavar="DEPTH", default=1, type=int, help="Depth of the subtrees below the prefix all categories share")
+
+    options = parser.parse_args()
+
+    if options.source.endswith('.trie'):
+        trie = CategoryTrie.load(options.source)
+    else:
+        trie = CategoryTrie()
+        Parse.extract_current_run_info(Types.RunInfo(), options.source, Types.Ids(), streaming=True, trie=trie)
+
+    metric = METRICS.index(options.metric)
+    for node in trie.top(metric, options.count, options.depth):
+        print(f'{node.totals[metric]:8}  {node.path}')
+
+    sys.exit(0)
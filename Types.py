@@ -12,69 +12,214 @@ __maintainer__ = "Bob Hood"
 __email__      = "bhood@mozilla.com"
 __status__     = "Production"
 
-from copy           import deepcopy
-from dataclasses    import dataclass
+import zlib
 
-from typing         import Dict
+from array          import array
+from dataclasses    import dataclass, field, fields
+
+from typing         import List, Set
 
 PLATFORMS = ['Windows', 'MacOs', 'Linux']
 # first is empty so indexnig matches tier numbers
 TIERS = [None, 'Tier 1', 'Tier 2', 'Tier 3']
+BUILDS = ['Debug', 'Optimized']
+
+# counter metrics; tier counts do not vary by build, so they only use
+# the Debug slot of the build axis
+METRICS = ['test_tier', 'test_intermittent', 'test_passing',
+           'subtest_tier', 'subtest_intermittent', 'subtest_passing']
+
+TEST_TIER, TEST_INTERMITTENT, TEST_PASSING, SUBTEST_TIER, SUBTEST_INTERMITTENT, SUBTEST_PASSING = range(len(METRICS))
+DEBUG, OPTIMIZED = range(len(BUILDS))
+
+# the historical per-counter attribute names, mapped onto (metric, build)
+COUNTERS = {
+    'test_tier_count' : (TEST_TIER, DEBUG),
+    'test_dbg_intermittent_count' : (TEST_INTERMITTENT, DEBUG),
+    'test_opt_intermittent_count' : (TEST_INTERMITTENT, OPTIMIZED),
+    'test_dbg_passing_count' : (TEST_PASSING, DEBUG),
+    'test_opt_passing_count' : (TEST_PASSING, OPTIMIZED),
+    'subtest_tier_count' : (SUBTEST_TIER, DEBUG),
+    'subtest_dbg_intermittent_count' : (SUBTEST_INTERMITTENT, DEBUG),
+    'subtest_opt_intermittent_count' : (SUBTEST_INTERMITTENT, OPTIMIZED),
+    'subtest_dbg_passing_count' : (SUBTEST_PASSING, DEBUG),
+    'subtest_opt_passing_count' : (SUBTEST_PASSING, OPTIMIZED),
+}
+
+class TierCounts:
+    """ Dict-like view of one tier of a counter, keyed by platform name """
+    def __init__(self, run_info: 'RunInfo', metric: int, tier: int, build: int):
+        self.run_info = run_info
+        self.metric = metric
+        self.tier = tier
+        self.build = build
+
+    def __getitem__(self, platform: str) -> int:
+        if platform not in self.run_info.platform_ids:
+            raise KeyError(platform)
+        return self.run_info.counts[self.run_info.index(self.metric, self.tier, self.run_info.platform_ids[platform], self.build)]
+
+    def __setitem__(self, platform: str, value: int) -> None:
+        platform_id = self.run_info.intern(platform)
+        self.run_info.counts[self.run_info.index(self.metric, self.tier, platform_id, self.build)] = value
+
+    def __contains__(self, platform: str) -> bool:
+        return platform in self.run_info.platform_ids
+
+    def __iter__(self):
+        return iter(list(self.run_info.platforms))
+
+    def items(self):
+        return [(platform, self[platform]) for platform in self.run_info.platforms]
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+class Counter:
+    """ Dict-like view of a counter, keyed by tier name, then platform name """
+    def __init__(self, run_info: 'RunInfo', metric: int, build: int):
+        self.run_info = run_info
+        self.metric = metric
+        self.build = build
+
+    def __getitem__(self, tier: str) -> TierCounts:
+        if tier not in TIERS[1:]:
+            raise KeyError(tier)
+        return TierCounts(self.run_info, self.metric, TIERS.index(tier), self.build)
+
+    def __contains__(self, tier: str) -> bool:
+        return tier in TIERS[1:]
+
+    def __iter__(self):
+        return iter(TIERS[1:])
+
+    def __repr__(self) -> str:
+        return repr({tier: dict(self[tier].items()) for tier in TIERS[1:]})
+
+def _counter_property(name: str) -> property:
+    metric, build = COUNTERS[name]
+    return property(lambda self: Counter(self, metric, build))
 
 @dataclass
 class RunInfo:
+    """ Counters for a single run, held in one dense integer array indexed
+        by [metric, tier, platform, build].  Platforms are interned to
+        integer ids in the order they are first seen. """
     run_date: float = 0.0
 
     chunk_count: int = 0
 
     test_count: int = 0
-    test_tier_count: Dict[str, Dict[str, int]] = None
-
-    test_dbg_intermittent_count: Dict[str, Dict[str, int]] = None
-    test_opt_intermittent_count: Dict[str, Dict[str, int]] = None
-
-    test_dbg_passing_count: Dict[str, Dict[str, int]] = None
-    test_opt_passing_count: Dict[str, Dict[str, int]] = None
-
     subtest_count: int = 0
-    subtest_tier_count: Dict[str, Dict[str, int]] = None
-
-    subtest_dbg_intermittent_count: Dict[str, Dict[str, int]] = None
-    subtest_opt_intermittent_count: Dict[str, Dict[str, int]] = None
-
-    subtest_dbg_passing_count: Dict[str, Dict[str, int]] = None
-    subtest_opt_passing_count: Dict[str, Dict[str, int]] = None
 
     disabled_test_count: int = 0
     disabled_subtest_count: int = 0
 
-    def __post_init__(self):
-        platform_map = {}
-        for platform in PLATFORMS:
-            platform_map[platform] = 0
+    platforms: List[str] = field(default_factory=lambda: list(PLATFORMS))
+    counts: array = None
 
-        tier_platform_map = {}
-        for tier in TIERS[1:]:
-            tier_platform_map[tier] = deepcopy(platform_map)
+    # compatible tier -> platform views of the individual counters
+    test_tier_count = _counter_property('test_tier_count')
 
-        self.test_tier_count = deepcopy(tier_platform_map)
-        self.subtest_tier_count = deepcopy(tier_platform_map)
+    test_dbg_intermittent_count = _counter_property('test_dbg_intermittent_count')
+    test_opt_intermittent_count = _counter_property('test_opt_intermittent_count')
 
-        self.test_dbg_intermittent_count = deepcopy(tier_platform_map)
-        self.test_opt_intermittent_count = deepcopy(tier_platform_map)
+    test_dbg_passing_count = _counter_property('test_dbg_passing_count')
+    test_opt_passing_count = _counter_property('test_opt_passing_count')
 
-        self.test_dbg_passing_count = deepcopy(tier_platform_map)
-        self.test_opt_passing_count = deepcopy(tier_platform_map)
+    subtest_tier_count = _counter_property('subtest_tier_count')
 
-        self.subtest_dbg_intermittent_count = deepcopy(tier_platform_map)
-        self.subtest_opt_intermittent_count = deepcopy(tier_platform_map)
+    subtest_dbg_intermittent_count = _counter_property('subtest_dbg_intermittent_count')
+    subtest_opt_intermittent_count = _counter_property('subtest_opt_intermittent_count')
 
-        self.subtest_dbg_passing_count = deepcopy(tier_platform_map)
-        self.subtest_opt_passing_count = deepcopy(tier_platform_map)
+    subtest_dbg_passing_count = _counter_property('subtest_dbg_passing_count')
+    subtest_opt_passing_count = _counter_property('subtest_opt_passing_count')
+
+    def __post_init__(self):
+        self.platform_ids = {platform: i for i, platform in enumerate(self.platforms)}
+        if self.counts is None:
+            self.counts = array('i', bytes(4 * self.size(len(self.platforms))))
+
+    @staticmethod
+    def size(platform_count: int) -> int:
+        return len(METRICS) * len(TIERS) * platform_count * len(BUILDS)
+
+    def index(self, metric: int, tier: int, platform: int, build: int) -> int:
+        """ Offset of a single counter in the dense array """
+        return ((metric * len(TIERS) + tier) * len(self.platforms) + platform) * len(BUILDS) + build
+
+    def intern(self, platform: str) -> int:
+        """ Integer id of a platform, growing the platform axis for new names """
+        platform_id = self.platform_ids.get(platform)
+        if platform_id is None:
+            old_count = len(self.platforms)
+            counts = array('i', bytes(4 * self.size(old_count + 1)))
+            stride = old_count * len(BUILDS)
+            for row in range(len(METRICS) * len(TIERS)):
+                counts[row * (stride + len(BUILDS)):row * (stride + len(BUILDS)) + stride] = self.counts[row * stride:(row + 1) * stride]
+            self.counts = counts
+
+            platform_id = old_count
+            self.platforms.append(platform)
+            self.platform_ids[platform] = platform_id
+        return platform_id
+
+    def add(self, metric: int, tier: int, platform: str, build: int = DEBUG, value: int = 1) -> None:
+        """ Bump a single counter, interning the platform if it is new """
+        platform_id = self.platform_ids.get(platform)
+        if platform_id is None:
+            platform_id = self.intern(platform)
+        self.counts[((metric * len(TIERS) + tier) * len(self.platforms) + platform_id) * len(BUILDS) + build] += value
+
+    def merge(self, other: 'RunInfo') -> None:
+        """ Fold the counters of a partial run (e.g., one shard of the
+            categories) into this one """
+        for name in ('chunk_count', 'test_count', 'subtest_count', 'disabled_test_count', 'disabled_subtest_count'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+        for platform in other.platforms:
+            self.intern(platform)
+
+        if self.platforms == other.platforms:
+            self.counts = array('i', map(int.__add__, self.counts, other.counts))
+        else:
+            for metric in range(len(METRICS)):
+                for tier in range(len(TIERS)):
+                    for platform_id, platform in enumerate(other.platforms):
+                        for build in range(len(BUILDS)):
+                            self.counts[self.index(metric, tier, self.platform_ids[platform], build)] += other.counts[other.index(metric, tier, platform_id, build)]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['platform_ids']
+        # most counters are zero, so the array compresses to a few bytes
+        state['counts'] = zlib.compress(self.counts.tobytes())
+        return state
+
+    def __setstate__(self, state):
+        legacy = {name: state.pop(name) for name in COUNTERS if name in state}
+        self.__dict__.update(state)
+        if isinstance(self.counts, bytes):
+            self.counts = array('i', zlib.decompress(self.counts))
+        if legacy:
+            # history pickled before the counters were array-backed
+            self.platforms = list(PLATFORMS)
+            self.counts = None
+        self.__post_init__()
+        for name, tiers in legacy.items():
+            counter = getattr(self, name)
+            for tier in tiers:
+                for platform in tiers[tier]:
+                    counter[tier][platform] = tiers[tier][platform]
 
 @dataclass
 class Ids:
-    tests_properties_expected_ids = set()
-    subtests_properties_expected_ids = set()
-    test_implementation_status_ids = set()
-    subtest_implementation_status_ids = set()
+    tests_properties_expected_ids: Set[str] = field(default_factory=set)
+    subtests_properties_expected_ids: Set[str] = field(default_factory=set)
+    test_implementation_status_ids: Set[str] = field(default_factory=set)
+    subtest_implementation_status_ids: Set[str] = field(default_factory=set)
+
+    def merge(self, other: 'Ids') -> None:
+        """ Fold the ids seen by a partial run into this one """
+        for f in fields(self):
+            getattr(self, f.name).update(getattr(other, f.name))
@@ -14,19 +14,35 @@ __status__     = "Production"
 
 import os
 import sys
-import pickle
+import traceback
 import subprocess
-import importlib.util
 
 from argparse       import ArgumentParser
-from typing         import List
+from concurrent.futures import ProcessPoolExecutor
+from typing         import Dict, List, Optional, Tuple
 
 import Plot
 import Types
 import Parse
-
-HAVE_MATPLOTLIB = importlib.util.find_spec('matplotlib') is not None
-HAVE_ALTAIR = importlib.util.find_spec('altair') is not None
+import Cache
+import Index
+import Flaky
+import Export
+import Trie
+import Table
+import Daemon
+import Dashboard
+import Backfill
+import Suites
+import Pipeline
+import Server
+import History
+import Profile
+
+# history, and history from before the database, relative to the repo
+HISTORY_DB = os.path.join('data', 'history.db')
+LEGACY_HISTORY = os.path.join('data', 'history.pickle')
+EXPORT_FOLDER = os.path.join('data', Export.FOLDER_NAME)
 
 def diagnostics(ids: Types.Ids, run_info: Types.RunInfo):
     """ Print some useful and intersting information about the latest run """
@@ -64,124 +80,577 @@ def diagnostics(ids: Types.Ids, run_info: Types.RunInfo):
         for platform in Types.PLATFORMS:
             print(f'\tsubtest_opt_passing_count[{tier}][{platform}]', run_info.subtest_opt_passing_count[tier][platform])
 
-if __name__ == "__main__":
-    parser = ArgumentParser(description="SyncNet")
-    parser.add_argument("-m", "--maxhistory", metavar="RUNCOUNT", default=5, type=int, help="Maximum number of run histories to remember")
-    parser.add_argument("-R", "--repo", metavar="PATH", default=None, type=str, help="Path to the github repo for cts-tracker")
-    parser.add_argument("-M", "--matplotlib", action="store_true", default=False, help="Generate charts using matplotlib")
-    parser.add_argument("-A", "--altair", action="store_true", default=False, help="Generate charts using altair")
+class RunError(Exception):
+    """ A step of the run pipeline failed; the message is for the user """
+    pass
 
-    options, args = parser.parse_known_args()
+def git(repo: str, *args: str, error: str, capture: bool = False) -> None:
+    """ Run a git command in the local repo """
+    try:
+        if capture:
+            subprocess.check_output(['git', *args], cwd=repo, stderr=subprocess.STDOUT)
+        else:
+            subprocess.check_call(['git', *args], cwd=repo, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError:
+        raise RunError(error)
 
-    # validate the local repo
+def dump_file(options) -> str:
+    """ The run output to track: the one named by --dump, or else the one
+        found in the repo's data folder """
+    if options.dump:
+        return os.path.join(options.repo, options.dump)
+    return Parse.find_dump(os.path.join(options.repo, 'data'))
+
+def validate_options(options) -> None:
+    """ Make sure the local repo and the selected backend are usable """
     if not options.repo:
-        print('Error: the data path to the github repo was not specified')
-        sys.exit(1)
+        raise RunError('the data path to the github repo was not specified')
     elif not os.path.exists(options.repo):
-        print(f"Error: the repo path ('{options.repo}') is not accessible")
-        sys.exit(1)
-    else:
-        # validate data paths
-        data_path = os.path.join(options.repo, 'data')
-        image_path = os.path.join(options.repo, 'images')
-        if not os.path.exists(data_path):
-            print(f"Error: the repo data path ('{data_path}') is not accessible")
-            sys.exit(1)
-        elif not os.path.exists(image_path):
-            print(f"Error: the repo images path ('{image_path}') is not accessible")
-            sys.exit(1)
-
-    if options.matplotlib and (not HAVE_MATPLOTLIB):
-        print('Error: the matplotlib graphing package is not available')
-        sys.exit(1)
-    if options.altair and (not HAVE_ALTAIR):
-        print('Error: the altair graphing package is not available')
-        sys.exit(1)
+        raise RunError(f"the repo path ('{options.repo}') is not accessible")
+
+    # validate data paths
+    data_path = os.path.join(options.repo, 'data')
+    image_path = os.path.join(options.repo, 'images')
+    if not os.path.exists(data_path):
+        raise RunError(f"the repo data path ('{data_path}') is not accessible")
+    elif not os.path.exists(image_path):
+        raise RunError(f"the repo images path ('{image_path}') is not accessible")
+
+    # backends are only located here; they are not imported until
+    # there is actually a chart to render
+    for backend in [backend for backend in Plot.BACKENDS if getattr(options, backend)]:
+        missing = Plot.missing_modules(backend)
+        if missing:
+            raise RunError(f"the {backend} graphing package is not available (missing: {', '.join(missing)})")
+    if options.dashboard and (not Dashboard.HAVE_VL_CONVERT):
+        raise RunError('the vl-convert-python package needed to embed the dashboard scripts is not available')
+    if options.export and not (Export.HAVE_PYARROW and Export.HAVE_NUMPY):
+        raise RunError('the pyarrow and numpy packages needed to export runs are not available')
+
+    run_file = dump_file(options)
+    if not os.path.exists(run_file):
+        raise RunError(f"the run output ('{run_file}') is not accessible")
+    if run_file.endswith('.zst') and (not Parse.HAVE_ZSTANDARD):
+        raise RunError(f"the run output ('{run_file}') is zstd compressed, and the zstandard package is not available")
 
     if options.matplotlib:
         options.altair = False
     elif options.altair:
         options.matplotlib = False
 
-    # note the current modified stamp of the dump file
-    run_file = os.path.join(options.repo, 'data', 'dump.json')
-    last_run_date = os.stat(run_file).st_mtime
-
-    # make sure the local report is current
-    cwd = os.getcwd()
-    os.chdir(options.repo)
+def open_history(options, read_only: bool = False) -> History.HistoryStore:
+    history_file = os.path.join(options.repo, LEGACY_HISTORY)
+    history_db = os.path.join(options.repo, HISTORY_DB)
+
+    # any legacy pickled history is migrated into the database the
+    # first time it is opened for writing; a read-only store (e.g., for
+    # --check) leaves the tree exactly as it is
+    return History.HistoryStore(history_db, history_file, read_only)
+
+def is_tracked(repo: str, path: str) -> bool:
+    return subprocess.call(['git', 'ls-files', '--error-unmatch', '--', path], cwd=repo, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+
+def detect_change(options, history: History.HistoryStore, profiler: Profile.Profiler, fetch: bool = True):
+    """ Fetch the remote (unless the caller already has) and decide whether
+        it holds a new dump; the local repo is only merged when there is one
+        to process.  Returns (changed, previous digest, current digest). """
+    run_file = dump_file(options)
+    rel_path = os.path.relpath(run_file, options.repo).replace(os.sep, '/')
+
+    if fetch:
+        with profiler.phase('git fetch'):
+            git(options.repo, 'fetch', '--quiet', error='failed to execute a fetch on the local repo', capture=True)
+
+    # compare blob ids rather than content: a touch or a fresh checkout of
+    # identical content is not a new run, and nothing has to be read
+    with profiler.phase('change detection'):
+        local_digest = Cache.dump_digest(options.repo, run_file)
+        upstream = None
+        for revision in ('@{upstream}', 'FETCH_HEAD'):
+            upstream_digest = Cache.revision_blob(options.repo, revision, rel_path)
+            if upstream_digest is not None:
+                upstream = revision
+                break
+        incoming = (upstream is not None) and (upstream_digest != local_digest)
+        current_digest = upstream_digest if incoming else local_digest
+
+    # the last processed dump is the reference when history knows it, so
+    # a check (or a failed run) does not hide the change
+    processed_digest = history.latest_digest()
+    if processed_digest is not None:
+        changed = processed_digest != current_digest
+    elif len(history) == 0:
+        # nothing has been processed yet
+        changed = True
+    else:
+        changed = local_digest != current_digest
+
+    # a check only looks; otherwise the working tree is brought up to date
+    # before the new dump is read, and so the push that follows is a
+    # fast-forward
+    if changed and (not options.check) and (upstream is not None):
+        with profiler.phase('git merge'):
+            git(options.repo, 'merge', '--quiet', '--no-edit', upstream, error='failed to merge the update into the local repo', capture=True)
+
+    return changed, processed_digest or local_digest, current_digest
+
+def parse_run(options, cache: Cache.ParseCache, current_digest: str, profiler: Profile.Profiler) -> dict:
+    """ The counters (and whatever else the run needs) of the new dump,
+        from the cache when it has all of them """
+    run_file = dump_file(options)
+
+    # dump content we have seen before is never parsed twice
+    cached = cache.get(current_digest)
+    indexed = options.diff or options.flaky or options.export
+    test_index = cache.get_index(current_digest) if indexed else None
+    trie = cache.get_trie(current_digest) if options.top else None
+    table = None
+    # the parse is only skipped when everything this run needs is cached
+    complete = (cached is not None) and ((not indexed) or (test_index is not None)) and \
+               ((not options.table) or cache.has_table(current_digest)) and ((not options.top) or (trie is not None))
+    if complete:
+        run_info, ids = cached
+        run_info.run_date = os.stat(run_file).st_mtime
+    else:
+        with profiler.parse_phase():
+            run_info = Types.RunInfo()
+            ids = Types.Ids()
+            builder = Index.IndexBuilder() if indexed else None
+            table = Table.ResultTable() if options.table else None
+            trie = Trie.CategoryTrie() if options.top else None
+            Parse.extract_current_run_info(run_info, run_file, ids, streaming=options.stream, jobs=options.jobs, index=builder,
+                                           fast=options.fast, table=table, trie=trie)
+            if builder is not None:
+                test_index = builder.finish()
+
+    return {'run_info': run_info, 'ids': ids, 'test_index': test_index, 'table': table, 'trie': trie, 'parsed': not complete}
+
+def cache_run(cache: Cache.ParseCache, current_digest: str, parsed: dict, profiler: Profile.Profiler) -> None:
+    """ Keep what a parse produced for the next time this dump is seen """
+    with profiler.phase('cache save'):
+        cache.put(current_digest, parsed['run_info'], parsed['ids'])
+        if parsed['test_index'] is not None:
+            cache.put_index(current_digest, parsed['test_index'])
+        if parsed['table'] is not None:
+            # kept for ad-hoc queries (python Table.py <cache>/<digest>.table)
+            cache.put_table(current_digest, parsed['table'])
+        if parsed['trie'] is not None:
+            cache.put_trie(current_digest, parsed['trie'])
+
+def save_history(options, history: History.HistoryStore, run_info: Types.RunInfo, current_digest: str, profiler: Profile.Profiler) -> List[str]:
+    with profiler.phase('history save'):
+        # append the data from this latest run
+        history.append(run_info, current_digest)
+
+        # trim excess history; older runs live on in the rollups
+        history.trim(options.maxhistory, options.daily, options.weekly)
+
+    files = [history.db_file]
+    if history.migrated_from is not None:
+        # the legacy pickle is gone; its removal is committed too
+        files.append(history.migrated_from)
+    return files
+
+def update_flakiness(options, history: History.HistoryStore, test_index: Index.TestIndex, current_digest: str, profiler: Profile.Profiler) -> None:
+    # the bitsets outlive the trimmed history; they hold their own window
+    with profiler.phase('flakiness'):
+        data = history.get_state(Flaky.STATE_NAME)
+        flakes = Flaky.FlakeHistory.loads(data) if data is not None else Flaky.FlakeHistory()
+        if flakes.update(test_index, current_digest):
+            history.put_state(Flaky.STATE_NAME, flakes.dumps())
+        for flake in flakes.flakiest(options.flaky):
+            print(f'flaky: {flake.score:.2f} ({flake.flips} flips in {flake.runs} runs) {flake.platform} {flake.build} {flake.key}')
+
+def render(options, jobs: List[Plot.ChartJob], name: str, profiler: Profile.Profiler) -> List[str]:
+    with profiler.phase(name):
+        rendered = Plot.render_jobs(options, jobs, profiler)
+    return [job.file_name for job in rendered]
+
+def process_run(options, history: History.HistoryStore, previous_digest: str, current_digest: str, profiler: Profile.Profiler) -> List[str]:
+    """ Parse the new dump, record it in history and re-create the plots.
+        Once the parse is done, the cache save, the history save and the
+        charts of the latest run are independent, and run concurrently;
+        only the tier chart (or dashboard) waits on history.  Tasks that
+        use the history database still run one at a time.
+        Returns the files that were written (or removed). """
+    cache = Cache.ParseCache(options.cache)
+
+    # an actual history (with this run, more than one) gets charts
+    charted = len(history) > 0
+
+    pipeline = Pipeline.Pipeline()
+    results = pipeline.results
+    pipeline.add('parse', lambda: parse_run(options, cache, current_digest, profiler))
+    pipeline.add('cache', lambda: cache_run(cache, current_digest, results['parse'], profiler), after=['parse'],
+                 when=lambda: results['parse']['parsed'])
+
+    # report which tests moved since the previous dump
+    def diff():
+        previous_index = cache.get_index(previous_digest)
+        if previous_index is not None:
+            print(Index.diff(previous_index, results['parse']['test_index']).summary())
+    pipeline.add('diff', diff, after=['parse'], when=lambda: options.diff and (previous_digest != current_digest))
+
+    if options.export:
+        # other tools read the runs from these, not from a re-parse
+        def export():
+            with profiler.phase('export'):
+                parsed = results['parse']
+                folder = os.path.join(options.repo, EXPORT_FOLDER)
+                Export.export_run(folder, parsed['test_index'], parsed['run_info'].run_date, current_digest, options.export_format, options.maxhistory)
+            # the whole folder is staged, so expired snapshots go too
+            return [folder]
+        pipeline.add('export', export, after=['parse'])
+
+    pipeline.add('history', lambda: save_history(options, history, results['parse']['run_info'], current_digest, profiler), after=['parse'])
+    saved = ['history']
+    if options.flaky:
+        pipeline.add('flakiness', lambda: update_flakiness(options, history, results['parse']['test_index'], current_digest, profiler), after=saved)
+        saved = ['flakiness']
+
+    # print diagnostics
+    #diagnostics(ids, run_info)
+
+    if options.dashboard:
+        # one page, drawn by the browser, replaces all of the PNG charts
+        def dashboard():
+            with profiler.phase('dashboard'):
+                spec = Dashboard.dashboard_spec(history.trend(options.maxhistory), results['parse']['trie'], options.top or 10)
+                file_name = os.path.join(options.repo, 'images', Dashboard.DASHBOARD_NAME)
+                return Dashboard.write_dashboard(file_name, spec)
+        pipeline.add('dashboard', dashboard, after=['parse'] + saved)
+
+    # if we have an actual history, re-create the plots
+    elif charted:
+        def run_charts():
+            # intermittent and passing graphs only regard the most recent run data
+            run_info = results['parse']['run_info']
+            jobs = Plot.intermittent_graph_jobs(options, run_info)
+            jobs += Plot.passfail_graph_jobs(options, run_info)
+            if results['parse']['trie'] is not None:
+                jobs += Plot.subtree_graph_jobs(options, results['parse']['trie'], options.top)
+            return render(options, jobs, 'render', profiler)
+        pipeline.add('run charts', run_charts, after=['parse'])
+        pipeline.add('tier chart', lambda: render(options, Plot.tier_graph_jobs(options, history), 'render tiers', profiler), after=saved)
+
+    pipeline.run()
+
+    files = list(results['history'])
+    files += results.get('export', [])
+    files += results.get('dashboard', [])
+    rendered = results.get('tier chart', []) + results.get('run charts', [])
+    if rendered:
+        files += rendered
+        files.append(os.path.join(os.path.dirname(rendered[0]), Plot.MANIFEST_NAME))
+
+    return files
+
+def publish(options, files: List[str], profiler: Profile.Profiler, push: bool = True) -> bool:
+    """ Commit the files a run wrote and (unless the caller pushes itself)
+        push them upstream.  Only those paths are staged, so the (large)
+        working tree is never scanned.  Returns whether there was anything
+        to commit. """
+    with profiler.phase('git add'):
+        paths = [os.path.relpath(file_name, options.repo) for file_name in files]
+        # a legacy pickle migrated by an earlier invocation whose removal
+        # never made it into a commit
+        if (LEGACY_HISTORY not in paths) and (not os.path.exists(os.path.join(options.repo, LEGACY_HISTORY))) and is_tracked(options.repo, LEGACY_HISTORY):
+            paths.append(LEGACY_HISTORY)
+        git(options.repo, 'add', '--all', '--', *paths, error='failed to execute an add on the local repo')
+
+    # nothing to commit (e.g., identical output) means nothing to push
     try:
-        output = subprocess.check_output(['git', 'pull'], stderr=subprocess.STDOUT)
+        subprocess.check_call(['git', 'diff', '--cached', '--quiet'], cwd=options.repo)
+        return False
     except subprocess.CalledProcessError:
-        print('Error: failed to execute an update of the local repo')
-        sys.exit(1)
-    os.chdir(cwd)
+        pass
 
-    # get the post-update stamp of the dump file
-    current_run_date = os.stat(run_file).st_mtime
+    with profiler.phase('git commit'):
+        git(options.repo, 'commit', '-m', 'Automatic updated of history and charts', error='failed to execute a commit on the local repo')
 
-    if last_run_date != current_run_date:
-        # the dump file has been updated with new CTS run data
+    if push:
+        with profiler.phase('git push'):
+            git(options.repo, 'push', error='failed to execute a push on the local repo')
+    return True
 
-        history_file = os.path.join(options.repo, 'data', 'history.pickle')
-
-        # this might be better as an sqlite database instead of
-        # just a _(NonSQL) list of pickled RunInfo data
-
-        history_data: List[Types.RunInfo] = []
-        if os.path.exists(history_file):
-            history_data = pickle.load(open(history_file, 'rb'))
+def run_once(options, history: History.HistoryStore) -> bool:
+    """ One full pass of the pipeline; returns whether a new dump was found """
+    profiler = Profile.Profiler(options.profile is not None, options.profile_parse)
+    try:
+        pipeline = Pipeline.Pipeline()
+        results = pipeline.results
 
-        run_info = Types.RunInfo()
-        ids = Types.Ids()
-        Parse.extract_current_run_info(run_info, run_file, ids)
+        # the backend import needs nothing from the pull, so it overlaps it
+        backend = Plot.chart_backend(options)
+        if (backend is not None) and (not options.check) and (not options.dashboard):
+            pipeline.add('backend', lambda: Plot.load_backend(backend))
+        pipeline.add('detect', lambda: detect_change(options, history, profiler))
 
-        # append the data from this latest run
-        history_data.append(run_info)
+        # the dump file has been updated with new CTS run data
+        new_run = lambda: results['detect'][0] and (not options.check)
+        pipeline.add('process', lambda: process_run(options, history, results['detect'][1], results['detect'][2], profiler),
+                     after=['detect'], when=new_run)
+
+        # the push is the final barrier
+        pipeline.add('publish', lambda: publish(options, results['process'], profiler), after=list(pipeline.tasks))
+        pipeline.run()
+
+        if 'publish' in results:
+            history.migrated_from = None
+    finally:
+        profiler.write(options.profile)
+
+    return results['detect'][0]
+
+def process_suite(options, previous_digest: str, current_digest: str) -> List[str]:
+    """ process_run() for one suite, in a worker of the shared pool; the
+        worker opens the suite's history itself """
+    profiler = Profile.Profiler(options.profile is not None, options.profile_parse)
+    history = open_history(options)
+    try:
+        return process_run(options, history, previous_digest, current_digest, profiler)
+    finally:
+        history.close()
+        profiler.write(options.profile)
+
+def keep_run(options) -> Tuple[str, Dict[str, Optional[bytes]]]:
+    """ What an unpublished run has to put back: the commit it started
+        from, and the history files as they were """
+    try:
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=options.repo, stderr=subprocess.STDOUT, text=True).strip()
+    except subprocess.CalledProcessError:
+        raise RunError('failed to read the HEAD of the local repo')
+
+    files = {}
+    for path in (HISTORY_DB, LEGACY_HISTORY):
+        file_name = os.path.join(options.repo, path)
+        if os.path.exists(file_name):
+            with open(file_name, 'rb') as f:
+                files[file_name] = f.read()
+        else:
+            files[file_name] = None
+    return head, files
+
+def restore_run(options, kept: Tuple[str, Dict[str, Optional[bytes]]]) -> None:
+    """ Undo the commit, the history, the charts and the snapshots of a run
+        that was not published """
+    head, files = kept
+    git(options.repo, 'reset', '--quiet', head, error='failed to reset the local repo')
+    # the render manifest goes back too, so the next run redraws them all;
+    # either folder may have nothing tracked yet
+    for folder in ('images', EXPORT_FOLDER):
+        subprocess.call(['git', 'checkout', head, '--', folder], cwd=options.repo, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for file_name, data in files.items():
+        if data is not None:
+            with open(file_name, 'wb') as f:
+                f.write(data)
+        elif os.path.exists(file_name):
+            os.remove(file_name)
+
+def suite_failed(suite: Suites.Suite, e: Exception) -> None:
+    """ Record why a suite failed; the other suites carry on """
+    if not isinstance(e, RunError):
+        # unexpected, so the details are worth having
+        traceback.print_exception(e)
+    suite.error = str(e) or type(e).__name__
+
+def run_suites(options) -> List[Suites.Suite]:
+    """ One pass over every suite of a --suites config.  The git
+        round-trips of all suites run concurrently, and their parsing and
+        rendering share one worker pool; each suite gets its own commit. """
+    suites = Suites.load_suites(options.suites, options)
+    for suite in suites:
+        try:
+            validate_options(suite.options)
+        except RunError as e:
+            raise RunError(f'suite {suite.name}: {e}')
 
-        # trim excess history
-        while len(history_data) > options.maxhistory:
-            history_data.pop(0)
+    profiler = Profile.Profiler(options.profile is not None, options.profile_parse)
+    try:
+        with profiler.phase('git fetch'):
+            results = Suites.git_all(suites, 'fetch', '--quiet')
+        for suite, (returncode, _) in zip(suites, results):
+            if returncode != 0:
+                suite.error = 'failed to execute a fetch on the local repo'
+
+        # blob ids and merges are local and quick
+        for suite in [suite for suite in suites if suite.error is None]:
+            # detection only reads; a suite's worker migrates its history
+            history = open_history(suite.options, read_only=True)
+            try:
+                suite.changed, suite.previous_digest, suite.current_digest = detect_change(suite.options, history, profiler, fetch=False)
+            except Exception as e:
+                suite_failed(suite, e)
+            finally:
+                history.close()
+
+        pending = [suite for suite in suites if suite.changed and (suite.error is None)]
+        if options.check or (not pending):
+            return suites
+
+        # history records the digest of each processed dump, so it is only
+        # kept once the run is published; a suite that fails anywhere is
+        # put back as it was, and the next pass processes its dump again
+        kept = {}
+        for suite in pending:
+            try:
+                kept[suite.name] = keep_run(suite.options)
+            except Exception as e:
+                suite_failed(suite, e)
+        pending = [suite for suite in pending if suite.error is None]
+
+        with profiler.phase('process'):
+            with ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as pool:
+                futures = [pool.submit(process_suite, suite.options, suite.previous_digest, suite.current_digest) for suite in pending]
+                for suite, future in zip(pending, futures):
+                    try:
+                        suite.files = future.result()
+                    except Exception as e:
+                        suite_failed(suite, e)
+
+        for suite in [suite for suite in pending if suite.error is None]:
+            try:
+                suite.committed = publish(suite.options, suite.files, profiler, push=False)
+            except Exception as e:
+                suite_failed(suite, e)
+
+        pushing = [suite for suite in pending if suite.committed and (suite.error is None)]
+        with profiler.phase('git push'):
+            results = Suites.git_all(pushing, 'push')
+        for suite, (returncode, _) in zip(pushing, results):
+            if returncode != 0:
+                suite.error = 'failed to execute a push on the local repo'
+
+        for suite in [suite for suite in pending if suite.error is not None]:
+            try:
+                restore_run(suite.options, kept[suite.name])
+            except Exception as e:
+                print(f'suite {suite.name}: could not undo its run: {e}')
+    finally:
+        profiler.write(options.profile)
+
+    return suites
+
+def make_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="SyncNet")
+    parser.add_argument("-m", "--maxhistory", metavar="RUNCOUNT", default=5, type=int, help="Maximum number of run histories to remember")
+    parser.add_argument("--daily", metavar="DAYS", default=30, type=int, help="Roll runs beyond --maxhistory up into daily totals kept for DAYS days (0 to drop them)")
+    parser.add_argument("--weekly", metavar="WEEKS", default=52, type=int, help="Roll expired daily totals up into weekly totals, keeping WEEKS of them (0 to drop them)")
+    parser.add_argument("-R", "--repo", metavar="PATH", default=None, type=str, help="Path to the github repo for cts-tracker")
+    parser.add_argument("--dump", metavar="PATH", default=None, type=str, help="Run output to track, relative to the repo (default: the dump in its data folder)")
+    parser.add_argument("--suites", metavar="FILE", default=None, type=str, help="Track every suite (repo) listed in this JSON config in one concurrent pass")
+    parser.add_argument("-M", "--matplotlib", action="store_true", default=False, help="Generate charts using matplotlib")
+    parser.add_argument("-A", "--altair", action="store_true", default=False, help="Generate charts using altair")
+    parser.add_argument("-S", "--stream", action="store_true", default=False, help="Parse the run output one category at a time to bound memory use, even with --fast")
+    parser.add_argument("-f", "--fast", action="store_true", default=False, help="Decode the run output in one pass, building only the counted fields (uses msgspec when installed, else orjson)")
+    parser.add_argument("-j", "--jobs", metavar="COUNT", default=1, type=int, help="Number of worker processes used to parse the run output")
+    parser.add_argument("-C", "--cache", metavar="PATH", default=Cache.DEFAULT_CACHE_DIR, type=str, help="Folder for cached parse results, keyed by dump digest")
+    parser.add_argument("-D", "--diff", action="store_true", default=False, help="Index per-test results and report what changed since the previous dump")
+    parser.add_argument("-K", "--flaky", metavar="COUNT", default=0, type=int, help="Track per-test flakiness across runs in the history, and report the COUNT flakiest tests")
+    parser.add_argument("-E", "--export", action="store_true", default=False, help="Write each run's per-test results as a columnar snapshot into data/runs, published with history (keeps --maxhistory of them)")
+    parser.add_argument("--export-format", default='arrow', choices=list(Export.FORMATS), help="With --export, write memory-mappable Arrow IPC files or smaller Parquet files")
+    parser.add_argument("-T", "--table", action="store_true", default=False, help="Count through a columnar result table, and cache it for later queries")
+    parser.add_argument("-N", "--top", metavar="COUNT", default=0, type=int, help="Also chart the COUNT category areas with the most intermittent and failing results")
+    parser.add_argument("-H", "--dashboard", action="store_true", default=False, help="Write a self-contained HTML dashboard (images/dashboard.html) instead of the PNG charts")
+    parser.add_argument("-r", "--render-jobs", metavar="COUNT", default=1, type=int, help="Number of worker processes used to render charts")
+    parser.add_argument("-F", "--force-render", action="store_true", default=False, help="Render every chart, even those whose inputs have not changed")
+    parser.add_argument("-k", "--check", action="store_true", default=False, help="Only check for a new dump; exit with 2 if it changed, 0 if not")
+    parser.add_argument("-P", "--profile", metavar="PATH", default=None, type=str, help="Write per-phase timings as a JSON summary and a Chrome trace into this folder")
+    parser.add_argument("--profile-parse", action="store_true", default=False, help="With --profile, also capture a cProfile of the parse phase")
+    parser.add_argument("--daemon", action="store_true", default=False, help="Stay resident, processing each new dump as it arrives")
+    parser.add_argument("--interval", metavar="SECONDS", default=300, type=float, help="With --daemon, how often to poll the remote for a new dump")
+    parser.add_argument("--serve", metavar="PORT", default=None, type=int, help="Serve the latest run, history and counters as JSON over HTTP on this port")
+    parser.add_argument("--bind", metavar="ADDRESS", default='127.0.0.1', type=str, help="With --serve, the address to listen on")
+    parser.add_argument("--backfill", action="store_true", default=False, help="Rebuild history from past revisions of the dump in the git log (set --maxhistory to keep them)")
+    parser.add_argument("--since", metavar="DATE", default=None, type=str, help="With --backfill, only add revisions committed after this date to the existing history")
+
+    return parser
 
-        # save run data
-        with open(history_file, 'wb') as f:
-            pickle.dump(history_data, f)
+if __name__ == "__main__":
+    parser = make_parser()
+    options, args = parser.parse_known_args()
 
-        # print diagnostics
-        #diagnostics(ids, run_info)
+    if options.suites:
+        try:
+            suites = run_suites(options)
+        except (RunError, ValueError, OSError) as e:
+            print(f'Error: {e}')
+            sys.exit(1)
 
-        # if we have an actual history, re-create the plots
-        if len(history_data) > 1:
-            Plot.regenerate_tier_graphs(options, history_data)
+        for suite in suites:
+            state = f'error: {suite.error}' if suite.error else 'changed' if suite.changed else 'unchanged'
+            print(f'{suite.name}: {state}')
 
-            # intermittent and passing graphs only regard the most recent run data
-            Plot.regenerate_intermittent_graphs(options, history_data[-1])
-            Plot.regenerate_passfail_graphs(options, history_data[-1])
+        if any(suite.error for suite in suites):
+            sys.exit(1)
+        if options.check:
+            sys.exit(2 if any(suite.changed for suite in suites) else 0)
+        sys.exit(0)
 
-        # commit the changes in the local repo and push
-        # them upstream
+    try:
+        validate_options(options)
+    except RunError as e:
+        print(f'Error: {e}')
+        sys.exit(1)
 
-        cwd = os.getcwd()
-        os.chdir(options.repo)
+    # neither a check nor the server may change the tree
+    history = open_history(options, read_only=options.check or (options.serve is not None))
 
+    if options.serve is not None:
+        # another (cron or --daemon) invocation keeps history current
         try:
-            output = subprocess.check_call(['git', 'add', '.'], stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError:
-            print('Error: failed to execute an add on the local repo')
-            sys.exit(1)
-
+            Server.serve(history, options.bind, options.serve, options.maxhistory)
+        finally:
+            history.close()
+        sys.exit(0)
+
+    if options.backfill:
+        # this is CPU bound; use every core unless told otherwise
+        jobs = options.jobs if options.jobs > 1 else (os.cpu_count() or 1)
         try:
-            output = subprocess.check_call(['git', 'commit', '-m', 'Automatic updated of history and charts'], stderr=subprocess.STDOUT)
+            rel_path = os.path.relpath(dump_file(options), options.repo).replace(os.sep, '/')
+            added = Backfill.backfill(options.repo, rel_path, history, jobs, options.cache, options.since)
         except subprocess.CalledProcessError:
-            print('Error: failed to execute a commit on the local repo')
+            print('Error: failed to read the dump revisions from the local repo')
             sys.exit(1)
+        history.trim(options.maxhistory, options.daily, options.weekly)
+        print(f'{added} new runs loaded from the git log; {len(history)} runs kept in history')
+        history.close()
+        sys.exit(0)
+
+    if options.daemon:
+        # history stays open and the plotting backend stays imported
+        # between dumps, so each new one only pays for its own work
+        backend = Plot.chart_backend(options)
+        if backend is not None:
+            Plot.load_backend(backend)
+
+        # anything else a cycle raises is logged by the daemon, which
+        # backs off and carries on
+        def cycle() -> bool:
+            try:
+                run_once(options, history)
+            except RunError as e:
+                print(f'Error: {e}')
+                return False
+            return True
 
         try:
-            output = subprocess.check_call(['git', 'push'], stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError:
-            print('Error: failed to execute a push on the local repo')
-            sys.exit(1)
+            Daemon.run(dump_file(options), options.interval, cycle)
+        finally:
+            history.close()
+        sys.exit(0)
+
+    try:
+        changed = run_once(options, history)
+    except RunError as e:
+        print(f'Error: {e}')
+        sys.exit(1)
+    finally:
+        history.close()
 
-        os.chdir(cwd)
+    if options.check:
+        print('changed' if changed else 'unchanged')
+        sys.exit(2 if changed else 0)
 
     sys.exit(0)
@@ -0,0 +1,133 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: test_flaky                                                      #
+#                                                                         #
+# Rolling flakiness bitsets, with and without numpy                       #
+#-------------------------------------------------------------------------#
+
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Index
+import Flaky
+
+@pytest.fixture(params=[True, False], ids=['numpy', 'python'])
+def numpy(request, monkeypatch):
+    if request.param and not Flaky.HAVE_NUMPY:
+        pytest.skip('numpy is not installed')
+    monkeypatch.setattr(Flaky, 'HAVE_NUMPY', request.param)
+    return request.param
+
+def run(tests: dict, platforms=('Linux',)) -> Index.TestIndex:
+    """ name -> True (passes everywhere), False (fails) or None (disabled) """
+    builder = Index.IndexBuilder()
+    for name, passing in tests.items():
+        outcome = ['OK'] if passing else ['FAIL']
+        builder.add('webgpu_area', name, 0 if passing is None else 3, passing is None,
+                    {platform: {'Debug': outcome, 'Optimized': ['OK']} for platform in platforms})
+    return builder.finish()
+
+def history(*runs) -> Flaky.FlakeHistory:
+    flakes = Flaky.FlakeHistory()
+    for i, tests in enumerate(runs):
+        flakes.update(tests if isinstance(tests, Index.TestIndex) else run(tests), f'digest {i}')
+    return flakes
+
+def flake(flakes: Flaky.FlakeHistory, key: str, platform: str = 'Linux', build: str = 'Debug') -> Flaky.Flake:
+    for result in flakes.flakiest(count=1000, min_runs=1):
+        if (result.key, result.platform, result.build) == (f'webgpu_area/{key}', platform, build):
+            return result
+    return None
+
+def test_bits(numpy):
+    flakes = history({'a': True, 'b': True}, {'a': False, 'b': True}, {'a': True})
+
+    # bit 0 is the latest run
+    assert flakes.keys == ['webgpu_area/a', 'webgpu_area/b']
+    assert list(flakes.seen) == [0b111, 0b110]
+    assert list(flakes.passing) == [0b101, 0b111, 0b110, 0b110]
+    assert list(flakes.platform_seen) == [0b111]
+
+def test_scores(numpy):
+    # oldest first: pass, fail, pass, pass
+    flakes = history({'a': True}, {'a': False}, {'a': True}, {'a': True})
+
+    result = flake(flakes, 'a')
+    assert (result.flips, result.runs, result.streak, result.passing) == (2, 4, 2, True)
+    assert result.score == pytest.approx(2 / 3)
+    # a steady build never flips
+    assert flake(flakes, 'a', build='Optimized') is None
+
+def test_absent_runs_do_not_flip(numpy):
+    # missing or disabled in the middle runs; only the runs that had the
+    # test are compared, and only when they were consecutive
+    flakes = history({'a': True, 'b': True}, {'b': True}, {'a': None, 'b': True}, {'a': False, 'b': True}, {'a': False, 'b': True})
+
+    assert flakes.seen[0] == 0b10011
+    result = flake(flakes, 'a')
+    assert result is None
+
+    flakes.update(run({'a': True, 'b': True}), 'digest 5')
+    result = flake(flakes, 'a')
+    assert (result.flips, result.runs, result.streak, result.passing) == (1, 4, 1, True)
+
+def test_new_platform(numpy):
+    flakes = history({'a': True}, {'a': False}, run({'a': True}, platforms=('Linux', 'Windows')), run({'a': False}, platforms=('Linux', 'Windows')))
+
+    # the platform only has results from the runs that included it
+    assert flakes.platforms == ['Linux', 'Windows']
+    assert list(flakes.platform_seen) == [0b1111, 0b11]
+    result = flake(flakes, 'a', 'Windows')
+    assert (result.flips, result.runs) == (1, 2)
+    assert flake(flakes, 'a').flips == 3
+
+def test_window(numpy):
+    runs = [{'a': i % 2 == 0, 'b': True} for i in range(Flaky.WINDOW)]
+    flakes = history({'old': False, 'b': True}, *runs)
+
+    # a test no run in the window had is dropped
+    assert flakes.keys == ['webgpu_area/a', 'webgpu_area/b']
+    result = flake(flakes, 'a')
+    assert (result.flips, result.runs) == (Flaky.WINDOW - 1, Flaky.WINDOW)
+    assert result.score == 1.0
+
+def test_same_dump_ignored(numpy):
+    flakes = history({'a': True})
+    assert not flakes.update(run({'a': False}), 'digest 0')
+    assert list(flakes.seen) == [0b1]
+    assert flakes.update(run({'a': False}), 'digest 1')
+
+def test_ordering(numpy):
+    flakes = history({'a': True, 'b': True, 'c': True}, {'a': False, 'b': False, 'c': True},
+                     {'a': True, 'b': False, 'c': True}, {'a': False, 'b': False, 'c': False})
+
+    results = flakes.flakiest(min_runs=3)
+    assert [(result.key, result.flips) for result in results] == [('webgpu_area/a', 3), ('webgpu_area/b', 1), ('webgpu_area/c', 1)]
+    assert flakes.flakiest(count=1, min_runs=3)[0].key == 'webgpu_area/a'
+    assert flakes.flakiest(min_runs=5) == []
+
+def test_round_trip(numpy):
+    flakes = history({'a': True}, {'a': False})
+    assert Flaky.FlakeHistory.loads(flakes.dumps()) == flakes
+
+@pytest.mark.skipif(not Flaky.HAVE_NUMPY, reason='numpy is not installed')
+def test_numpy_matches_python(monkeypatch):
+    rng = random.Random(0)
+    names = [f't{i}' for i in range(40)]
+    runs = []
+    for i in range(Flaky.WINDOW + 8):
+        platforms = ('Linux', 'Windows') if i % 3 else ('Linux',)
+        runs.append(run({name: rng.choice([True, True, False, None]) for name in names if rng.random() < 0.9}, platforms))
+
+    results = {}
+    for flag in (True, False):
+        monkeypatch.setattr(Flaky, 'HAVE_NUMPY', flag)
+        flakes = history(*runs)
+        results[flag] = (flakes, flakes.flakiest(count=1000, min_runs=1))
+    assert results[True] == results[False]
@@ -0,0 +1,111 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: test_history                                                    #
+#                                                                         #
+# Daily and weekly rollups, and what trim() keeps of each level           #
+#-------------------------------------------------------------------------#
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Types
+import History
+
+# a Monday (2024-01-01, UTC)
+MONDAY = 1704067200.0
+DAY = History.DAY
+HOUR = 3600.0
+
+def run(run_date: float, tests: int) -> Types.RunInfo:
+    run_info = Types.RunInfo(run_date=run_date, test_count=tests)
+    run_info.test_tier_count['Tier 3']['Linux'] = tests
+    return run_info
+
+def summary(runs) -> list:
+    return [(run.run_date, run.test_count, run.test_tier_count['Tier 3']['Linux']) for run in runs]
+
+@pytest.fixture
+def store(tmp_path):
+    history = History.HistoryStore(str(tmp_path / 'history.db'))
+    yield history
+    history.close()
+
+def fill(store: History.HistoryStore, runs: list) -> None:
+    for day, hour, tests in runs:
+        store.append(run(MONDAY + day * DAY + hour * HOUR, tests))
+
+def test_period_start():
+    assert History.period_start(History.DAILY, MONDAY + 2 * DAY + 5 * HOUR) == MONDAY + 2 * DAY
+    # weeks start on Monday, whatever day the run fell on
+    assert History.period_start(History.WEEKLY, MONDAY + 6 * DAY + 23 * HOUR) == MONDAY
+    assert History.period_start(History.WEEKLY, MONDAY + 7 * DAY) == MONDAY + 7 * DAY
+
+def test_trim_without_rollups(store):
+    fill(store, [(0, 1, 10), (1, 1, 20), (2, 1, 30)])
+    store.trim(2)
+
+    assert len(store) == 2
+    assert summary(store.window(5)) == [(MONDAY + DAY + HOUR, 20, 20), (MONDAY + 2 * DAY + HOUR, 30, 30)]
+    assert store.rollups(History.DAILY) == []
+    assert store.rollups(History.WEEKLY) == []
+
+def test_daily_rollups(store):
+    fill(store, [(0, 1, 10), (0, 3, 21), (1, 1, 30), (2, 1, 40)])
+    store.trim(1, days=30)
+
+    # expired runs are averaged per day (rounded) at the mean of their dates
+    assert summary(store.rollups(History.DAILY)) == [(MONDAY + 2 * HOUR, 16, 16), (MONDAY + DAY + HOUR, 30, 30)]
+    assert summary(store.window(5)) == [(MONDAY + 2 * DAY + HOUR, 40, 40)]
+    assert store.rollups(History.WEEKLY) == []
+
+def test_days_roll_into_weeks(store):
+    fill(store, [(0, 1, 10), (0, 3, 20), (1, 1, 30), (8, 1, 40), (9, 1, 50), (9, 2, 60)])
+    store.trim(1, days=3, weeks=4)
+
+    # days before the cutoff (three days before the latest run's day)
+    # are summed into their week; later ones stay daily
+    weekly = store.rollups(History.WEEKLY)
+    assert summary(weekly) == [(MONDAY + (1 + 3 + 25) * HOUR / 3, 20, 20)]
+    assert History.period_start(History.WEEKLY, weekly[0].run_date) == MONDAY
+    assert summary(store.rollups(History.DAILY)) == [(MONDAY + 8 * DAY + HOUR, 40, 40), (MONDAY + 9 * DAY + HOUR, 50, 50)]
+    assert summary(store.window(5)) == [(MONDAY + 9 * DAY + 2 * HOUR, 60, 60)]
+
+    # the long view runs oldest first through every level
+    assert [run.test_count for run in store.trend(1)] == [20, 40, 50, 60]
+
+def test_rollups_accumulate_across_trims(store):
+    fill(store, [(0, 1, 10), (0, 2, 20)])
+    store.trim(1, days=30)
+    fill(store, [(0, 3, 30)])
+    store.trim(1, days=30)
+
+    # the day's rollup gained the second expired run, not replaced by it
+    assert summary(store.rollups(History.DAILY)) == [(MONDAY + 1.5 * HOUR, 15, 15)]
+    assert summary(store.window(5)) == [(MONDAY + 3 * HOUR, 30, 30)]
+
+def test_weeks_kept(store):
+    fill(store, [(0, 1, 10), (7, 1, 20), (14, 1, 30), (21, 1, 40)])
+    store.trim(1, days=1, weeks=2)
+
+    # three weeks were rolled up; only the latest two are kept
+    assert summary(store.rollups(History.WEEKLY)) == [(MONDAY + 7 * DAY + HOUR, 20, 20), (MONDAY + 14 * DAY + HOUR, 30, 30)]
+    assert store.rollups(History.DAILY) == []
+
+def test_weeks_without_days(store):
+    fill(store, [(0, 1, 10), (2, 1, 30), (8, 1, 50)])
+    store.trim(1, weeks=4)
+
+    # with no daily level, expired runs go straight into their week
+    assert summary(store.rollups(History.WEEKLY)) == [(MONDAY + DAY + HOUR, 20, 20)]
+    assert store.rollups(History.DAILY) == []
+
+def test_trend_since(store):
+    fill(store, [(0, 1, 10), (8, 1, 20), (9, 1, 30)])
+    store.trim(1, days=30)
+
+    assert [run.test_count for run in store.trend(1, since=MONDAY + 8 * DAY)] == [20, 30]
@@ -0,0 +1,96 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: test_index                                                      #
+#                                                                         #
+# What Index.diff() reports between two runs                              #
+#-------------------------------------------------------------------------#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Index
+
+def expected(**platforms) -> dict:
+    """ 'Linux=("OK", "FAIL/OK")' -> the dump's form, Debug then Optimized """
+    return {platform: {'Debug': debug.split('/'), 'Optimized': optimized.split('/')} for platform, (debug, optimized) in platforms.items()}
+
+def index(*entries) -> Index.TestIndex:
+    """ (name, tier, disabled, expected) entries of one category """
+    builder = Index.IndexBuilder()
+    for name, tier, disabled, results in entries:
+        builder.add('webgpu_area', name, tier, disabled, results, subtest='/' in name)
+    return builder.finish()
+
+PASS = expected(Windows=('OK', 'OK'), Linux=('OK', 'OK'))
+
+def test_same_run():
+    run = index(('a', 3, False, PASS), ('b', 2, False, PASS), ('b/s', 2, False, None))
+    assert Index.diff(run, run) == Index.IndexDiff()
+
+def test_added_and_removed():
+    old = index(('a', 3, False, PASS), ('b', 3, False, PASS), ('d', 3, False, PASS))
+    new = index(('c', 3, False, PASS), ('a', 3, False, PASS), ('e', 3, False, PASS))
+
+    result = Index.diff(old, new)
+    assert result.added == ['webgpu_area/c', 'webgpu_area/e']
+    assert result.removed == ['webgpu_area/b', 'webgpu_area/d']
+    assert result.tier_changed == []
+
+def test_tier_and_disabled():
+    old = index(('a', 3, False, PASS), ('b', 3, False, PASS), ('c', 0, True, PASS))
+    new = index(('a', 2, False, PASS), ('b', 0, True, PASS), ('c', 3, False, PASS))
+
+    result = Index.diff(old, new)
+    assert result.tier_changed == [('webgpu_area/a', 3, 2)]
+    # a test that is disabled or enabled is not also reported as a tier change
+    assert result.disabled == ['webgpu_area/b']
+    assert result.enabled == ['webgpu_area/c']
+
+def test_outcomes():
+    old = index(('a', 3, False, expected(Windows=('FAIL', 'OK'), Linux=('OK', 'OK'))),
+                ('a/s', 3, False, expected(Windows=('PASS', 'PASS'), Linux=('PASS', 'PASS'))))
+    new = index(('a', 3, False, expected(Windows=('OK', 'OK'), Linux=('OK', 'FAIL/OK'))),
+                ('a/s', 3, False, expected(Windows=('FAIL', 'PASS'), Linux=('PASS', 'PASS'))))
+
+    result = Index.diff(old, new)
+    assert result.started_passing == [('webgpu_area/a', 'Windows', 'Debug')]
+    assert sorted(result.stopped_passing) == [('webgpu_area/a', 'Linux', 'Optimized'), ('webgpu_area/a/s', 'Windows', 'Debug')]
+    assert result.became_intermittent == [('webgpu_area/a', 'Linux', 'Optimized')]
+
+def test_platforms_lined_up_by_name():
+    # the same results, with platforms interned in a different order;
+    # a platform only one run has is not compared
+    old = index(('a', 3, False, expected(Windows=('OK', 'OK'), Linux=('FAIL', 'FAIL'))))
+    new = index(('a', 3, False, expected(MacOs=('FAIL', 'FAIL'), Linux=('FAIL', 'FAIL'), Windows=('OK', 'OK'))))
+    assert Index.diff(old, new) == Index.IndexDiff()
+
+    new = index(('a', 3, False, expected(Linux=('OK', 'FAIL'), Windows=('OK', 'OK'))))
+    assert Index.diff(old, new).started_passing == [('webgpu_area/a', 'Linux', 'Debug')]
+
+def test_missing_expectation():
+    # an entry with no expectation on a platform both runs have is
+    # compared as the empty outcome, which is not a pass
+    old = index(('a', 2, False, None), ('b', 2, False, PASS))
+    new = index(('a', 2, False, expected(Linux=('OK', 'FAIL'))), ('b', 2, False, PASS))
+
+    assert Index.diff(old, new).started_passing == [('webgpu_area/a', 'Linux', 'Debug')]
+    assert Index.diff(new, old).stopped_passing == [('webgpu_area/a', 'Linux', 'Debug')]
+
+def test_merged_shards_match(tmp_path):
+    entries = [('c', 3, False, expected(Linux=('OK', 'FAIL/OK'))), ('a', 2, False, PASS), ('b/s', 3, True, None), ('a/s', 2, False, PASS)]
+
+    # the index does not depend on the order of the shards it came from
+    first = Index.IndexBuilder()
+    second = Index.IndexBuilder()
+    for builder, (name, tier, disabled, results) in zip([second, first, second, first], entries):
+        builder.add('webgpu_area', name, tier, disabled, results, subtest='/' in name)
+    first.merge(second)
+    merged = first.finish()
+    assert merged == index(*entries)
+
+    file_name = str(tmp_path / 'index.bin')
+    merged.save(file_name)
+    assert Index.TestIndex.load(file_name) == merged
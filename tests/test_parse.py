@@ -0,0 +1,87 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: test_parse                                                      #
+#                                                                         #
+# Every parse mode must produce the same counters for the same dump       #
+#-------------------------------------------------------------------------#
+
+import os
+import sys
+import gzip
+import lzma
+import shutil
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Types
+import Parse
+import Table
+import Generate
+
+def counters(run_file: str, **kwargs) -> dict:
+    """ Everything a parse produces, independent of the order in which
+        platforms were interned """
+    run_info = Types.RunInfo()
+    ids = Types.Ids()
+    Parse.extract_current_run_info(run_info, run_file, ids, **kwargs)
+    return {
+        'chunk_count': run_info.chunk_count,
+        'test_count': run_info.test_count,
+        'subtest_count': run_info.subtest_count,
+        'disabled_test_count': run_info.disabled_test_count,
+        'disabled_subtest_count': run_info.disabled_subtest_count,
+        'platforms': sorted(run_info.platforms),
+        'counters': {name: {tier: {platform: getattr(run_info, name)[tier][platform] for platform in run_info.platforms}
+                            for tier in Types.TIERS[1:]} for name in Types.COUNTERS},
+        'ids': {name: sorted(value) for name, value in vars(ids).items()},
+    }
+
+@pytest.fixture(scope='module', params=[3, 5], ids=['3 platforms', '5 platforms'])
+def dumps(request, tmp_path_factory):
+    """ A generated dump, plain and compressed """
+    folder = tmp_path_factory.mktemp(f'dump{request.param}')
+    run_file = str(folder / 'dump.json')
+    Generate.generate_dump(run_file, scale=0.2, platform_count=request.param, seed=request.param)
+
+    files = {'json': run_file}
+    for suffix, opener in (('gz', gzip.open), ('xz', lzma.open)):
+        files[suffix] = f'{run_file}.{suffix}'
+        with open(run_file, 'rb') as source, opener(files[suffix], 'wb') as target:
+            shutil.copyfileobj(source, target)
+    return files
+
+MODES = {
+    'streaming': dict(streaming=True),
+    'jobs 2': dict(jobs=2),
+    'jobs 3': dict(jobs=3),
+    'jobs 4': dict(jobs=4),
+    'fast': dict(fast=True),
+    'table': dict(table=Table.ResultTable),
+    'table, jobs 3': dict(jobs=3, table=Table.ResultTable),
+}
+
+@pytest.mark.parametrize('mode', MODES)
+def test_mode_matches_default(dumps, mode):
+    # a table collects the rows of one parse, so each call needs a new one
+    kwargs = {name: value() if name == 'table' else value for name, value in MODES[mode].items()}
+    assert counters(dumps['json'], **kwargs) == counters(dumps['json'])
+
+@pytest.mark.parametrize('suffix', ['gz', 'xz'])
+@pytest.mark.parametrize('streaming', [False, True], ids=['whole', 'streaming'])
+def test_compressed_matches_plain(dumps, suffix, streaming):
+    assert counters(dumps[suffix], streaming=streaming) == counters(dumps['json'])
+
+def test_fast_outside_schema(tmp_path):
+    # a subtest field that is not properties still counts as a subtest,
+    # so a dump the fast schema does not fit must be decoded in full
+    run_file = str(tmp_path / 'dump.json')
+    Generate.generate_dump(run_file, scale=0.05)
+    with open(run_file) as f:
+        text = f.read()
+    with open(run_file, 'w') as f:
+        f.write(text.replace('"subtest:0": {', '"subtest:0": {"note": "flaky", ', 1))
+
+    assert counters(run_file, fast=True) == counters(run_file)
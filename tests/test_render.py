@@ -0,0 +1,66 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: test_render                                                     #
+#                                                                         #
+# Rendering charts over a worker pool from the run pipeline               #
+#-------------------------------------------------------------------------#
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Plot
+import Types
+import Generate
+
+# generous; a deadlocked render pool never finishes at all
+TIMEOUT = 180
+
+def process(repo: str) -> None:
+    """ One process_run() with a prior run in history, so both the run
+        charts and the tier chart are rendered, each as a pipeline task,
+        while the backend is still being imported, as in run_once() """
+    import main
+    import Profile
+    import Pipeline
+
+    options = main.make_parser().parse_args(['-R', repo, '-C', os.path.join(repo, 'cache'), '-M', '-F', '-r', '3'])
+    history = main.open_history(options)
+    try:
+        previous = Types.RunInfo()
+        previous.run_date = 1.0
+        history.append(previous, 'previous')
+
+        pipeline = Pipeline.Pipeline()
+        pipeline.add('backend', lambda: Plot.load_backend('matplotlib'))
+        pipeline.add('process', lambda: main.process_run(options, history, 'previous', 'current', Profile.Profiler()))
+        pipeline.run()
+        files = pipeline.results['process']
+    finally:
+        history.close()
+
+    # the chart code prints its own diagnostics, so mark the file list
+    print('FILES', '\t'.join(files))
+
+@pytest.mark.skipif(bool(Plot.missing_modules('matplotlib')), reason='matplotlib is not installed')
+def test_render_pool_from_pipeline(tmp_path):
+    for folder in ('data', 'images'):
+        os.makedirs(tmp_path / folder)
+    Generate.generate_dump(str(tmp_path / 'data' / 'dump.json'), scale=0.05)
+
+    # in a process of its own, so a hang fails the test instead of pytest
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), str(tmp_path)], capture_output=True, text=True, timeout=TIMEOUT)
+    assert result.returncode == 0, result.stderr
+
+    line = [line for line in result.stdout.splitlines() if line.startswith('FILES ')][-1]
+    files = line[len('FILES '):].split('\t')
+    assert os.path.join(str(tmp_path), 'images', 'Tier_Migration.png') in files
+    assert all(os.path.exists(file_name) for file_name in files)
+
+if __name__ == "__main__":
+    process(sys.argv[1])
@@ -0,0 +1,103 @@
+#-------------------------------------------------------------------------#
+# cts-tracker                                                 by Bob Hood #
+#                                                                         #
+# Module: test_server                                                     #
+#                                                                         #
+# ETags and conditional requests of the metrics endpoint                  #
+#-------------------------------------------------------------------------#
+
+import os
+import sys
+import json
+import threading
+import http.client
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Types
+import History
+import Server
+
+def run(run_date: float, tests: int) -> Types.RunInfo:
+    run_info = Types.RunInfo(run_date=run_date, test_count=tests)
+    run_info.test_tier_count['Tier 3']['Linux'] = tests
+    return run_info
+
+@pytest.fixture
+def served(tmp_path):
+    history = History.HistoryStore(str(tmp_path / 'history.db'))
+    history.append(run(1.0, 10), 'first')
+
+    server = Server.MetricsServer(('127.0.0.1', 0), Server.MetricsCache(history, 5))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server, history
+
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    history.close()
+
+def request(server, path: str, method: str = 'GET', **headers) -> http.client.HTTPResponse:
+    connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+    connection.request(method, path, headers={name.replace('_', '-'): value for name, value in headers.items()})
+    response = connection.getresponse()
+    response.body = response.read()
+    connection.close()
+    return response
+
+def test_etag(served):
+    server, history = served
+    first = request(server, '/latest')
+    assert first.status == 200
+    assert json.loads(first.body)['digest'] == 'first'
+    etag = first.getheader('ETag')
+    assert etag.startswith('"') and etag.endswith('"')
+    assert first.getheader('Cache-Control') == 'no-cache'
+
+    # the same document keeps its tag
+    assert request(server, '/latest').getheader('ETag') == etag
+    assert request(server, '/history').getheader('ETag') != etag
+
+@pytest.mark.parametrize('tags', ['{etag}', 'W/{etag}', '"other", {etag}', '*'], ids=['strong', 'weak', 'list', 'any'])
+def test_not_modified(served, tags):
+    server, history = served
+    etag = request(server, '/latest').getheader('ETag')
+
+    response = request(server, '/latest', If_None_Match=tags.format(etag=etag))
+    assert response.status == 304
+    assert response.getheader('ETag') == etag
+    assert response.body == b''
+
+def test_stale_tag(served):
+    server, history = served
+    etag = request(server, '/latest').getheader('ETag')
+    assert request(server, '/latest', If_None_Match='"other"').status == 200
+
+    # a new dump in history changes the document, and so its tag
+    history.append(run(2.0, 20), 'second')
+    response = request(server, '/latest', If_None_Match=etag)
+    assert response.status == 200
+    assert response.getheader('ETag') != etag
+    assert json.loads(response.body)['test_count'] == 20
+
+def test_head(served):
+    server, history = served
+    get = request(server, '/counters?tier=Tier+3&platform=Linux')
+    head = request(server, '/counters?tier=Tier+3&platform=Linux', 'HEAD')
+
+    assert head.status == 200
+    assert head.getheader('ETag') == get.getheader('ETag')
+    assert head.getheader('Content-Length') == str(len(get.body))
+    assert head.body == b''
+    assert json.loads(get.body)['test_tier_count'] == {'Tier 3': {'Linux': 10}}
+
+def test_errors(served):
+    server, history = served
+    for path, status in (('/nowhere', 404), ('/history?count=0', 400), ('/counters?tier=Tier+9', 400)):
+        response = request(server, path)
+        assert response.status == status
+        assert 'error' in json.loads(response.body)
+        assert response.getheader('ETag') is None